@@ -0,0 +1,303 @@
+""" Benchmarks of the hot paths of the control graph, run under CPython on
+    the host stand-ins with a VirtualClock so that no timer fires on its own.
+
+    Each benchmark is a setup function returning an event callable. Time
+    per event is the best of several repeats. Allocations are measured with
+    tracemalloc: bytes and blocks still allocated per event afterwards, the
+    transient bytes allocated during a single event beyond the iterators of
+    its for loops, and the peak of transient allocations during the run.
+
+    The benchmarks in ALLOCATION_FREE must not allocate at all, which is
+    what keeps the garbage collector of the device out of the way. """
+
+import gc
+import itertools
+import time
+import tracemalloc
+from functools import partial
+
+import host
+from sim.clock import VirtualClock
+
+BENCHMARKS = {}
+ALLOCATION_FREE = ('notify_fanout', 'value_setter', 'scheduler_throughput', 'scheduler_coalescing',
+                   'controller_update', 'sensor_criterion_update', 'graph_tick', 'plan_tick', 'dosing_tick')
+# sensor_tick only allocates the ints of the calibration above 256, which CPython boxes but Micropython does not
+NESTED_LOOPS = {'plan_tick': 2}  # For loops in progress at once, 1 if not listed
+
+
+def benchmark(function):
+    BENCHMARKS[function.__name__] = function
+    return function
+
+
+def _fresh_scheduler(capacity: int = 128):  # Slots below 257 are cached ints in CPython, as all small ints in Micropython
+    from observable import Observable
+    from scheduler import Scheduler
+    Observable.scheduler = Scheduler(capacity)
+    return Observable.scheduler
+
+
+@benchmark
+def notify_fanout():
+    """ Observable.notify calling 8 subscribers directly. """
+    from observable import Observable
+    observable = Observable('fanout')
+    for i in range(8):
+        observable.subscribe(lambda obs: None)
+    return observable.notify
+
+
+@benchmark
+def value_setter():
+    """ ObservableValue.value setter posting one deferred callback, and draining it. """
+    from observable import Observable, ObservableValue
+    scheduler = _fresh_scheduler()
+    value = ObservableValue('value')
+    value.subscribe(lambda obs: None)
+
+    def event():
+        value.value = 1
+        scheduler.run()
+    return event
+
+
+@benchmark
+def scheduler_throughput():
+    """ Posting 64 distinct callbacks to the Scheduler and draining them. """
+    from scheduler import Deferred
+    scheduler = _fresh_scheduler(64)
+    deferreds = [Deferred(lambda arg: None) for i in range(64)]
+
+    def event():
+        for deferred in deferreds:
+            scheduler.post(deferred)
+        scheduler.run()
+    return event
+
+
+@benchmark
+def scheduler_coalescing():
+    """ Posting the same callback 64 times, which coalesces into one entry, and draining it. """
+    from scheduler import Deferred
+    scheduler = _fresh_scheduler(64)
+    deferred = Deferred(lambda arg: None)
+    args = tuple(range(64))
+
+    def event():
+        for arg in args:
+            scheduler.post(deferred, arg)
+        scheduler.run()
+    return event
+
+
+@benchmark
+def controller_update():
+    """ Controller.update with three valid criteria. """
+    from controller import Controller
+    from criteria import ObservableValueCriterion
+    _fresh_scheduler()
+    controller = Controller()
+    for i in range(3):
+        criterion = ObservableValueCriterion(f'criterion{i}')
+        criterion.value = True
+        controller.add_criterion(criterion)
+    return lambda: controller.update(controller)
+
+
+@benchmark
+def sensor_criterion_update():
+    """ SensorCriterion.update with always_notify, as used for pumping. """
+    from criteria import SensorCriterion
+    from machine import Pin
+    from sensor import MoistureSensor
+    _fresh_scheduler()
+    sensor = MoistureSensor(Pin(26), 'Moisture')
+    sensor.sample(50_000)
+    criterion = SensorCriterion(sensor, max_value=75.0, always_notify=True)
+    return lambda: criterion.update(sensor)
+
+
+@benchmark
+def sensor_tick():
+    """ One sensor reading through a whole Irrigation in the draining state. """
+    irrigation, sensor, pump, scheduler = _irrigation()
+    wet = _reading(50.0)
+
+    def event():
+        sensor.sample(wet)
+        scheduler.run()
+    return event
+
+
+@benchmark
+def graph_tick():
+    """ As sensor_tick, but with a Sensor handing over the reading as is rather than calibrated. """
+    from sensor import Sensor
+    irrigation, sensor, pump, scheduler = _irrigation(Sensor)
+    wet = 50
+
+    def event():
+        sensor.sample(wet)
+        scheduler.run()
+    return event
+
+
+@benchmark
+def plan_tick():
+    """ As graph_tick, with the graph compiled into a Plan. """
+    from plan import Plan
+    from sensor import Sensor
+    irrigation, sensor, pump, scheduler = _irrigation(Sensor)
+    Plan([sensor])
+    wet = 50
+
+    def event():
+        sensor.sample(wet)
+        scheduler.run()
+    return event
+
+
+@benchmark
+def dosing_tick():
+    """ As graph_tick, with the pump started by a DosingCriterion. """
+    from sensor import Sensor
+    irrigation, sensor, pump, scheduler = _irrigation(Sensor, dosing=True)
+    wet = 50
+
+    def event():
+        sensor.sample(wet)
+        scheduler.run()
+    return event
+
+
+@benchmark
+def irrigation_cycle():
+    """ A full Irrigation cycle: dry reading to watering with a pump start, wet reading back to draining. """
+    irrigation, sensor, pump, scheduler = _irrigation()
+    dry, wet = _reading(10.0), _reading(90.0)
+
+    def event():
+        sensor.sample(dry)
+        scheduler.run()
+        sensor.sample(wet)
+        scheduler.run()
+        pump.stop()
+    return event
+
+
+@benchmark
+def zones_tick():
+    """ One tick of a Zones engine of 256 zones, in array operations with numpy if installed. """
+    return _zones(vectorized=True)
+
+
+@benchmark
+def zones_loop_tick():
+    """ As zones_tick, in the loop over the zones run on Micropython. """
+    return _zones(vectorized=False)
+
+
+def _zones(vectorized: bool, count: int = 256):
+    import config
+    import zones
+    from machine import Pin
+    from sensor import Sensor
+    _fresh_scheduler()
+    sensors = [Sensor(Pin(26), 'Moisture') for i in range(count)]
+    for i, sensor in enumerate(sensors):
+        sensor.sample(40 + i % 30)  # Within the range, so every zone keeps draining
+    pump_config = {key: value for key, value in config.pump_config.items()
+                   if key in ('pump_duration', 'pump_cap_window')}
+    engine = zones.Zones([f'Zone{i}' for i in range(count)], sensors, [Pin(i, Pin.OUT) for i in range(count)],
+                         None, echo=False, period=0, pump_cap_time=1 << 30, vectorized=vectorized,
+                         **pump_config, **config.humidity_config)
+    engine.start()
+    engine.tick()
+    return engine.tick
+
+
+def _reading(humidity: float) -> int:
+    import config
+    low, high = config.sensor_config['min_reading'], config.sensor_config['max_reading']
+    return int(high - humidity / 100 * (high - low))
+
+
+def _irrigation(sensor_class=None, dosing: bool = False):
+    import config
+    from irrigation import Irrigation
+    from machine import Pin
+    from pump import Pump
+    from sensor import MoistureSensor
+    scheduler = _fresh_scheduler()
+    if sensor_class:
+        sensor = sensor_class(Pin(26), 'Moisture')
+    else:
+        sensor = MoistureSensor(Pin(26), 'Moisture', **{**config.sensor_config, 'stuck_samples': 0})  # The reading never changes
+    pump = Pump(Pin(2, Pin.OUT), name='Pump')
+    pump_config = {**config.pump_config, 'pump_cap_time': 1 << 60, 'pump_dosing': dosing}
+    irrigation = Irrigation('Bench', sensor, pump, None, echo=False, **pump_config, **config.humidity_config)
+    irrigation.start()
+    scheduler.run()
+    return irrigation, sensor, pump, scheduler
+
+
+def _transient(event) -> int:
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.reset_peak()
+    event()
+    return tracemalloc.get_traced_memory()[1] - current
+
+
+def _loops(depth: int = 1, items=(None,)) -> None:
+    for item in items:  # CPython allocates the iterator, which Micropython keeps on the stack
+        if depth > 1:
+            _loops(depth - 1)
+
+
+def measure(name: str, events: int = 10_000, repeat: int = 5) -> dict:
+    event = BENCHMARKS[name]()
+    for i in range(min(events, 100)):  # Warm up, e.g. fill caches and free lists
+        event()
+    best = None
+    gc.disable()
+    try:
+        for r in range(repeat):
+            start = time.perf_counter_ns()
+            for i in range(events):
+                event()
+            elapsed = time.perf_counter_ns() - start
+            best = elapsed if best is None else min(best, elapsed)
+    finally:
+        gc.enable()
+    gc.collect()
+    gc.disable()  # A collection would free unrelated memory during the measurement
+    tracemalloc.start()
+    try:
+        loops = partial(_loops, NESTED_LOOPS.get(name, 1))
+        _transient(loops)  # Warm up
+        transient = max(0, _transient(event) - _transient(loops))
+        before = tracemalloc.take_snapshot()
+        current, _ = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        for _ in itertools.repeat(None, events):  # Unlike range, no int is left allocated
+            event()
+        after_current, peak = tracemalloc.get_traced_memory()
+        after = tracemalloc.take_snapshot()
+    finally:
+        tracemalloc.stop()
+        gc.enable()
+    own = (tracemalloc.Filter(False, tracemalloc.__file__), tracemalloc.Filter(False, __file__))  # Not the measurement
+    blocks = sum(stat.count_diff for stat in after.filter_traces(own).compare_to(before.filter_traces(own), 'filename'))
+    return {
+        'ns_per_event': round(best / events, 1),
+        'bytes_per_event': round((after_current - current) / events, 2),
+        'blocks_per_event': round(blocks / events, 3),
+        'transient_bytes': transient,
+        'peak_bytes': peak - current,
+    }
+
+
+def run(names=None, events: int = 10_000, repeat: int = 5) -> dict:
+    host.install(VirtualClock())
+    return {name: measure(name, events, repeat) for name in (names or BENCHMARKS)}
@@ -0,0 +1,78 @@
+""" Runs the benchmarks, compares them with the last saved run and
+    optionally appends the results to the history. Exits with 1 on a
+    regression, or if a benchmark in ALLOCATION_FREE allocates:
+
+    python -m bench --save
+    python -m bench notify_fanout sensor_tick --events 100000 """
+
+import argparse
+import datetime
+import json
+import os
+import subprocess
+import sys
+
+from . import ALLOCATION_FREE, BENCHMARKS, run
+
+HISTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'history.jsonl')
+
+
+def revision() -> str:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(HISTORY), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ''
+
+
+def last_run(path: str) -> dict:
+    try:
+        with open(path) as f:
+            lines = [line for line in f if line.strip()]
+    except OSError:
+        return {}
+    return json.loads(lines[-1])['results'] if lines else {}
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(prog='python -m bench', description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('names', nargs='*', choices=[[]] + list(BENCHMARKS), metavar='NAME',
+                        help=f'benchmarks to run, all by default: {", ".join(BENCHMARKS)}')
+    parser.add_argument('--events', type=int, default=10_000)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--history', default=HISTORY, help='JSON lines file of earlier runs')
+    parser.add_argument('--save', action='store_true', help='append the results to the history')
+    parser.add_argument('--tolerance', type=float, default=0.10,
+                        help='relative slowdown reported as a regression')
+    args = parser.parse_args()
+
+    previous = last_run(args.history)
+    results = run(args.names, args.events, args.repeat)
+    regressions = 0
+    print(f'{"benchmark":<24}{"ns/event":>12}{"change":>9}{"bytes/event":>13}{"blocks/event":>14}'
+          f'{"transient":>11}{"peak bytes":>12}')
+    for name, result in results.items():
+        change = ''
+        before = previous.get(name)
+        if before:
+            ratio = result['ns_per_event'] / before['ns_per_event'] - 1
+            change = f'{100 * ratio:+.0f}%'
+            if ratio > args.tolerance or result['blocks_per_event'] > before['blocks_per_event']:
+                change += ' !'
+                regressions += 1
+        if name in ALLOCATION_FREE and (result['blocks_per_event'] or result['transient_bytes']):
+            change += ' alloc'
+            regressions += 1
+        print(f'{name:<24}{result["ns_per_event"]:>12.1f}{change:>9}{result["bytes_per_event"]:>13.2f}'
+              f'{result["blocks_per_event"]:>14.3f}{result.get("transient_bytes", ""):>11}{result["peak_bytes"]:>12}')
+    if args.save:
+        entry = {'time': datetime.datetime.now().isoformat(timespec='seconds'), 'revision': revision(),
+                 'python': sys.version.split()[0], 'events': args.events, 'results': results}
+        with open(args.history, 'a') as f:
+            f.write(json.dumps(entry) + '\n')
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,16 @@
+""" Collects the telemetry of a fleet of boards on the host and answers
+    queries across all zones. Runs under CPython and needs numpy, unlike
+    the device code.
+
+    The Collector subscribes to <zone>/<name> on the broker, as published
+    by the device, and appends the values to a ColumnStore of memory-mapped
+    columns per topic. Fleet answers queries such as the daily pump time of
+    every zone with array operations over all of them at once. A fleet is
+    synthesized through a LocalBroker and queried by:
+
+    python -m collector --zones 2000 --days 2 """
+
+from .broker import BrokerClient, LocalBroker  # noqa: F401
+from .collector import Collector  # noqa: F401
+from .queries import Fleet  # noqa: F401
+from .store import ColumnStore  # noqa: F401
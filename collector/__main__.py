@@ -0,0 +1,111 @@
+""" Synthesizes the telemetry of a fleet, publishes it through a LocalBroker
+    to a Collector, queries it and checks the answers against the fleet:
+
+    python -m collector --zones 2000 --days 2 --store /tmp/fleet """
+
+import argparse
+import random
+import tempfile
+import time
+
+import numpy as np
+
+from .broker import LocalBroker
+from .collector import Collector
+from .queries import DAY, Fleet
+from .store import ColumnStore
+
+
+class Zone:
+
+    """ A zone drying linearly and watered back up, publishing like the
+        device: the humidity on Moisture(<zone>), the pump time as a running
+        sum on Sum(Pump) and the state on the name of the zone. """
+
+    def __init__(self, name: str, client, rng: random.Random) -> None:
+        self.name = name
+        self._client = client
+        self._drying = rng.uniform(0.5, 2.0)  # % per hour
+        self._low = rng.uniform(45, 55)
+        self.humidity = rng.uniform(50, 80)
+        self.pump_sum = 0
+        self.pump_ms = {}  # Day -> ms
+        self.cycles = 0
+        self.in_band = []  # Whether each published humidity was within 50-70 %
+
+    def step(self, now: int, period: int) -> None:
+        topic = self.name.encode()
+        if self.humidity < self._low:
+            self._client.publish(topic + b'/' + topic, b'Watering')
+            self.cycles += 1
+            duration = int(1_000 * (75 - self.humidity))
+            self.pump_sum += duration
+            self.pump_ms[now // DAY] = self.pump_ms.get(now // DAY, 0) + duration
+            self._client.publish(topic + b'/Sum(Pump)', str(self.pump_sum).encode())
+            self.humidity = 75.0
+            self._client.publish(topic + b'/' + topic, b'Draining')
+        self._client.publish(topic + b'/Moisture(' + topic + b')', f'{self.humidity:.1f}'.encode())
+        self.in_band.append(50 <= round(self.humidity, 1) <= 70)
+        self.humidity -= self._drying * period / 3_600_000
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(prog='python -m collector', description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--zones', type=int, default=1_000)
+    parser.add_argument('--days', type=float, default=1.0)
+    parser.add_argument('--period', type=int, default=10 * 60 * 1_000, help='ms between published readings')
+    parser.add_argument('--store', help='directory of the ColumnStore, a temporary one by default')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as temporary:
+        store = ColumnStore(args.store or temporary)
+        broker = LocalBroker()
+        now = 0
+        collector = Collector(store, broker.client(b'collector'), clock=lambda: now)
+        collector.start()
+        board = broker.client(b'fleet')
+        rng = random.Random(args.seed)
+        zones = [Zone(f'Zone{i:05}', board, rng) for i in range(args.zones)]
+
+        start = time.perf_counter()
+        steps = int(args.days * DAY) // args.period
+        for step in range(steps):
+            now = step * args.period
+            for zone in zones:
+                zone.step(now, args.period)
+            collector.poll()
+        elapsed = time.perf_counter() - start
+        print(f'Collected {collector.stored} values of {args.zones} zones over {args.days} days '
+              f'in {elapsed:.1f} s, {collector.stored / elapsed:,.0f} values/s with publishing')
+
+        fleet = Fleet(store)
+        for query, call in (('daily_pump_ms', fleet.daily_pump_ms),
+                            ('time_in_band', lambda: fleet.time_in_band(50, 70)),
+                            ('watering_cycles', fleet.watering_cycles)):
+            start = time.perf_counter()
+            call()
+            loaded = time.perf_counter() - start
+            start = time.perf_counter()
+            call()
+            print(f'{query:>16}: {(time.perf_counter() - start) * 1_000:8.2f} ms, '
+                  f'{loaded * 1_000:8.2f} ms with loading the columns')
+
+        by_name = {zone.name: zone for zone in zones}
+        names, first_day, pump_ms = fleet.daily_pump_ms()
+        expected = np.zeros_like(pump_ms)
+        for row, name in enumerate(names):
+            for day, ms in by_name[name].pump_ms.items():
+                expected[row, day - first_day // DAY] = ms
+        names, in_band = fleet.time_in_band(50, 70)
+        expected_band = np.array([sum(by_name[name].in_band[:-1]) / (steps - 1) for name in names])
+        names, cycles = fleet.watering_cycles()
+        expected_cycles = np.array([by_name[name].cycles for name in names])
+        print(f'daily pump ms {"match" if np.array_equal(pump_ms, expected) else "DIFFER"}, '
+              f'time in band {"matches" if np.allclose(in_band, expected_band) else "DIFFERS"}, '
+              f'watering cycles {"match" if np.array_equal(cycles, expected_cycles) else "DIFFER"}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,112 @@
+""" An in-process MQTT broker stand-in for running the collector and the
+    device code against each other without a network. """
+
+from __future__ import annotations
+
+from collections import deque
+
+
+def matches(topic_filter: bytes, topic: bytes) -> bool:
+    """ Whether topic matches topic_filter, with the + and # wildcards. """
+    levels = topic.split(b'/')
+    filters = topic_filter.split(b'/')
+    if topic.startswith(b'$') and filters[0] in (b'+', b'#'):
+        return False
+    for i, level in enumerate(filters):
+        if level == b'#':
+            return True
+        if i == len(levels) or (level != b'+' and level != levels[i]):
+            return False
+    return len(filters) == len(levels)
+
+
+class LocalBroker:
+
+    """ Routes published messages to the subscribed BrokerClients, keeping
+        the last retained message per topic. """
+
+    def __init__(self) -> None:
+        self._clients = []
+        self._retained = {}
+        self.published = 0
+
+    def client(self, client_id=b'') -> BrokerClient:
+        return BrokerClient(self, client_id)
+
+    def _connect(self, client: BrokerClient) -> None:
+        if client not in self._clients:
+            self._clients.append(client)
+
+    def _disconnect(self, client: BrokerClient) -> None:
+        if client in self._clients:
+            self._clients.remove(client)
+
+    def _subscribe(self, client: BrokerClient, topic_filter: bytes) -> None:
+        for topic, msg in self._retained.items():
+            if matches(topic_filter, topic):
+                client._queue.append((topic, msg))
+
+    def publish(self, topic, msg, retain: bool = False) -> None:
+        topic = topic.encode() if isinstance(topic, str) else bytes(topic)
+        msg = msg.encode() if isinstance(msg, str) else bytes(msg)
+        self.published += 1
+        if retain:
+            self._retained[topic] = msg
+        for client in self._clients:
+            if any(matches(topic_filter, topic) for topic_filter in client._filters):
+                client._queue.append((topic, msg))
+
+
+class BrokerClient:
+
+    """ A client of a LocalBroker with the interface of umqtt.simple's
+        MQTTClient. Messages are queued until check_msg or wait_msg. """
+
+    def __init__(self, broker: LocalBroker, client_id=b'', keepalive: int = 0) -> None:
+        self._broker = broker
+        self.client_id = client_id
+        self.keepalive = keepalive
+        self._callback = None
+        self._filters = []
+        self._queue = deque()
+
+    def set_callback(self, callback) -> None:
+        self._callback = callback
+
+    def connect(self, clean_session: bool = True) -> int:
+        self._broker._connect(self)
+        return 0
+
+    def disconnect(self) -> None:
+        self._broker._disconnect(self)
+
+    def ping(self) -> None:
+        pass
+
+    def publish(self, topic, msg, retain: bool = False, qos: int = 0) -> None:
+        self._broker.publish(topic, msg, retain)
+
+    def subscribe(self, topic, qos: int = 0) -> None:
+        topic_filter = topic.encode() if isinstance(topic, str) else bytes(topic)
+        if topic_filter not in self._filters:
+            self._filters.append(topic_filter)
+        self._broker._subscribe(self, topic_filter)
+
+    def pending(self) -> int:
+        return len(self._queue)
+
+    def check_msg(self) -> None:
+        """ Delivers one queued message, if any. """
+        if self._queue and self._callback:
+            self._callback(*self._queue.popleft())
+
+    def wait_msg(self) -> None:
+        self.check_msg()
+
+    def drain(self) -> int:
+        """ Delivers all queued messages. Returns how many. """
+        count = 0
+        while self._queue and self._callback:
+            self._callback(*self._queue.popleft())
+            count += 1
+        return count
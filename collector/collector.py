@@ -0,0 +1,117 @@
+""" Subscribes to the telemetry of the boards and stores it. """
+
+from __future__ import annotations
+
+import json
+import time
+
+import numpy as np
+
+
+class Collector:
+
+    """ Collects the values the boards publish on <zone>/<name>, such as
+        Gurka/Moisture(Gurka), Gurka/Sum(Pump) and the state on Gurka/Gurka,
+        and the batches an Outbox publishes on <zone>/batch, into a
+        ColumnStore. Messages are stamped with the time received and
+        buffered, and parsed a batch at a time per topic: numeric payloads
+        in one vectorized conversion, others one by one into symbols. The
+        diagnostics and history responses and the pump and config commands
+        sent to the boards are not telemetry and skipped.
+
+        Values an Uplink replays after a disconnection arrive on
+        <zone>/<name>/replay as '<age> <value>' and are stamped with the time
+        they were logged. Those logged before a restart of the board have no
+        age and are counted in undated instead. """
+
+    SKIPPED = ('diag', 'history', 'Pump', 'config')
+
+    def __init__(self, store: ColumnStore, client, topic_filter: bytes = b'+/+', batch: int = 4096,
+                 clock=None) -> None:
+        self.store = store
+        self._client = client
+        self._topic_filter = topic_filter
+        self._batch = batch
+        self._clock = clock or (lambda: int(time.time() * 1_000))
+        self._pending = []  # (ms, topic, payload)
+        self.received = 0
+        self.stored = 0
+        self.undated = 0
+
+    def start(self) -> None:
+        self._client.set_callback(self._received)
+        self._client.connect()
+        self._client.subscribe(self._topic_filter)
+        if not self._topic_filter.endswith(b'#'):
+            self._client.subscribe(self._topic_filter + b'/replay')
+
+    def _received(self, topic: bytes, msg: bytes) -> None:
+        self._pending.append((self._clock(), topic, msg))
+        self.received += 1
+        if len(self._pending) >= self._batch:
+            self.flush()
+
+    def flush(self) -> int:
+        """ Parses and stores the buffered messages. Returns how many rows
+            were stored. """
+        pending, self._pending = self._pending, []
+        topics = {}
+        for ms, topic, msg in pending:
+            zone, _, name = topic.decode().partition('/')
+            if name.endswith('/replay'):
+                name = name[:-7]
+                age, _, msg = msg.partition(b' ')
+                try:
+                    age = int(age)
+                except ValueError:
+                    continue
+                if age < 0:
+                    self.undated += 1
+                    continue
+                ms -= age
+            if name in Collector.SKIPPED:
+                continue
+            if name == 'batch':
+                try:
+                    values = json.loads(msg)
+                except ValueError:
+                    continue
+                for key, value in values.items():
+                    entry = topics.setdefault((zone, key), ([], []))
+                    entry[0].append(ms)
+                    entry[1].append(value if isinstance(value, str) else json.dumps(value).encode())
+                continue
+            entry = topics.setdefault((zone, name), ([], []))
+            entry[0].append(ms)
+            entry[1].append(msg)
+        stored = 0
+        for (zone, name), (times, payloads) in topics.items():
+            values = self._parse(payloads)
+            self.store.append(zone, name, np.array(times, dtype=np.int64), values)
+            stored += len(times)
+        self.stored += stored
+        return stored
+
+    def _parse(self, payloads: list) -> np.ndarray:
+        try:
+            return np.array(payloads, dtype=np.bytes_).astype(np.float64)
+        except (ValueError, TypeError):
+            pass
+        values = np.empty(len(payloads), dtype=np.float64)
+        for i, payload in enumerate(payloads):
+            text = payload.decode() if isinstance(payload, (bytes, bytearray)) else payload
+            try:
+                values[i] = float(text)
+            except ValueError:
+                values[i] = self.store.symbol(text)
+        return values
+
+    def poll(self) -> int:
+        """ Receives what the client has queued and stores it. """
+        received = self.received
+        if hasattr(self._client, 'drain'):
+            self._client.drain()
+        else:
+            self._client.check_msg()
+        self.flush()
+        return self.received - received
@@ -0,0 +1,92 @@
+""" Vectorized queries over the series of all zones in a ColumnStore. """
+
+from __future__ import annotations
+
+import numpy as np
+
+DAY = 24 * 60 * 60 * 1_000
+
+
+class Fleet:
+
+    """ Answers queries across all zones of a ColumnStore. The series of
+        one kind for every zone are loaded once into concatenated columns
+        with a zone index, so each query is a handful of array operations
+        over all zones at once rather than a loop over them. refresh loads
+        them again after more has been stored.
+
+        The series are found by the names the device publishes them under:
+        the pump time on Sum(Pump), the state on the name of the zone and
+        the humidity on the names starting with Moisture. """
+
+    def __init__(self, store: ColumnStore, pump: str = 'Sum(Pump)', moisture: str = 'Moisture') -> None:
+        self.store = store
+        self._pump = pump
+        self._moisture = moisture
+        self._columns = {}
+
+    def refresh(self) -> None:
+        self._columns = {}
+
+    def _series(self, kind: str) -> tuple:
+        if kind not in self._columns:
+            names = {}
+            for zone in self.store.zones():
+                if kind == 'state':
+                    name = zone
+                elif kind == 'pump':
+                    name = self._pump
+                else:
+                    name = next((n for n in self.store.names(zone) if n.startswith(self._moisture)), None)
+                if name is not None:
+                    names[zone] = name
+            self._columns[kind] = self.store.columns(names)
+        return self._columns[kind]
+
+    @staticmethod
+    def _first(index: np.ndarray) -> np.ndarray:
+        """ Whether each row is the first of its zone. """
+        first = np.ones(len(index), dtype=bool)
+        first[1:] = index[1:] != index[:-1]
+        return first
+
+    def daily_pump_ms(self) -> tuple:
+        """ The pump time per zone and day, as the zones, the first day in
+            ms since the epoch and an array of zones by days. The pump time
+            is published as a running sum, so the increments are summed,
+            counting the value itself where the sum was reset. """
+        zones, index, times, values = self._series('pump')
+        if not len(times):
+            return zones, 0, np.zeros((0, 0))
+        increments = np.diff(values, prepend=0.0)
+        reset = self._first(index) | (increments < 0)
+        increments[reset] = values[reset]
+        first_day = times.min() // DAY
+        days = times // DAY - first_day
+        width = int(days.max()) + 1
+        totals = np.bincount(index * width + days, weights=increments, minlength=len(zones) * width)
+        return zones, int(first_day * DAY), totals.reshape(len(zones), width)
+
+    def time_in_band(self, low: float, high: float) -> tuple:
+        """ The fraction of time each zone's humidity was within [low, high],
+            each value holding until the next. """
+        zones, index, times, values = self._series('moisture')
+        if not len(times):
+            return zones, np.zeros(0)
+        held = np.diff(times, append=times[-1]).astype(np.float64)
+        last = np.ones(len(index), dtype=bool)
+        last[:-1] = index[1:] != index[:-1]
+        held[last] = 0.0  # The last value of a zone holds for an unknown time
+        inside = (values >= low) & (values <= high)
+        total = np.bincount(index, weights=held, minlength=len(zones))
+        within = np.bincount(index, weights=held * inside, minlength=len(zones))
+        return zones, np.divide(within, total, out=np.zeros(len(zones)), where=total > 0)
+
+    def watering_cycles(self, state: str = 'Watering') -> tuple:
+        """ The number of times each zone started watering. """
+        zones, index, times, values = self._series('state')
+        if not len(times):
+            return zones, np.zeros(0, dtype=np.int64)
+        watering = values == self.store.symbol(state)
+        started = watering & (self._first(index) | ~np.roll(watering, 1))
+        return zones, np.bincount(index, weights=started, minlength=len(zones)).astype(np.int64)
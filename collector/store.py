@@ -0,0 +1,131 @@
+""" Columnar storage of the time series of many zones. """
+
+import os
+from urllib.parse import quote, unquote
+
+import numpy as np
+
+TIME = np.dtype('<i8')  # ms since the epoch
+VALUE = np.dtype('<f8')
+
+
+class ColumnStore:
+
+    """ Time series stored per topic <zone>/<name> in a directory of its
+        own, as segments of two columns: the times in <n>.t and the values
+        in <n>.v. New rows are appended to the newest segment until it
+        holds segment_rows, and read back as memory-mapped arrays, so a
+        query only touches the columns it needs.
+
+        Values that are not numbers, such as the state of a zone, are
+        stored as the index of the string in symbols.txt. """
+
+    def __init__(self, root: str, segment_rows: int = 1 << 20) -> None:
+        self.root = root
+        self.segment_rows = segment_rows
+        os.makedirs(root, exist_ok=True)
+        self._symbols = {}
+        self._names = []
+        self._rows = {}  # Topic -> rows in its newest segment
+        try:
+            with open(self._symbols_path()) as f:
+                for line in f:
+                    self._symbols[line[:-1]] = len(self._names)
+                    self._names.append(line[:-1])
+        except OSError:
+            pass
+
+    def _symbols_path(self) -> str:
+        return os.path.join(self.root, 'symbols.txt')
+
+    def _dir(self, zone: str, name: str) -> str:
+        return os.path.join(self.root, quote(zone, safe=''), quote(name, safe='()'))
+
+    def symbol(self, name: str) -> int:
+        try:
+            return self._symbols[name]
+        except KeyError:
+            pass
+        with open(self._symbols_path(), 'a') as f:
+            f.write(name + '\n')
+        self._symbols[name] = len(self._names)
+        self._names.append(name)
+        return self._symbols[name]
+
+    def symbol_name(self, symbol: int) -> str:
+        return self._names[int(symbol)]
+
+    def zones(self) -> list:
+        return sorted(unquote(zone) for zone in os.listdir(self.root)
+                      if os.path.isdir(os.path.join(self.root, zone)))
+
+    def names(self, zone: str) -> list:
+        directory = os.path.join(self.root, quote(zone, safe=''))
+        return sorted(unquote(name) for name in os.listdir(directory))
+
+    def _segments(self, directory: str) -> list:
+        try:
+            return sorted(int(file[:-2]) for file in os.listdir(directory) if file.endswith('.t'))
+        except OSError:
+            return []
+
+    def append(self, zone: str, name: str, times: np.ndarray, values: np.ndarray) -> None:
+        """ Appends rows to the series of the topic, in time order. """
+        directory = self._dir(zone, name)
+        topic = (zone, name)
+        times = np.asarray(times, dtype=TIME)
+        values = np.asarray(values, dtype=VALUE)
+        if topic not in self._rows:
+            os.makedirs(directory, exist_ok=True)
+            segments = self._segments(directory)
+            segment = segments[-1] if segments else 0
+            path = os.path.join(directory, f'{segment}.t')
+            self._rows[topic] = (segment, os.path.getsize(path) // TIME.itemsize if segments else 0)
+        start = 0
+        while start < len(times):
+            segment, rows = self._rows[topic]
+            if rows == self.segment_rows:
+                segment, rows = segment + 1, 0
+            n = min(len(times) - start, self.segment_rows - rows)
+            base = os.path.join(directory, str(segment))
+            with open(base + '.t', 'ab') as f:
+                f.write(times[start:start + n].tobytes())
+            with open(base + '.v', 'ab') as f:
+                f.write(values[start:start + n].tobytes())
+            self._rows[topic] = (segment, rows + n)
+            start += n
+
+    def read(self, zone: str, name: str) -> tuple:
+        """ The times and values of the topic, memory-mapped if held in a
+            single segment and concatenated otherwise. """
+        directory = self._dir(zone, name)
+        times, values = [], []
+        for segment in self._segments(directory):
+            base = os.path.join(directory, str(segment))
+            if not os.path.getsize(base + '.t'):
+                continue
+            times.append(np.memmap(base + '.t', dtype=TIME, mode='r'))
+            values.append(np.memmap(base + '.v', dtype=VALUE, mode='r')[:len(times[-1])])
+        if not times:
+            return np.empty(0, TIME), np.empty(0, VALUE)
+        if len(times) == 1:
+            return times[0], values[0]
+        return np.concatenate(times), np.concatenate(values)
+
+    def columns(self, names: dict) -> tuple:
+        """ The series of many zones at once, as the zones and the
+            concatenated zone indices, times and values, ordered by zone
+            and time. names maps each zone to the name of its series. """
+        zones, counts, times, values = [], [], [], []
+        for zone, name in names.items():
+            t, v = self.read(zone, name)
+            if not len(t):
+                continue
+            zones.append(zone)
+            counts.append(len(t))
+            times.append(t)
+            values.append(v)
+        if not zones:
+            return [], np.empty(0, np.intp), np.empty(0, TIME), np.empty(0, VALUE)
+        index = np.repeat(np.arange(len(zones)), counts)
+        return zones, index, np.concatenate(times), np.concatenate(values)
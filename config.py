@@ -7,9 +7,38 @@ humidity_config = {
 pump_config = {
     'pump_duration': 5 * 1_000,
     'pump_cooldown': 0 * 1_000,
-    'pump_cap_time': 15 * 1_000
+    'pump_cap_time': 15 * 1_000,  # Within the sliding window below
+    'pump_cap_window': 24 * 60 * 60 * 1_000,
+    'pump_dosing': False,  # Size each start by the fitted response of the zone rather than pump_duration
+    'pump_gain': 1.0,  # Initial humidity percent per pump second, refined by dosing
+    'pump_delay': 60 * 1_000  # Initial time constant of the humidity following the pump, refined by dosing
+}
+supply_config = {
+    'max_running': 1,  # Pumps running at once on the shared supply
+    'spacing': 500  # Milliseconds between pump starts
 }
 sensor_config = {
-    'min_reading': 42000,
-    'max_reading': 65535,
-}
\ No newline at end of file
+    'min_reading': 42000,  # Wet, 100 %
+    'max_reading': 65535,  # Dry, 0 %
+    'auto_calibrate': False,  # Extend the range to the driest and wettest readings seen
+    'stuck_samples': 300  # Unchanged readings taken as a stuck sensor, 0 disables
+}
+sensor_curves = (None, None, None)  # Per sensor (reading, percent) points overriding the line from min to max_reading
+history_config = {
+    # (period in ms, length) per resolution, 0 for the raw samples. About 14 bytes per bucket, and three series per zone.
+    'resolutions': ((0, 60), (60 * 1_000, 60), (60 * 60 * 1_000, 48))
+}
+trace_config = {
+    'capacity': 0 * 4096,  # Records per file of the trace of sensor readings and decisions, 0 disables it
+    'files': 2
+}
+diag_config = {
+    'period': 0 * 1_000,  # Publish diagnostics on <zone>/diag, 0 disables the instrumentation
+}
+zones_config = {
+    'arrays': False,  # Run all zones in one Zones engine of parallel arrays rather than an Irrigation each, requires publish_interval 0
+}
+publish_config = {
+    'publish_interval': 0 * 1_000,  # Batch values per zone, 0 publishes each value on its own topic
+    'echo': True
+}
@@ -4,26 +4,42 @@ from observable import Observable
 
 class Controller(Observable):
     
-    """ A controller that notifies when all active critiera are met. """
+    """ A controller that notifies when all active critiera are met.
+        The number of blocking criteria, i.e. active but not valid, is kept
+        up to date by the criteria themselves. """
+    
+    __slots__ = ('_criteria', '_criterion_subscriptions', '_blocking')
     
     def __init__(self) -> None:
         super().__init__('Controller')
         self._criteria = []
-        self._callback = self.update  # Micropython does not implement 3.8+ behavior for equality of member functions
+        self._criterion_subscriptions = []  # In the order of _criteria, None if not subscribed
+        self._blocking = 0
         
     def add_criterion(self, criterion: Criterion, subscribe: bool = True) -> None:
-        if subscribe:
-            criterion.subscribe(self._callback)
+        self._criterion_subscriptions.append(criterion.subscribe(self.update, target=self) if subscribe else None)
         self._criteria.append(criterion)  
+        criterion._attach(self)
+        if criterion.is_blocking():
+            self._blocking += 1
         
     def remove_criteriea(self, criterion: Criterion) -> None:
-        criterion.unsubscribe(self._callback)
         try:
-            self._criteria.remove(criterion)
+            i = self._criteria.index(criterion)
         except ValueError:
-            pass
+            return
+        del self._criteria[i]
+        subscription = self._criterion_subscriptions.pop(i)
+        if subscription:
+            subscription.detach()
+        criterion._detach(self)
+        if criterion.is_blocking():
+            self._blocking -= 1
+    
+    def blocked(self, change: int) -> None:
+        self._blocking += change
         
     def update(self, observable: Observable) -> None:
-        if all([criterion.is_valid() for criterion in self._criteria if criterion.is_active()]):
+        if not self._blocking:
             self.notify()
-    
\ No newline at end of file
+    
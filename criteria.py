@@ -1,11 +1,21 @@
+import struct
+from array import array
 from functools import partial
-from machine import Timer
 from observable import ObservableValue, ObservableSum, Cooldown
 from sensor import Sensor
+from timers import SoftTimer
 
 class Criterion:
     
-    """ A Criterion that that can be activated/deactivated and queried is_active and is_valid. """
+    """ A Criterion that that can be activated/deactivated and queried is_active and is_valid.
+        A Criterion that is active but not valid is blocking, which is reported to the
+        attached Controllers whenever it changes. """
+    
+    __slots__ = ()  # Only one base class with slots is allowed, the state is slotted by the subclass
+    
+    _active = False
+    _blocking = False
+    _controllers = ()
     
     def __init__(self) -> None:
         pass  # Initialization of only one super class is supported in Micropython.
@@ -16,20 +26,53 @@ class Criterion:
     def is_active(self) -> bool:
         return self._active
     
+    def is_blocking(self) -> bool:
+        return self._blocking
+    
     def activate(self) -> None:
         self._active = True
+        self._refresh()
           
     def deactivate(self) -> None:
         self._active = False
+        self._refresh()
+    
+    def _attach(self, controller: Controller) -> None:
+        self._controllers += (controller,)
+    
+    def _detach(self, controller: Controller) -> None:
+        self._controllers = tuple(c for c in self._controllers if c is not controller)
+    
+    def _refresh(self) -> None:
+        blocking = self._active and not self.is_valid()
+        if blocking != self._blocking:
+            self._blocking = blocking
+            for controller in self._controllers:
+                controller.blocked(1 if blocking else -1)
 
 
 class ObservableValueCriterion(ObservableValue, Criterion):
     
+    __slots__ = ('_active', '_blocking', '_controllers')
+    
     def __init__(self,
                  name: str):
         super().__init__(name)
+        self._active = False
+        self._blocking = False
+        self._controllers = ()
         self.activate()
     
+    @property
+    def value(self):
+        return self._value
+    
+    @value.setter
+    def value(self, value):
+        self._value = value
+        self._refresh()
+        self.notify()
+    
     def is_valid(self) -> bool:
         return self.value
     
@@ -39,12 +82,14 @@ class ObservableValueCriterion(ObservableValue, Criterion):
 
 class ObservingObservableValueCriterion(ObservableValueCriterion):
     
+    __slots__ = ('_observable', '_subscription')
+    
     def __init__(self,
                  observable: Observable,
                  callback: Callable):
         super().__init__(observable.name())
         self._observable = observable
-        observable.subscribe(callback)
+        self._subscription = observable.subscribe(callback, target=self)
 
 
 class SensorCriterion(ObservingObservableValueCriterion):
@@ -52,6 +97,8 @@ class SensorCriterion(ObservingObservableValueCriterion):
     """ A criterion which validity depends on whether the sensor value is
         inside or outside the specified range. """
     
+    __slots__ = ('_valid_inside_range', '_min_value', '_max_value', '_always_notify')
+    
     def __init__(self,
                  sensor: Sensor,
                  valid_inside_range: bool = True,
@@ -72,6 +119,13 @@ class SensorCriterion(ObservingObservableValueCriterion):
     def reset(self) -> None:
         self.value = False
 
+    def retune(self, min_value: Optional[float] = None, max_value: Optional[float] = None) -> None:
+        """ Moves the given bounds of the range, effective from the next sensor value. """
+        if min_value is not None:
+            self._min_value = min_value
+        if max_value is not None:
+            self._max_value = max_value
+
     def update(self, sensor: ObservableValue) -> None:
         if not self.is_active():
             return
@@ -90,14 +144,17 @@ class CooldownCriterion(ObservingObservableValueCriterion):
     
     """ A criterion that is false during the cooldown period of the Observable. """
     
+    __slots__ = ('_timer',)
+    
     def __init__(self,
                  observable: Observable,
                  period: int) -> None:
         super().__init__(observable, partial(self.start, period))
+        self._timer = SoftTimer()
         self.value = True
         
     def start(self, period: int, observable: Observable) -> None:
-        Timer(-1).init(period=period, mode=Timer.ONE_SHOT, callback=self.stop)
+        self._timer.init(period=period, mode=SoftTimer.ONE_SHOT, callback=self.stop)
         self.value = False
         
     def stop(self, time: float) -> None:
@@ -109,15 +166,38 @@ class CooldownCriterion(ObservingObservableValueCriterion):
 
 class Cap(ObservableValueCriterion):
     
-    """ A Criterion which validity depends on if the cap is exceeded. """
+    """ A Criterion which validity depends on if the cap is exceeded within
+        a sliding window. The increments of the ObservableSum are counted
+        in a ring of buckets covering the window, and the oldest bucket is
+        cleared each time the window moves on by one bucket. Given a path,
+        the ring is saved whenever it changes and loaded again at start, so
+        a restart does not reset the window. The time spent restarting is
+        not known and counted as none, which errs on the side of less
+        pumping. """
+    
+    __slots__ = ('_cap', '_observable_sum', '_buckets', '_current', '_total', '_last', '_path', '_timer')
     
-    def __init__(self, observable_sum: ObservableSum, cap: int) -> None:
+    def __init__(self,
+                 observable_sum: ObservableSum,
+                 cap: int,
+                 window: int = 24 * 60 * 60 * 1_000,
+                 buckets: int = 24,
+                 path: Optional[str] = None) -> None:
         super().__init__(observable_sum.name())
         self.value = True
         self._cap = cap
+        self._buckets = array('L', [0] * buckets)
+        self._current = 0
+        self._path = path
+        self._load()
+        self._total = sum(self._buckets)
+        self._last = observable_sum.value or 0
         self.activate()
         self._observable_sum = observable_sum
-        self._observable_sum.subscribe(self.update)
+        self._observable_sum.subscribe(self.update, target=self)
+        self._timer = SoftTimer()
+        self._timer.init(period=window // buckets, mode=SoftTimer.PERIODIC, callback=self._rotate)
+        self._validate()
     
     def is_valid(self) -> bool:
         return self.value
@@ -125,9 +205,68 @@ class Cap(ObservableValueCriterion):
     def name(self) -> str:
         return f'Cap({super().name()})'
     
-    def reset(self, time: Optional[Timer]=None) -> None:
+    def total(self) -> int:
+        """ The sum within the window. """
+        return self._total
+    
+    def remaining(self) -> int:
+        """ What is left of the cap within the window. """
+        return max(0, self._cap - self._total)
+    
+    def retune(self, cap: int) -> None:
+        """ Changes the cap, keeping what is counted within the window. """
+        self._cap = cap
+        self._validate()
+    
+    def reset(self, time: Optional[SoftTimer]=None) -> None:
+        for i in range(len(self._buckets)):
+            self._buckets[i] = 0
+        self._total = 0
         self._observable_sum.reset()
+        self._save()
+        self._validate()
     
     def update(self, observable: ObservableSum) -> None:
-        if (valid := observable.value < self._cap) != self.value:
+        increment = observable.value - self._last
+        self._last = observable.value
+        if increment > 0:
+            self._buckets[self._current] += increment
+            self._total += increment
+            self._save()
+        self._validate()
+    
+    def _rotate(self, t: SoftTimer) -> None:
+        self._current = (self._current + 1) % len(self._buckets)
+        expired = self._buckets[self._current]
+        if expired:
+            self._total -= expired
+            self._buckets[self._current] = 0
+            self._validate()
+        if self._total or expired:  # The position only matters while anything is counted
+            self._save()
+    
+    def _validate(self) -> None:
+        if (valid := self._total < self._cap) != self.value:
             self.value = valid
+    
+    def _load(self) -> None:
+        if not self._path:
+            return
+        try:
+            with open(self._path, 'rb') as f:
+                header = f.read(4)
+                if len(header) == 4 and struct.unpack('<HH', header)[0] == len(self._buckets):
+                    f.readinto(self._buckets)
+                    self._current = struct.unpack('<HH', header)[1] % len(self._buckets)
+        except OSError:
+            pass
+    
+    def _save(self) -> None:
+        if not self._path:
+            return
+        try:
+            with open(self._path, 'wb') as f:
+                f.write(struct.pack('<HH', len(self._buckets), self._current))
+                f.write(self._buckets)
+        except OSError as e:
+            print(f'Saving {self._path} failed: {e}')
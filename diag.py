@@ -0,0 +1,127 @@
+import gc
+import json
+from array import array
+
+
+class Diagnostics:
+
+    """ Opt-in instrumentation of the event graph in fixed-size counters:
+        notify counts and callback latency histograms per observable, timer
+        fires, MQTT publish latency and free heap. The hot paths only
+        report while a Diagnostics is active. The counters of each zone are
+        published as JSON on <zone>/diag once per period together with the
+        deferred queue depth, and then reset. """
+
+    active = None  # The Diagnostics the hot paths report to
+    BUCKETS = 8  # Latency histogram buckets, doubling from below 64 us to above 4 ms
+
+    def __init__(self, client: Optional[Uplink] = None, period: int = 300_000, slots: int = 64) -> None:
+        self._client = client
+        self._slots = slots
+        self._ids = {}  # Observable -> slot, slot 0 counts any observable not watched
+        self._names = ['other']
+        self._zones = {}  # Zone -> slots
+        self._notifies = array('L', [0] * slots)
+        self._latency = array('L', [0] * (slots * Diagnostics.BUCKETS))
+        self._max_latency = array('L', [0] * slots)
+        self._publish_latency = array('L', [0] * Diagnostics.BUCKETS)
+        self._max_publish_latency = 0
+        self._timer_fires = 0
+        self._min_free = None
+        self._period = period
+        self._publish_deferred = None
+
+    def start(self) -> None:
+        from observable import Observable
+        from scheduler import Deferred
+        from timers import SoftTimer
+        Diagnostics.active = self
+        self._scheduler = Observable.scheduler
+        self._publish_deferred = Deferred(self.publish, self)
+        self._timer = SoftTimer()
+        if self._period:
+            self._timer.init(period=self._period, mode=SoftTimer.PERIODIC, callback=self._due)
+
+    def stop(self) -> None:
+        Diagnostics.active = None
+        self._timer.deinit()
+
+    def watch(self, zone: str, observables: list) -> None:
+        slots = self._zones.setdefault(zone, [])
+        for observable in observables:
+            if observable in self._ids or len(self._names) == self._slots:
+                continue
+            name = observable.name()
+            if name in self._names:
+                name = f'{name}#{len(self._names)}'
+            self._ids[observable] = len(self._names)
+            slots.append(len(self._names))
+            self._names.append(name)
+
+    @staticmethod
+    def _bucket(us: int) -> int:
+        bucket = 0
+        us >>= 6
+        while us and bucket < Diagnostics.BUCKETS - 1:
+            us >>= 1
+            bucket += 1
+        return bucket
+
+    def notified(self, observable: Observable) -> None:
+        self._notifies[self._ids.get(observable, 0)] += 1
+
+    def called(self, observable: Observable, us: int) -> None:
+        slot = self._ids.get(observable, 0)
+        self._latency[slot * Diagnostics.BUCKETS + self._bucket(us)] += 1
+        if us > self._max_latency[slot]:
+            self._max_latency[slot] = us
+
+    def timer_fired(self) -> None:
+        self._timer_fires += 1
+
+    def published(self, us: int) -> None:
+        self._publish_latency[self._bucket(us)] += 1
+        if us > self._max_publish_latency:
+            self._max_publish_latency = us
+
+    def sample_heap(self) -> Optional[int]:
+        if not hasattr(gc, 'mem_free'):  # Only on MicroPython
+            return None
+        free = gc.mem_free()
+        if self._min_free is None or free < self._min_free:
+            self._min_free = free
+        return free
+
+    def _due(self, t: SoftTimer) -> None:
+        self.sample_heap()
+        self._scheduler.post(self._publish_deferred)  # Publish from the main loop
+
+    def report(self, zone: str) -> dict:
+        buckets = Diagnostics.BUCKETS
+        return {
+            'notify': {self._names[i]: self._notifies[i] for i in self._zones[zone]},
+            'latency_us': {self._names[i]: list(self._latency[i * buckets:(i + 1) * buckets]) for i in self._zones[zone]},
+            'max_latency_us': {self._names[i]: self._max_latency[i] for i in self._zones[zone]},
+            'other': [self._notifies[0], self._max_latency[0]],
+            'queue': [self._scheduler.depth(), self._scheduler.high_water(), self._scheduler.dropped()],
+            'timer_fires': self._timer_fires,
+            'publish_latency_us': list(self._publish_latency),
+            'max_publish_latency_us': self._max_publish_latency,
+            'heap': [self.sample_heap(), self._min_free],
+        }
+
+    def publish(self, arg=None) -> None:
+        for zone in self._zones:
+            payload = json.dumps(self.report(zone))
+            if self._client:
+                self._client.publish(f'{zone}/diag', payload.encode())  # As bytes, which are not logged for replay
+            else:
+                print(f'{zone}/diag', payload)
+        self.reset()
+
+    def reset(self) -> None:
+        for counters in (self._notifies, self._latency, self._max_latency, self._publish_latency):
+            for i in range(len(counters)):
+                counters[i] = 0
+        self._max_publish_latency = 0
+        self._timer_fires = 0
@@ -0,0 +1,184 @@
+import utime
+from criteria import ObservingObservableValueCriterion
+from observable import ObservableSum
+
+
+class ResponseModel:
+
+    """ The response of the moisture to the pump of one zone, modelled as a
+        gain, in percent per pump second, reached through a first order lag
+        with the time constant delay, in milliseconds. The model is fitted
+        online, one dose at a time: the rise and the area under it are
+        accumulated from the sensor values until the response has settled.
+        For a first order lag the area missing between the final rise R
+        and the response is R * (delay + duration / 2), which gives the
+        delay without keeping any history of the sensor. A response has
+        settled once it has had four delays to do so and has not risen for
+        one more. The first fitted dose replaces the initial estimates,
+        each later one moves them by rate towards what was observed. """
+
+    __slots__ = ('gain', 'delay', 'rate', 'doses', '_duration', '_start', '_last', '_base', '_peak', '_peaked', '_area', '_fit')
+
+    MIN_DELAY = 1_000
+    MAX_DELAY = 30 * 60 * 1_000
+    MIN_RISE = 0.5  # Below this the response is not told from the noise
+
+    def __init__(self, gain: float = 1.0, delay: int = 60_000, rate: float = 0.5) -> None:
+        self.gain = gain
+        self.delay = delay
+        self.rate = rate
+        self.doses = 0  # Number of fitted doses
+        self._duration = 0  # Of the dose being observed, 0 if none
+        self._start = 0
+        self._last = 0
+        self._base = 0.0
+        self._peak = 0.0
+        self._peaked = 0  # When the peak was last raised
+        self._area = 0.0
+        self._fit = False
+
+    def observing(self) -> bool:
+        return self._duration > 0
+
+    def settle_time(self, duration: int = 0) -> int:
+        """ Milliseconds until the response to a dose of duration has settled. """
+        return duration + 4 * self.delay
+
+    def duration(self, rise: float) -> int:
+        """ The dose in milliseconds predicted to rise the moisture by rise. """
+        return int(1_000 * rise / self.gain)
+
+    def dosed(self, duration: int, value: float) -> None:
+        """ Starts observing a dose given at the sensor value. A dose given
+            before the previous one settled is observed in its place, but
+            not fitted, since the responses overlap. """
+        now = utime.ticks_ms()
+        self._fit = not self.observing()
+        if not self._fit:
+            duration += self._duration
+        self._duration = duration
+        self._start = self._last = self._peaked = now
+        self._base = value
+        self._peak = self._area = 0.0
+
+    def sampled(self, value: float) -> bool:
+        """ Accumulates a sensor value. Returns True when the dose settled. """
+        if not self.observing():
+            return False
+        now = utime.ticks_ms()
+        rise = value - self._base
+        self._area += rise * utime.ticks_diff(now, self._last)
+        self._last = now
+        if rise > self._peak:
+            self._peak = rise
+            self._peaked = now
+        elapsed = utime.ticks_diff(now, self._start)
+        if elapsed < self.settle_time(self._duration) or utime.ticks_diff(now, self._peaked) < self.delay:
+            return False
+        if self._fit and self._peak >= ResponseModel.MIN_RISE:
+            gain = self._peak * 1_000 / self._duration
+            delay = (self._peak * elapsed - self._area) / self._peak - self._duration / 2
+            delay = min(ResponseModel.MAX_DELAY, max(ResponseModel.MIN_DELAY, delay))
+            rate = self.rate if self.doses else 1.0
+            self.gain += rate * (gain - self.gain)
+            self.delay += int(rate * (delay - self.delay))
+            self.doses += 1
+        self._duration = 0
+        return True
+
+
+class DosingCriterion(ObservingObservableValueCriterion):
+
+    """ A criterion that is valid when a dose is due, i.e. the response to
+        the previous one has settled below the target. The dose is sized by
+        the ResponseModel to bring the moisture up to target in one start,
+        limited to max_dose and to what is left of the Cap. Until a dose has
+        been fitted, the initial gain is merely a guess and doses are
+        limited to probe instead, to not overshoot a zone wetter than
+        guessed. Doses predicted
+        to rise the moisture less than tolerance are not given, so a zone
+        converges in as few starts as the fit allows. Between doses an
+        update is a single comparison with a threshold derived from those,
+        which allocates nothing.
+
+        The pump time is taken from the ObservableSum counting it, so that
+        doses started by other means, e.g. over MQTT, are observed too. """
+
+    __slots__ = ('_model', '_target', '_tolerance', '_min_dose', '_max_dose', '_probe', '_cap', '_counter', '_last', '_requested', '_threshold')
+
+    def __init__(self,
+                 sensor: Sensor,
+                 pump_counter: ObservableSum,
+                 target: float,
+                 tolerance: float = 2.0,
+                 cap: Optional[Cap] = None,
+                 min_dose: int = 500,
+                 max_dose: int = 60_000,
+                 probe: int = 5_000,
+                 gain: float = 1.0,
+                 delay: int = 60_000) -> None:
+        super().__init__(sensor, self.update)
+        self._model = ResponseModel(gain, delay)
+        self._target = target
+        self._tolerance = tolerance
+        self._cap = cap
+        self._min_dose = min_dose
+        self._max_dose = max_dose
+        self._probe = probe
+        self._counter = pump_counter.subscribe(self._pumped, target=self)
+        self._last = pump_counter.value or 0
+        self._requested = None  # When a dose was requested but not yet started
+        self._threshold = 0.0
+        self._retune()
+        self.value = False
+
+    def name(self) -> str:
+        return f'DosingCriterion({super().name()})'
+
+    def model(self) -> ResponseModel:
+        return self._model
+
+    def retune(self, target: float, tolerance: float, probe: int) -> None:
+        """ Changes the target, the tolerance and the probe, keeping the fit. """
+        self._target = target
+        self._tolerance = tolerance
+        self._probe = probe
+        self._retune()
+
+    def _retune(self) -> None:
+        """ Derives the sensor value below which a dose is due from the model. """
+        self._threshold = self._target - max(self._tolerance, self._model.gain * self._min_dose / 1_000)
+
+    def dose(self) -> int:
+        """ The duration in milliseconds of the due dose, which is then
+            waited for. """
+        duration = self._model.duration(self._target - self._observable.value)
+        duration = min(duration, self._max_dose if self._model.doses else self._probe)
+        if self._cap:
+            duration = min(duration, self._cap.remaining())
+        self._requested = utime.ticks_ms()
+        self.value = False
+        return duration
+
+    def update(self, sensor: Sensor) -> None:
+        model = self._model
+        if model.observing():
+            if not model.sampled(sensor.value):
+                return
+            self._retune()
+        if self._requested is not None:
+            if utime.ticks_diff(utime.ticks_ms(), self._requested) < model.settle_time():
+                return
+            self._requested = None  # The request was dropped, e.g. for a running pump
+        due = sensor.value <= self._threshold
+        if due or self.value:
+            self.value = due  # Always notified while due, as the Controller starts the pump on it
+
+    def _pumped(self, counter: ObservableSum) -> None:
+        increment = counter.value - self._last
+        self._last = counter.value
+        if increment > 0 and self._observable.value is not None:
+            self._requested = None
+            self._model.dosed(increment, self._observable.value)
+            if self.value:
+                self.value = False
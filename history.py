@@ -0,0 +1,193 @@
+import json
+from array import array
+from timers import SoftTimer
+
+
+class Rollup:
+
+    """ A ring of buckets of period milliseconds, each holding the min, max,
+        sum and count of the samples within it. Buckets are numbered by the
+        time since the TimerService started divided by the period, and the
+        ring is advanced lazily by the next sample, clearing the buckets
+        skipped meanwhile. """
+
+    __slots__ = ('period', '_min', '_max', '_sum', '_count', '_bucket')
+
+    def __init__(self, period: int, length: int) -> None:
+        self.period = period
+        self._min = array('f', [0.0] * length)
+        self._max = array('f', [0.0] * length)
+        self._sum = array('f', [0.0] * length)
+        self._count = array('H', [0] * length)
+        self._bucket = 0  # The number of the newest bucket
+
+    def __len__(self) -> int:
+        return len(self._count)
+
+    def _advance(self, bucket: int) -> None:
+        count = self._count
+        for b in range(max(self._bucket + 1, bucket - len(count) + 1), bucket + 1):
+            count[b % len(count)] = 0
+        self._bucket = bucket
+
+    def add(self, now: int, value: float) -> None:
+        bucket = now // self.period
+        if bucket != self._bucket:
+            self._advance(bucket)
+        i = bucket % len(self._count)
+        if self._count[i]:
+            if value < self._min[i]:
+                self._min[i] = value
+            if value > self._max[i]:
+                self._max[i] = value
+            self._sum[i] += value
+            self._count[i] += 1
+        else:
+            self._min[i] = self._max[i] = self._sum[i] = value
+            self._count[i] = 1
+
+    def query(self, now: int, count: int) -> dict:
+        """ The newest count buckets up to now, oldest first, None where empty. """
+        bucket = now // self.period
+        if bucket != self._bucket:
+            self._advance(bucket)
+        n = min(count, len(self._count))
+        mins, maxs, means, sums = [], [], [], []
+        for b in range(bucket - n + 1, bucket + 1):
+            i = b % len(self._count)
+            c = self._count[i] if b >= 0 else 0
+            mins.append(round(self._min[i], 2) if c else None)
+            maxs.append(round(self._max[i], 2) if c else None)
+            means.append(round(self._sum[i] / c, 2) if c else None)
+            sums.append(round(self._sum[i], 2) if c else None)
+        return {'resolution': self.period, 'end': (bucket + 1) * self.period,
+                'min': mins, 'max': maxs, 'mean': means, 'sum': sums}
+
+
+class History:
+
+    """ The history of an ObservableValue at multiple resolutions in fixed
+        memory. The raw samples are kept in a ring of their own, each
+        coarser resolution in a Rollup. Recording a sample takes constant
+        time, independent of the length of the rings.
+
+        With delta, the increments of the value are recorded rather than
+        the value, as for the pump time of an ObservableSum, so the sums
+        of the buckets are the totals within them. Values that are not
+        numbers, e.g. states, are recorded as the number encode returns. """
+
+    __slots__ = ('_values', '_times', '_next', '_size', '_rollups', '_delta', '_last', '_encode', '_subscription')
+
+    def __init__(self,
+                 observable: ObservableValue,
+                 resolutions: tuple = ((0, 600), (60_000, 24 * 60), (60 * 60_000, 31 * 24)),
+                 delta: bool = False,
+                 encode: Optional[Callable] = None) -> None:
+        raw = [length for period, length in resolutions if not period]
+        self._values = array('f', [0.0] * (raw[0] if raw else 0))
+        self._times = array('L', [0] * len(self._values))
+        self._next = 0
+        self._size = 0
+        self._rollups = [Rollup(period, length) for period, length in resolutions if period]
+        self._delta = delta
+        self._last = observable.value or 0
+        self._encode = encode
+        self._subscription = observable.subscribe(self._record)
+
+    def resolutions(self) -> list:
+        return ([0] if len(self._values) else []) + [rollup.period for rollup in self._rollups]
+
+    def _record(self, observable: ObservableValue) -> None:
+        value = observable.value
+        if self._encode:
+            value = self._encode(value)
+        if value is None:
+            return
+        if self._delta:
+            increment = value - self._last
+            self._last = value
+            value = increment if increment >= 0 else value  # The sum was reset
+        self.add(value)
+
+    def add(self, value: float, now: Optional[int] = None) -> None:
+        if now is None:
+            now = SoftTimer.service.now()
+        if len(self._values):
+            self._values[self._next] = value
+            self._times[self._next] = now & 0xFFFFFFFF
+            self._next = (self._next + 1) % len(self._values)
+            self._size = min(self._size + 1, len(self._values))
+        for rollup in self._rollups:
+            rollup.add(now, value)
+
+    def query(self, resolution: int = 0, count: int = 0x7FFF) -> Optional[dict]:
+        """ The newest count samples, or buckets at the given resolution,
+            oldest first. None if the resolution is not kept. """
+        now = SoftTimer.service.now()
+        if resolution:
+            for rollup in self._rollups:
+                if rollup.period == resolution:
+                    return rollup.query(now, count)
+            return None
+        if not len(self._values):
+            return None
+        n = min(count, self._size)
+        ages, values = [], []
+        for k in range(n):
+            i = (self._next - n + k) % len(self._values)
+            ages.append((now - self._times[i]) & 0xFFFFFFFF)
+            values.append(round(self._values[i], 2))
+        return {'resolution': 0, 'age': ages, 'value': values}
+
+
+class HistoryServer:
+
+    """ Answers queries of the Histories of the zones over MQTT, so that a
+        dashboard pulls the aggregates it needs in one message rather than
+        subscribing to every value. A request on <zone>/history/get is a
+        JSON object with the series and optionally the resolution in ms, 0
+        for the raw samples, and the count of buckets, e.g.
+
+            {"series": "moisture", "resolution": 60000, "count": 60}
+
+        The response on <zone>/history holds the series, the resolution and
+        either the ages in ms and values of the raw samples, or the end time
+        and the min, max, mean and sum of each bucket, null where empty. """
+
+    def __init__(self,
+                 client: Optional[Uplink],
+                 resolutions: tuple = ((0, 600), (60_000, 24 * 60), (60 * 60_000, 31 * 24))) -> None:
+        self._client = client
+        self.resolutions = resolutions
+        self._histories = {}  # Per zone as bytes, the Histories by series
+
+    def add(self, zone: str, series: str, history: History) -> None:
+        self._histories.setdefault(zone.encode(), {})[series] = history
+
+    def history(self, zone: str, series: str) -> Optional[History]:
+        return self._histories.get(zone.encode(), {}).get(series)
+
+    def request(self, topic: bytes, msg: bytes) -> None:
+        """ A Receiver callback for <zone>/history/get. """
+        zone = topic.split(b'/')[0]
+        try:
+            query = json.loads(msg) if msg else {}
+            series = query.get('series', 'moisture')
+            if not isinstance(series, str):
+                raise TypeError('series is not a string')
+            resolution = int(query.get('resolution', 0))
+            count = int(query.get('count', 0x7FFF))
+        except (ValueError, TypeError, AttributeError) as e:
+            self._respond(zone, {'error': f'Invalid query: {e}'})
+            return
+        history = self._histories.get(zone, {}).get(series)
+        result = history.query(resolution, count) if history else None
+        if result is None:
+            self._respond(zone, {'error': f'No {series} history at resolution {resolution}'})
+            return
+        result['series'] = series
+        self._respond(zone, result)
+
+    def _respond(self, zone: bytes, response: dict) -> None:
+        if self._client:
+            self._client.publish(zone + b'/history', json.dumps(response).encode())
@@ -0,0 +1,70 @@
+""" Host-side support for running the device code under CPython.
+
+    install() puts stand-ins for the MicroPython-only modules in sys.modules,
+    driven by a Clock, and makes the device modules importable. These use
+    annotations naming classes that are never imported, which MicroPython
+    ignores but CPython evaluates, so they are compiled with postponed
+    evaluation of annotations. """
+
+import __future__
+import importlib.abc
+import importlib.util
+import os
+import sys
+
+from . import clock as _clock
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+STAND_INS = ('machine', 'network', 'utime', 'ubinascii', 'ssl', 'umqtt', 'umqtt.simple', 'password')
+
+
+def compile_device(source, path: str):
+    return compile(source, path, 'exec', flags=__future__.annotations.compiler_flag, dont_inherit=True)
+
+
+class _DeviceLoader(importlib.abc.SourceLoader):
+
+    def __init__(self, path: str) -> None:
+        self._path = path
+
+    def get_filename(self, fullname: str) -> str:
+        return self._path
+
+    def get_data(self, path: str) -> bytes:
+        with open(path, 'rb') as f:
+            return f.read()
+
+    def source_to_code(self, data, path, *, _optimize=-1):
+        return compile_device(data, path)
+
+
+class _DeviceFinder(importlib.abc.MetaPathFinder):
+
+    def __init__(self, root: str) -> None:
+        self._root = root
+
+    def find_spec(self, fullname, path, target=None):
+        if '.' in fullname:
+            return None
+        filename = os.path.join(self._root, fullname + '.py')
+        if not os.path.exists(filename):
+            return None
+        return importlib.util.spec_from_file_location(fullname, filename, loader=_DeviceLoader(filename))
+
+
+def install(clock: _clock.Clock = None, root: str = ROOT) -> _clock.Clock:
+    """ Installs the stand-ins driven by clock (real time by default) and
+        the importer of the device modules in root. Returns the clock. """
+    _clock.current = clock or _clock.Clock()
+    for name in STAND_INS:
+        sys.modules[name] = importlib.import_module(f'{__name__}.{name}')
+    if not any(isinstance(finder, _DeviceFinder) for finder in sys.meta_path):
+        sys.meta_path.insert(0, _DeviceFinder(root))
+    return _clock.current
+
+
+def run_main(root: str = ROOT) -> None:
+    path = os.path.join(root, 'main.py')
+    with open(path, 'rb') as f:
+        code = compile_device(f.read(), path)
+    exec(code, {'__name__': '__main__', '__file__': path})
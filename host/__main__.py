@@ -0,0 +1,8 @@
+""" Runs main.py under CPython with the stand-ins in real time:
+
+    python -m host """
+
+from . import install, run_main
+
+install()
+run_main()
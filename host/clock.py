@@ -0,0 +1,68 @@
+""" The clock driving the host stand-ins of utime and machine.Timer. """
+
+import heapq
+import itertools
+import time
+
+
+class Clock:
+
+    """ Real-time clock. Stand-in timers are fired whenever the device
+        code waits, i.e. in machine.idle/lightsleep and utime.sleep*. """
+
+    def __init__(self) -> None:
+        self._start = time.monotonic()
+        self._timers = []  # Heap of (deadline, seq, timer)
+        self._seq = itertools.count()
+        self._stale = 0  # Entries of cancelled or rescheduled timers
+
+    def now_us(self) -> int:
+        return int((time.monotonic() - self._start) * 1_000_000)
+
+    def now_ms(self) -> int:
+        return self.now_us() // 1_000
+
+    def schedule(self, timer, deadline: int) -> None:
+        self.cancel(timer)
+        timer._seq = next(self._seq)
+        heapq.heappush(self._timers, (deadline, timer._seq, timer))
+
+    def cancel(self, timer) -> None:
+        if timer._seq is None:
+            return
+        timer._seq = None  # Removed lazily
+        self._stale += 1
+        if self._stale > 64 and 2 * self._stale > len(self._timers):
+            self._timers = [entry for entry in self._timers if entry[2]._seq == entry[1]]
+            heapq.heapify(self._timers)
+            self._stale = 0
+
+    def next_deadline(self):
+        while self._timers and self._timers[0][2]._seq != self._timers[0][1]:
+            heapq.heappop(self._timers)
+            self._stale -= 1
+        return self._timers[0][0] if self._timers else None
+
+    def run_due(self) -> int:
+        count = 0
+        while (deadline := self.next_deadline()) is not None and deadline <= self.now_ms():
+            _, _, timer = heapq.heappop(self._timers)
+            timer._fire(deadline)
+            count += 1
+        return count
+
+    def sleep_ms(self, ms: int) -> None:
+        end = self.now_ms() + ms
+        while True:
+            self.run_due()
+            now = self.now_ms()
+            if now >= end:
+                return
+            deadline = self.next_deadline()
+            self._wait(min(end, deadline if deadline is not None else end) - now)
+
+    def _wait(self, ms: int) -> None:
+        time.sleep(ms / 1_000)
+
+
+current = None
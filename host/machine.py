@@ -0,0 +1,103 @@
+""" Stand-in for MicroPython's machine module, driven by the installed Clock. """
+
+import sys
+
+from . import clock as _clock
+
+
+class Timer:
+
+    ONE_SHOT = 0
+    PERIODIC = 1
+
+    def __init__(self, id: int = -1, **kwargs) -> None:
+        self._seq = None
+        self._callback = None
+        if kwargs:
+            self.init(**kwargs)
+
+    def init(self, period: int = 0, mode: int = PERIODIC, callback=None, **kwargs) -> None:
+        self._period = max(1, period)
+        self._mode = mode
+        self._callback = callback
+        _clock.current.schedule(self, _clock.current.now_ms() + self._period)
+
+    def deinit(self) -> None:
+        _clock.current.cancel(self)
+
+    def _fire(self, deadline: int) -> None:
+        self._seq = None
+        if self._mode == Timer.PERIODIC:
+            _clock.current.schedule(self, deadline + self._period)
+        if self._callback:
+            self._callback(self)
+
+
+class Pin:
+
+    IN = 0
+    OUT = 1
+    PULL_UP = 1
+    PULL_DOWN = 2
+    IRQ_FALLING = 4
+    IRQ_RISING = 8
+
+    def __init__(self, id, mode: int = IN, pull: int = None, value: int = None) -> None:
+        self._id = id
+        self._value = value or 0
+
+    def __repr__(self) -> str:
+        return f'Pin({self._id})'
+
+    def value(self, value=None):
+        if value is None:
+            return self._value
+        self._value = 1 if value else 0
+
+    def on(self) -> None:
+        self._value = 1
+
+    def off(self) -> None:
+        self._value = 0
+
+    high = on
+    low = off
+
+    def irq(self, handler=None, trigger: int = 0, **kwargs) -> None:
+        self._handler = handler
+
+
+class ADC:
+
+    """ Reads reading, or calls source if given. """
+
+    def __init__(self, pin) -> None:
+        self._pin = pin
+        self.reading = 0x8000
+        self.source = None
+
+    def read_u16(self) -> int:
+        return self.source() if self.source else self.reading
+
+
+def idle() -> None:
+    _clock.current.run_due()
+
+
+def lightsleep(ms: int = None) -> None:
+    if ms is None:
+        deadline = _clock.current.next_deadline()
+        ms = deadline - _clock.current.now_ms() if deadline is not None else 1_000
+    _clock.current.sleep_ms(max(0, ms))
+
+
+def reset() -> None:
+    sys.exit('machine.reset()')
+
+
+def unique_id() -> bytes:
+    return b'host'
+
+
+def freq() -> int:
+    return 125_000_000
@@ -0,0 +1,31 @@
+""" Stand-in for MicroPython's network module, connecting instantly. """
+
+STA_IF = 0
+AP_IF = 1
+
+
+class WLAN:
+
+    def __init__(self, interface: int = STA_IF) -> None:
+        self._active = False
+        self._connected = False
+
+    def active(self, active: bool = None) -> bool:
+        if active is not None:
+            self._active = active
+        return self._active
+
+    def connect(self, ssid: str = None, key: str = None) -> None:
+        self._connected = True
+
+    def disconnect(self) -> None:
+        self._connected = False
+
+    def isconnected(self) -> bool:
+        return self._connected
+
+    def config(self, *args, **kwargs):
+        return None
+
+    def ifconfig(self):
+        return ('127.0.0.1', '255.0.0.0', '127.0.0.1', '127.0.0.1')
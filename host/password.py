@@ -0,0 +1,4 @@
+""" Stand-in for the device's password.py, which is not part of the repository. """
+
+wifi = {'ssid': 'host', 'password': ''}
+hivemq = {'server': 'localhost', 'user': '', 'password': ''}
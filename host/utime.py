@@ -0,0 +1,38 @@
+""" Stand-in for MicroPython's utime, driven by the installed Clock. """
+
+from . import clock as _clock
+
+_PERIOD = 1 << 30
+_HALF = _PERIOD // 2
+
+
+def ticks_ms() -> int:
+    return _clock.current.now_ms() % _PERIOD
+
+
+def ticks_us() -> int:
+    return _clock.current.now_us() % _PERIOD
+
+
+def ticks_add(ticks: int, delta: int) -> int:
+    return (ticks + delta) % _PERIOD
+
+
+def ticks_diff(ticks1: int, ticks2: int) -> int:
+    return (ticks1 - ticks2 + _HALF) % _PERIOD - _HALF
+
+
+def sleep_ms(ms: int) -> None:
+    _clock.current.sleep_ms(ms)
+
+
+def sleep_us(us: int) -> None:
+    _clock.current.sleep_ms(us // 1_000)
+
+
+def sleep(seconds: float) -> None:
+    _clock.current.sleep_ms(int(seconds * 1_000))
+
+
+def time() -> int:
+    return _clock.current.now_ms() // 1_000
@@ -0,0 +1,63 @@
+import machine
+import utime
+
+
+class Idle:
+
+    """ Sleeps until the nearest deadline of its sources, or an interrupt,
+        using machine.lightsleep. A source is a callable returning the
+        milliseconds until its next deadline, or None if it has none.
+        Keeps count of the time spent awake and the number of wakeups to
+        report the duty cycle. """
+
+    def __init__(self,
+                 max_sleep: int = 1_000,
+                 min_sleep: int = 2,
+                 sleep: Optional[Callable] = None) -> None:
+        self._sources = []
+        self._max_sleep = max_sleep
+        self._min_sleep = min_sleep
+        self._sleep = sleep or machine.lightsleep
+        self.reset()
+
+    def add_source(self, source: Callable) -> None:
+        self._sources.append(source)
+
+    def until_deadline(self) -> int:
+        ms = self._max_sleep
+        for source in self._sources:
+            deadline = source()
+            if deadline is not None and deadline < ms:
+                ms = deadline
+        return ms
+
+    def sleep(self) -> int:
+        """ Sleeps until the nearest deadline. Returns the milliseconds slept. """
+        ms = self.until_deadline()
+        if ms < self._min_sleep:
+            machine.idle()
+            return 0
+        start = utime.ticks_ms()
+        self._awake += utime.ticks_diff(start, self._woke)
+        self._sleep(ms)
+        self._woke = utime.ticks_ms()
+        self._asleep += utime.ticks_diff(self._woke, start)
+        self._wakeups += 1
+        return ms
+
+    def reset(self) -> None:
+        self._woke = self._since = utime.ticks_ms()
+        self._awake = 0
+        self._asleep = 0
+        self._wakeups = 0
+
+    def duty_cycle(self) -> float:
+        awake = self._awake + utime.ticks_diff(utime.ticks_ms(), self._woke)
+        return awake / max(1, awake + self._asleep)
+
+    def wakeups_per_minute(self) -> float:
+        return 60_000 * self._wakeups / max(1, utime.ticks_diff(utime.ticks_ms(), self._since))
+
+    def report(self, t: Optional[SoftTimer] = None) -> None:
+        print(f'Idle: duty cycle {100 * self.duty_cycle():.1f}%, {self.wakeups_per_minute():.1f} wakeups/min')
+        self.reset()
@@ -1,9 +1,16 @@
-import utime
+import json
+import os
 from controller import Controller
 from criteria import Cap, CooldownCriterion, SensorCriterion
+from diag import Diagnostics
+from dosing import DosingCriterion
 from functools import partial
-from observable import Cooldown, ObservableSum, ObservableValue
-from mqtt import ObservableValuePublisher
+from history import History
+from observable import Cooldown, Observable, ObservableSum, ObservableValue
+from scheduler import Deferred
+from tracing import Trace
+from tuning import TUNABLE, tune
+from mqtt import ObservableValuePublisher, Outbox
 
 
 class Irrigation(ObservableValue):
@@ -12,13 +19,32 @@ class Irrigation(ObservableValue):
         within the range [min_humidity, max_humidity] by running the pump
         in the watering state and waiting in the draining stage.
         
-        Publishes sensor values, pump time, and state to an MQTT client. """
+        Publishes sensor values, pump time, and state to an MQTT client,
+        either one message per value or, given a publish_interval, batched
+        into one message per interval. The MQTT client is expected to be
+        an Uplink. Given a HistoryServer, the humidity, the pump time and the
+        state, 1 when watering, are recorded in Histories it answers
+        queries of.
+        
+        With pump_dosing, each pump start is instead a dose sized by a
+        DosingCriterion to bring the humidity up to three quarters into the
+        range, fitted online to how the zone responds. Watering then ends
+        once the humidity settles near that target.
+        
+        The settings in tuning.TUNABLE can be changed while running by
+        configure, given the JSON of a delta with a version above the
+        current one, as received on <zone>/config. The delta is applied
+        between control ticks by retuning the criteria, the Cap and the
+        Cooldowns in place, so their state is kept, and acknowledged with
+        all the settings on <zone>/config/applied. Given a config_path, the
+        settings are saved there and loaded again at start, if valid. """
+    
     
     def __init__(self,
                  name: str,
                  sensor: Sensor,
                  pump: Pump,
-                 mqtt_client: Optional[MQTTClient]=None,
+                 mqtt_client: Optional[Uplink]=None,
                  min_humidity: float = 20.0,
                  max_humidity: float = 60.0,
                  sensor_cooldown_period_watering: int = 10_000,
@@ -26,7 +52,16 @@ class Irrigation(ObservableValue):
                  pump_duration: int = 2_000,
                  pump_cooldown: int = 10_000,
                  pump_cap_time: int = 100_000,
-                 pump_cap_pin: Optional[Pin] = None) -> None:
+                 pump_cap_window: int = 24 * 60 * 60 * 1_000,
+                 pump_cap_pin: Optional[Pin] = None,
+                 pump_cap_path: Optional[str] = None,
+                 pump_dosing: bool = False,
+                 pump_gain: float = 1.0,
+                 pump_delay: int = 60_000,
+                 publish_interval: int = 0,
+                 echo: bool = True,
+                 history: Optional[HistoryServer] = None,
+                 config_path: Optional[str] = None) -> None:
 
         super().__init__(name)
         self._pump = pump
@@ -36,45 +71,93 @@ class Irrigation(ObservableValue):
         self._mqtt_client = mqtt_client
         sensor._name += f'({self.name()})'
 
-        # When watering, wait till max_humidity is reached before stopping.
-        self._criterion_when_watering = SensorCriterion(sensor, min_value=max_humidity, valid_inside_range=True)
+        self._settings = {'min_humidity': min_humidity, 'max_humidity': max_humidity,
+                          'sensor_cooldown_period_watering': sensor_cooldown_period_watering,
+                          'sensor_cooldown_period_draining': sensor_cooldown_period_draining,
+                          'pump_duration': pump_duration, 'pump_cap_time': pump_cap_time}
+        self._version = 0
+        self._pending = {}  # Settings received but not yet applied
+        self._pending_version = 0
+        self._config_path = config_path
+        self._configure_deferred = Deferred(self._configure, self)
+        self._pump_duration = pump_duration
+        target, tolerance, stop_humidity = self._thresholds(min_humidity, max_humidity, pump_dosing)
+
+        # When watering, wait till max_humidity, or the dosing target, is reached before stopping.
+        self._criterion_when_watering = SensorCriterion(sensor, min_value=stop_humidity, valid_inside_range=True)
         self._state_controller.add_criterion(self._criterion_when_watering)
 
         # When draining, wait until min_humidity is reached before starting watering again.
         self._criterion_when_draining = SensorCriterion(sensor, max_value=min_humidity, valid_inside_range=True)
         self._state_controller.add_criterion(self._criterion_when_draining)
         
-        # When watering, pump until max_humidity or cap is reached.
-        self._pump_controller.add_criterion(SensorCriterion(sensor, max_value=max_humidity, valid_inside_range=True, always_notify=True))
-        self._cap = Cap(self._pump_counter, pump_cap_time)
+        # When watering, pump until max_humidity or cap is reached, or dose when due unless the cap is reached.
+        self._cap = Cap(self._pump_counter, pump_cap_time, window=pump_cap_window, path=pump_cap_path)
+        if pump_dosing:
+            self._dosing = DosingCriterion(sensor, self._pump_counter, target, tolerance, cap=self._cap,
+                                           probe=pump_duration, gain=pump_gain, delay=pump_delay)
+            self._pump_controller.add_criterion(self._dosing)
+            self._pump_criterion = None
+            start_pump = self._dose
+        else:
+            self._dosing = None
+            self._pump_criterion = SensorCriterion(sensor, max_value=max_humidity, valid_inside_range=True, always_notify=True)
+            self._pump_controller.add_criterion(self._pump_criterion)
+            start_pump = self._burst
         self._pump_controller.add_criterion(self._cap)
         if pump_cap_pin:
             self._cap.subscribe(lambda obs: pump_cap_pin.value(not obs.value)) 
 
         # Switch between watering/draining states
-        self._pump_callback = partial(self._start_pump, pump_duration)
-        self._watering_callback = self._watering  # Micropython does not implement 3.8+ behavior for equality of member functions
-        self._draining_callback = self._draining
+        self._pump_subscription = self._pump_controller.subscribe(start_pump, enabled=False, target=pump)
+        self._watering_subscription = self._criterion_when_draining.subscribe(self._watering, enabled=False, target=self)
+        self._draining_subscription = self._criterion_when_watering.subscribe(self._draining, enabled=False, target=self)
 
-        self._pump_publisher = ObservableValuePublisher(mqtt_client, self._pump_counter, base_topic=name)
-        self._state_publisher = ObservableValuePublisher(mqtt_client, self, base_topic=name)
-        self._sensor_publisher_watering = ObservableValuePublisher(mqtt_client, Cooldown(sensor, sensor_cooldown_period_watering), base_topic=name)
-        self._sensor_publisher_draining = ObservableValuePublisher(mqtt_client, Cooldown(sensor, sensor_cooldown_period_draining), base_topic=name)
+        if publish_interval:
+            self._outbox = Outbox(mqtt_client, base_topic=name, period=publish_interval, echo=echo)
+            publisher = self._outbox.publisher
+        else:
+            publisher = partial(ObservableValuePublisher, mqtt_client, base_topic=name, echo=echo)
+        self._pump_publisher = publisher(self._pump_counter)
+        self._state_publisher = publisher(self)
+        self._cooldown_watering = Cooldown(sensor, sensor_cooldown_period_watering)
+        self._cooldown_draining = Cooldown(sensor, sensor_cooldown_period_draining)
+        self._sensor_publisher_watering = publisher(self._cooldown_watering)
+        self._sensor_publisher_draining = publisher(self._cooldown_draining)
 
-        self._draining(self._state_controller)  # start in draining state
-        utime.sleep_ms(1000)                    # Do not start everything simultaneously
+        if history:
+            history.add(name, 'moisture', History(sensor, history.resolutions))
+            history.add(name, 'pump', History(self._pump_counter, history.resolutions, delta=True))
+            history.add(name, 'state', History(self, history.resolutions, encode=lambda state: int(state == 'Watering')))
+
+        if Trace.active:
+            Trace.active.watch(name, sensor, pump, self)
+
+        if Diagnostics.active:
+            Diagnostics.active.watch(name, [sensor, pump, self._pump_counter, self._cap, self,
+                                            self._state_controller, self._pump_controller,
+                                            self._criterion_when_watering, self._criterion_when_draining]
+                                           + ([self._dosing] if self._dosing else []))
+
+        if config_path:
+            self._load()
 
     def name(self) -> str:
         return self._name
 
+    def start(self) -> None:
+        self._draining(self._state_controller)  # start in draining state
+
     def _watering(self, observable) -> None:
         self._sensor_publisher_draining.deactivate()
         self._sensor_publisher_watering.activate()
         self._criterion_when_watering.activate()
         self._criterion_when_draining.deactivate()
-        self._criterion_when_draining.unsubscribe(self._watering_callback)
-        self._criterion_when_watering.subscribe(self._draining_callback)
-        self._pump_controller.subscribe(self._pump_callback)
+        self._watering_subscription.disable()
+        self._draining_subscription.enable()
+        self._pump_subscription.enable()
+        if Trace.active:
+            Trace.active.state(self, True)
         self.value = 'Watering'
 
     def _draining(self, observable) -> None:
@@ -82,10 +165,120 @@ class Irrigation(ObservableValue):
         self._sensor_publisher_draining.activate()
         self._criterion_when_watering.deactivate()
         self._criterion_when_draining.activate()
-        self._criterion_when_watering.unsubscribe(self._draining_callback)
-        self._criterion_when_draining.subscribe(self._watering_callback)
-        self._pump_controller.unsubscribe(self._pump_callback)
+        self._draining_subscription.disable()
+        self._watering_subscription.enable()
+        self._pump_subscription.disable()
+        if Trace.active:
+            Trace.active.state(self, False)
         self.value = 'Draining'
 
     def _start_pump(self, period: int = 2_000, observable: Optional[Observable] = None) -> None:
-        self._pump.start(period)
+        self._pump.request(period)
+
+    def _burst(self, observable: Observable) -> None:
+        self._pump.request(self._pump_duration)
+
+    def _dose(self, observable: Observable) -> None:
+        period = self._dosing.dose()
+        if period > 0:  # A period of 0 would run the pump until stopped
+            self._pump.request(period)
+
+    @staticmethod
+    def _thresholds(min_humidity: float, max_humidity: float, dosing: bool) -> tuple:
+        """ The dosing target and tolerance, and the humidity that ends watering. """
+        # When dosing, aim below max_humidity, as the humidity keeps rising after the pump stopped.
+        target = max_humidity - (max_humidity - min_humidity) / 4
+        tolerance = (max_humidity - min_humidity) / 20
+        return target, tolerance, target - tolerance if dosing else max_humidity
+
+    def settings(self) -> dict:
+        """ The current values of the TUNABLE settings. """
+        return dict(self._settings)
+
+    def version(self) -> int:
+        return self._version
+
+    def configure(self, msg: bytes) -> None:
+        """ Validates the JSON of a delta of settings with a version, e.g.
+            {"version": 3, "max_humidity": 70}, and applies it between
+            control ticks. Deltas received before it is applied are merged. """
+        try:
+            delta = json.loads(msg)
+            version = int(delta.pop('version'))
+            if version <= max(self._version, self._pending_version):
+                raise ValueError(f'Version {version} is not above {max(self._version, self._pending_version)}')
+            settings = dict(self._settings)
+            settings.update(self._pending)
+            settings = tune(settings, delta)
+        except (ValueError, KeyError, TypeError, AttributeError) as e:
+            self._acknowledge({'error': f'Invalid config: {e}'})
+            return
+        self._pending = settings
+        self._pending_version = version
+        Observable.scheduler.post(self._configure_deferred)
+
+    def _configure(self, arg=None) -> None:
+        if not self._pending_version:
+            return
+        self._apply(self._pending, self._pending_version)
+        self._pending = {}
+        self._pending_version = 0
+        self._save()
+        self._acknowledge(self._saved())
+
+    def _apply(self, settings: dict, version: int) -> None:
+        """ Retunes the criteria, the Cap and the Cooldowns in place. """
+        min_humidity = settings['min_humidity']
+        max_humidity = settings['max_humidity']
+        target, tolerance, stop_humidity = self._thresholds(min_humidity, max_humidity, self._dosing is not None)
+        self._criterion_when_watering.retune(min_value=stop_humidity)
+        self._criterion_when_draining.retune(max_value=min_humidity)
+        if self._dosing:
+            self._dosing.retune(target, tolerance, settings['pump_duration'])
+        else:
+            self._pump_criterion.retune(max_value=max_humidity)
+        self._cap.retune(settings['pump_cap_time'])
+        self._cooldown_watering.retune(settings['sensor_cooldown_period_watering'])
+        self._cooldown_draining.retune(settings['sensor_cooldown_period_draining'])
+        self._pump_duration = settings['pump_duration']
+        self._settings = settings
+        self._version = version
+
+    def _acknowledge(self, response: dict) -> None:
+        if self._mqtt_client:
+            self._mqtt_client.publish(f'{self.name()}/config/applied'.encode(), json.dumps(response).encode())
+
+    def _saved(self) -> dict:
+        saved = dict(self._settings)
+        saved['version'] = self._version
+        return saved
+
+    def _load(self) -> None:
+        """ Applies the saved settings, validated as if received, or keeps
+            the defaults if they are invalid. """
+        try:
+            with open(self._config_path) as f:
+                saved = json.load(f)
+        except OSError:
+            return  # Nothing saved yet
+        except ValueError as e:
+            print(f'Loading {self._config_path} failed: {e}')
+            return
+        try:
+            version = int(saved.get('version', 0))
+            settings = tune(self._settings, {key: saved[key] for key in TUNABLE if key in saved})
+        except (ValueError, KeyError, TypeError, AttributeError) as e:
+            print(f'Invalid {self._config_path}, keeping the defaults: {e}')
+            return
+        self._apply(settings, version)
+
+    def _save(self) -> None:
+        """ Writes a new file and renames it over the old one, so a reset while saving keeps either. """
+        if not self._config_path:
+            return
+        try:
+            with open(self._config_path + '.new', 'w') as f:
+                json.dump(self._saved(), f)
+            os.rename(self._config_path + '.new', self._config_path)
+        except OSError as e:
+            print(f'Saving {self._config_path} failed: {e}')
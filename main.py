@@ -1,36 +1,35 @@
-import utime
+import machine
 import network
 import ubinascii
 import ssl
-from machine import Pin, Timer  # There are 15 timers available, use carefully!
+from machine import Pin
 from functools import partial
+from history import HistoryServer
+from idle import Idle
 from irrigation import Irrigation
 from umqtt.simple import MQTTClient
 from mqtt import Receiver
 from password import wifi, hivemq
-from config import humidity_config, pump_config, sensor_config
-from observable import Observable, ObservableValue, ObservableSum
-from pump import Pump
+from plan import Plan
+from config import diag_config, history_config, humidity_config, publish_config, pump_config, sensor_config, sensor_curves, supply_config, trace_config, zones_config
+from diag import Diagnostics
+from pump import Pump, PumpScheduler
+from runtime import Runtime
+from sampler import Sampler
 from sensor import MoistureSensor
+from telemetry import TelemetryLog
+from timers import SoftTimer  # All timers share a single hardware timer
+from tracing import Trace
+from uplink import Uplink
 
 
-# Reset the machine every 24h in order to reset caps
-TWENTYFOUR_HOURS_IN_MILLISECONDS = 1_000 * 60 * 60 * 24
-Timer(-1).init(period=TWENTYFOUR_HOURS_IN_MILLISECONDS, mode=Timer.ONE_SHOT, callback=lambda time: machine.reset())
-
 buzz = Pin(15, Pin.OUT)
-pumps = [Pump(Pin(pin, Pin.OUT), name=f'Pump') for pin in range(2, 6)]
+supply = PumpScheduler(**supply_config)  # The pumps share one relay board and supply
+pumps = [Pump(Pin(pin, Pin.OUT), name=f'Pump', scheduler=supply) for pin in range(2, 6)]
 leds = [Pin(pin, Pin.OUT, value=0) for pin in range(7, 11)]
 buttons = [Pin(pin, Pin.IN, machine.Pin.PULL_UP) for pin in range(11, 15)]
-sensors = [MoistureSensor(Pin(pin), name='Moisture', period=1_000, **sensor_config) for pin in range(26, 29)]
-
-
-def beep(buzz: Pin, duration: int = 100, times = 1):
-    for i in range(times):
-        buzz.high()
-        utime.sleep_ms(duration)
-        buzz.low()
-        utime.sleep_ms(duration)
+sensors = [MoistureSensor(Pin(pin), name='Moisture', curve=curve, **sensor_config) for pin, curve in zip(range(26, 29), sensor_curves)]
+sampler = Sampler(sensors, period=1_000, oversample=8)  # One burst reads all sensors
 
 
 # Manual pump control
@@ -52,10 +51,7 @@ for button, pump in zip(buttons, pumps):
     #button.irq(trigger=machine.Pin.IRQ_FALLING, handler=partial(start, button, pump))
 
 
-beep(buzz, times=1)
-
-
-# WLAN setup
+# WLAN setup, the runtime waits for the connection
 wlan = network.WLAN(network.STA_IF)
 wlan.active(True)
 wlan.connect(wifi.get('ssid'), wifi.get('password'))
@@ -74,41 +70,67 @@ client = MQTTClient(
     keepalive=600,
     ssl=ssl_context
 )
-receiver = Receiver(client)
-
-for i in range(10):
-    utime.sleep(1)
-    print('Waiting for WLAN connection...')
-    if wlan.isconnected():
-        beep(buzz, times=2)
-        break
-    
-if not wlan.isconnected():
-    client = None
+uplink = Uplink(client, wlan, TelemetryLog('telemetry'), retry_period=0)  # Store and forward, the runtime reconnects
+receiver = Receiver(uplink)
+
+if diag_config['period']:
+    Diagnostics(uplink, **diag_config).start()  # Before the irrigations in order to watch them
+if trace_config['capacity']:
+    Trace(**trace_config).start()  # Before the irrigations in order to watch them
+
+if zones_config['arrays']:
+    # All zones in one engine of parallel arrays, as on a gateway with many zones, without dosing, histories, cap LEDs
+    # and batching; Diagnostics and Trace only watch the sensors, as the zones are not observables of their own
+    if publish_config['publish_interval']:
+        raise ValueError('publish_interval is not supported with arrays')
+    from zones import Zones  # Only loaded when used
+    engine = Zones(['Gurka', 'Paprika', 'Hallon', 'Rabarber'], [sensors[0], sensors[1], sensors[2], sensors[2]],
+                   [pumps[0]._pin, pumps[3]._pin, pumps[1]._pin, pumps[2]._pin], uplink,
+                   max_running=supply_config['max_running'], path='zones', echo=publish_config['echo'], **humidity_config,
+                   **{key: pump_config[key] for key in ('pump_duration', 'pump_cap_time', 'pump_cap_window')})
+    receiver.subscribe(b'+/Pump', engine.command)
+    receiver.subscribe(b'+/config', engine.configure)
+    irrigations = [engine]
 else:
-    ip = wlan.ifconfig()[0]
-    print(f'Connected on {ip}')
-    status = client.connect()
-    print(f'MQTT client connected with status {status}')
-    if status == 0:
-        beep(buzz, times=3)
-    else:
-        client = None
-
-# Irrigation setup
-irrigations = []
-irrigations.append(Irrigation('Gurka',    sensors[0], pumps[0], client, **pump_config, **humidity_config, pump_cap_pin=leds[0]))
-irrigations.append(Irrigation('Paprika',  sensors[1], pumps[3], client, **pump_config, **humidity_config, pump_cap_pin=leds[3]))
-irrigations.append(Irrigation('Hallon',   sensors[2], pumps[1], client, **pump_config, **humidity_config, pump_cap_pin=leds[1]))
-irrigations.append(Irrigation('Rabarber', sensors[2], pumps[2], client, **pump_config, **humidity_config, pump_cap_pin=leds[2]))
-
-for irr in irrigations:
-    topic = bytes(f'{irr.name()}/Pump', 'utf-8')
-    receiver.subscribe(topic, lambda msg, irr=irr: irr._start_pump(int(msg.decode('utf-8'))))  # Force capture of irr
-
-
-while True:
-    machine.idle()
-    Observable.next_callback()
-    if client:
-        client.check_msg()
+    # Irrigation setup, with histories queried on <zone>/history/get
+    histories = HistoryServer(uplink, **history_config)
+    irrigations = []
+    irrigations.append(Irrigation('Gurka',    sensors[0], pumps[0], uplink, **pump_config, **humidity_config, **publish_config, pump_cap_pin=leds[0], pump_cap_path='Gurka.cap', history=histories, config_path='Gurka.cfg'))
+    irrigations.append(Irrigation('Paprika',  sensors[1], pumps[3], uplink, **pump_config, **humidity_config, **publish_config, pump_cap_pin=leds[3], pump_cap_path='Paprika.cap', history=histories, config_path='Paprika.cfg'))
+    irrigations.append(Irrigation('Hallon',   sensors[2], pumps[1], uplink, **pump_config, **humidity_config, **publish_config, pump_cap_pin=leds[1], pump_cap_path='Hallon.cap', history=histories, config_path='Hallon.cfg'))
+    irrigations.append(Irrigation('Rabarber', sensors[2], pumps[2], uplink, **pump_config, **humidity_config, **publish_config, pump_cap_pin=leds[2], pump_cap_path='Rabarber.cap', history=histories, config_path='Rabarber.cfg'))
+
+    # Propagate each reading through the whole graph in one pass
+    plan = Plan(sensors)
+
+    # Commands to the zones, <zone>/Pump runs the pump of the zone for the period given in ms,
+    # <zone>/config changes its settings, e.g. {"version": 2, "max_humidity": 70}
+    zones = {bytes(irr.name(), 'utf-8'): irr for irr in irrigations}
+
+    def pump_command(topic: bytes, msg: bytes) -> None:
+        irr = zones.get(topic.split(b'/')[0])
+        if irr:
+            try:
+                period = int(msg.decode('utf-8'))
+            except (ValueError, UnicodeError):
+                period = 0
+            if period > 0:  # A period of 0 would run the pump until stopped
+                irr._start_pump(period)
+            else:
+                receiver.rejected(topic, msg)
+
+    def config_command(topic: bytes, msg: bytes) -> None:
+        irr = zones.get(topic.split(b'/')[0])
+        if irr:
+            irr.configure(msg)
+
+    receiver.subscribe(b'+/Pump', pump_command)
+    receiver.subscribe(b'+/config', config_command)
+    receiver.subscribe(b'+/history/get', histories.request)
+
+
+# Sleep until the next deadline rather than spinning, report the duty cycle every hour
+idle = Idle(max_sleep=1_000)
+SoftTimer().init(period=60 * 60 * 1_000, mode=SoftTimer.PERIODIC, callback=idle.report)
+
+Runtime(irrigations, uplink, wlan, buzz=buzz, poll=1_000, idle=idle).run()
@@ -1,57 +1,253 @@
+import json
 from functools import partial
 from observable import Observable
+from scheduler import Deferred
+from timers import SoftTimer
+from tracing import Trace
 
 
 class ObservableValuePublisher:
     
-    """ MQTT publisher for ObservableValues. """
+    """ MQTT publisher for ObservableValues. The value is handed to
+        the client unformatted, see Uplink. """
+    
+    __slots__ = ('_topic', '_client', '_retain', '_qos', '_publish_subscription', '_print_subscription')
     
     def __init__(self,
                  client: MQTTClient,
                  observable: ObservableValue,
                  base_topic: str = '',
                  retain: bool = False,
-                 qos: int = 0) -> None:
-        self._topic = f'{base_topic}/{observable.name()}'
-        self._observable = observable
-        self._publish_callback = lambda obs: client.publish(self._topic, str(obs.value), retain=retain, qos=qos) if client else lambda obs: None
-        self._print_callback = lambda obs: print(self._topic, obs.value)
+                 qos: int = 0,
+                 echo: bool = True) -> None:
+        self._topic = f'{base_topic}/{observable.name()}'.encode()
+        self._client = client
+        self._retain = retain
+        self._qos = qos
+        self._publish_subscription = observable.subscribe(self._publish, enabled=False)
+        self._print_subscription = observable.subscribe(self._print, enabled=False) if echo else None
         self.activate()
         
     def __del__(self) -> None:
         self.deactivate()
         
     def activate(self) -> None:
-        self._observable.subscribe(self._publish_callback)
-        self._observable.subscribe(self._print_callback)
+        self._publish_subscription.enable()
+        if self._print_subscription:
+            self._print_subscription.enable()
         
     def deactivate(self) -> None:
-        self._observable.unsubscribe(self._publish_callback)
-        self._observable.unsubscribe(self._print_callback)
+        self._publish_subscription.disable()
+        if self._print_subscription:
+            self._print_subscription.disable()
+    
+    def _publish(self, observable: ObservableValue) -> None:
+        if self._client:
+            self._client.publish(self._topic, observable.value, retain=self._retain, qos=self._qos)
+    
+    def _print(self, observable: ObservableValue) -> None:
+        print(self._topic.decode(), observable.value)
+
+
+class Outbox:
+    
+    """ Batched MQTT publisher collecting the latest values of several
+        ObservableValues. Changed values are published together as one
+        JSON object on <base_topic>/batch once per period. While the
+        Uplink is disconnected the values are instead published one by
+        one on their own topics, so that they are logged for replay. """
+    
+    def __init__(self,
+                 client: MQTTClient,
+                 base_topic: str = '',
+                 period: int = 30_000,
+                 retain: bool = False,
+                 qos: int = 0,
+                 echo: bool = False) -> None:
+        self._client = client
+        self._base_topic = base_topic
+        self._topic = f'{base_topic}/batch'.encode()
+        self._retain = retain
+        self._qos = qos
+        self._echo = echo
+        self._entries = []
+        self._dirty = False
+        self._payload = bytearray()
+        self._flush_deferred = Deferred(self.flush, self)
+        self._timer = SoftTimer()
+        self._timer.init(period=period, mode=SoftTimer.PERIODIC, callback=self._due)
+    
+    def publisher(self, observable: ObservableValue) -> OutboxEntry:
+        entry = OutboxEntry(self, observable)
+        self._entries.append(entry)
+        return entry
+    
+    def _due(self, t: SoftTimer) -> None:
+        if self._dirty:  # Publish from the main loop rather than the timer callback
+            Observable.scheduler.post(self._flush_deferred)
+    
+    def flush(self, arg=None) -> None:
+        if not self._dirty:
+            return
+        self._dirty = False
+        if self._client and not self._client.isconnected():
+            for entry in self._entries:
+                if entry._dirty:
+                    entry._dirty = False
+                    self._client.publish(entry._topic, entry._source.value)
+            return
+        payload = self._payload
+        payload[:] = b'{'
+        for entry in self._entries:
+            if entry._dirty:
+                entry._dirty = False
+                if len(payload) > 1:
+                    payload.extend(b',')
+                payload.extend(entry._key)
+                payload.extend(json.dumps(entry._source.value).encode())
+        payload.extend(b'}')
+        if self._client:
+            self._client.publish(self._topic, payload, retain=self._retain, qos=self._qos)
+        if self._echo:
+            print(self._topic.decode(), payload.decode())
+
+
+class OutboxEntry:
+    
+    """ Marks the value of an ObservableValue for the next publish of an Outbox
+        while active. Has the same interface as ObservableValuePublisher. """
+    
+    __slots__ = ('_outbox', '_topic', '_key', '_source', '_dirty', '_subscription')
+    
+    def __init__(self, outbox: Outbox, observable: ObservableValue) -> None:
+        self._outbox = outbox
+        self._topic = f'{outbox._base_topic}/{observable.name()}'.encode()
+        self._key = f'"{observable.name()}":'.encode()
+        self._source = observable
+        self._dirty = False
+        self._subscription = observable.subscribe(self._mark)
+    
+    def activate(self) -> None:
+        self._subscription.enable()
+    
+    def deactivate(self) -> None:
+        self._subscription.disable()
+    
+    def _mark(self, observable: ObservableValue) -> None:
+        self._source = observable  # A Cooldown notifies with the wrapped Observable
+        self._dirty = True
+        self._outbox._dirty = True
+
+
+class TopicNode(Observable):
+    
+    """ A level of the topic trie of a Receiver, keyed by the topic segment
+        as bytes, or by + and # for the wildcards. The subscribers of the
+        filter ending at this level are notified with the node, holding the
+        topic and the message received. """
+    
+    __slots__ = ('children', 'topic', 'msg')
+    
+    def __init__(self, name: bytes) -> None:
+        super().__init__(name)
+        self.children = {}
+        self.topic = None
+        self.msg = None
+    
+    def child(self, segment: bytes) -> TopicNode:
+        node = self.children.get(segment)
+        if node is None:
+            node = self.children[segment] = TopicNode(segment)
+        return node
 
 
 class Receiver:
     
+    """ Dispatches the messages received by an MQTT client to the callbacks
+        subscribed to matching topic filters, which may contain the + and #
+        wildcards. The filters are kept in a trie of TopicNodes, so a topic
+        is matched level by level in time proportional to its depth rather
+        than to the number of filters. Topics are bytes and never decoded.
+        Each filter is subscribed to at the broker once, however many
+        callbacks it has. Messages matching no filter are counted rather
+        than raising from the main loop, as are those a callback rejects
+        as invalid. 
+        
+        The callbacks are called with the topic and the message. """
+    
     def __init__(self, client: MQTTClient) -> None:
         self._client = client
-        self._observables = {}
+        self._root = TopicNode(b'')
+        self._unmatched = 0
+        self._invalid = 0
         client.set_callback(self.dispatch)
-        
-    def dispatch(self, topic: str, msg: str) -> None:
+    
+    def unmatched(self) -> int:
+        """ The number of messages received matching no subscription. """
+        return self._unmatched
+    
+    def invalid(self) -> int:
+        """ The number of messages rejected by their callbacks. """
+        return self._invalid
+    
+    def rejected(self, topic: bytes, msg: bytes) -> None:
+        """ Counts a message a callback could not handle. """
+        print(f'Invalid message: {topic} {msg}')
+        self._invalid += 1
+    
+    def dispatch(self, topic: bytes, msg: bytes) -> None:
         print(f'Received: {topic} {msg}')
-        try:
-            self._observables[topic].notify(msg)
-        except KeyError as e:
-            raise e
-        
-    def subscribe(self, topic: str, callback: Callable) -> None:
-        if self._client and topic not in self._observables:
-            self._observables[topic] = Observable()
-            self._client.subscribe(topic)
-        self._observables[topic].subscribe(callback)
+        if Trace.active:
+            Trace.active.message(topic, msg)
+        levels = topic.split(b'/')
+        depth = len(levels)
+        stack = [self._root, 0]  # Nodes left to match and their levels
+        matched = False
+        while stack:
+            level = stack.pop()
+            node = stack.pop()
+            wildcards = level or not topic.startswith(b'$')  # System topics are not matched by leading wildcards
+            if wildcards:
+                multi = node.children.get(b'#')
+                if multi is not None:
+                    matched = self._notify(multi, topic, msg) or matched
+            if level == depth:
+                matched = self._notify(node, topic, msg) or matched
+                continue
+            child = node.children.get(levels[level])
+            if child is not None:
+                stack.append(child)
+                stack.append(level + 1)
+            if wildcards:
+                single = node.children.get(b'+')
+                if single is not None:
+                    stack.append(single)
+                    stack.append(level + 1)
+        if not matched:
+            self._unmatched += 1
+    
+    def _notify(self, node: TopicNode, topic: bytes, msg: bytes) -> bool:
+        if not node._subscriptions:
+            return False
+        node.topic = topic
+        node.msg = msg
+        node.notify()
+        return True
+    
+    @staticmethod
+    def _call(callback: Callable, node: TopicNode) -> None:
+        callback(node.topic, node.msg)
+    
+    def subscribe(self, topic_filter: bytes, callback: Callable) -> Subscription:
+        segments = topic_filter.split(b'/')
+        if b'#' in segments[:-1] or any(len(s) > 1 and (b'+' in s or b'#' in s) for s in segments):
+            raise ValueError(f'Invalid topic filter: {topic_filter}')
+        node = self._root
+        for segment in segments:
+            node = node.child(segment)
+        if self._client and not node._subscriptions:
+            self._client.subscribe(topic_filter)
+        return node.subscribe(partial(Receiver._call, callback))
         
-    def unsubscribe(self, topic: str, callback: Callable) -> None:
-        try:
-            self._observables[topic].unsubscribe(callback)
-        except KeyError as e:
-            pass
+    def unsubscribe(self, subscription: Subscription) -> None:
+        subscription.detach()
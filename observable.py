@@ -1,5 +1,39 @@
-from functools import partial
-from machine import Timer
+import utime
+from diag import Diagnostics
+from scheduler import Deferred, Scheduler
+from timers import SoftTimer
+
+
+class Subscription(Deferred):
+
+    """ The handle of a callback subscribed to an Observable. Enabling and
+        disabling it is a flag flip, detaching it removes it for good. All
+        take constant time and are safe while the Observable notifies. """
+
+    __slots__ = ('enabled', 'attached', 'target', 'due')
+
+    def __init__(self, callback: Callable, owner: Observable, target: Optional[Observable] = None) -> None:
+        super().__init__(callback, owner)
+        self.enabled = False
+        self.attached = True
+        self.target = target  # The Observable the callback updates, if any, see Plan
+        self.due = False  # Notified through a Plan, but not yet called
+
+    def enable(self) -> None:
+        if self.attached and not self.enabled:
+            self.enabled = True
+            self.owner._enabled(1)
+
+    def disable(self) -> None:
+        if self.enabled:
+            self.enabled = False
+            self.owner._enabled(-1)
+
+    def detach(self) -> None:
+        if self.attached:
+            self.disable()
+            self.attached = False
+            self.owner._detached()
 
 
 class Observable:
@@ -7,15 +41,32 @@ class Observable:
     """ An Observable can be subscribed to with a callback that is
         called when notify is called passing along the Observable. 
         Due to the limited callstack depth in MicroPython (30),
-        deferred Observables will instead store callbacks in a static
-        list for execution at a later stage when appropriate. """   
+        deferred Observables will instead post callbacks to a shared
+        Scheduler for execution at a later stage when appropriate.
+        Each Subscription is its own Deferred, so notifying allocates nothing.
+        
+        subscribe returns a Subscription, which is enabled, disabled or
+        detached rather than looked up again. Detached subscriptions are
+        removed lazily, once they make up half of the list and no notify is
+        in progress, so the callbacks may change the subscriptions.
+        
+        Observables compiled into a Plan notify through it instead.
+        
+        The core classes declare __slots__ to keep instances compact under
+        CPython, Micropython accepts but ignores them. """   
 
-    deferred_callbacks = []
+    __slots__ = ('_name', '_defer', '_subscriptions', '_stale', '_notifying', '_plan', '_rank')
+
+    scheduler = Scheduler()
         
     def __init__(self, name: Optional[str] = None, defer: bool = False) -> None:
         self._name = name
         self._defer = defer
-        self._callbacks = []
+        self._subscriptions = []
+        self._stale = 0  # Detached subscriptions not yet removed
+        self._notifying = 0
+        self._plan = None
+        self._rank = 0  # Position in the Plan
         
     def name(self) -> str:
         return self._name
@@ -26,36 +77,84 @@ class Observable:
         return self._defer
             
     def notify(self, msg=None):
-        for callback in self._callbacks:
-            if self._defer:
-                Observable.deferred_callbacks.append(partial(callback, msg or self))
-                #print(f'Deferring a callback, now have {len(Observable.deferred_callbacks)} defered!')
-            else:
-                callback(msg or self)
-
-    def subscribe(self, callback: Callable) -> None:
-        if callback not in self._callbacks:
-            self._callbacks.append(callback)
-
-    def unsubscribe(self, callback) -> None:
+        if Diagnostics.active:
+            Diagnostics.active.notified(self)
+        if self._plan is not None:
+            for subscription in self._subscriptions:
+                if subscription.enabled:
+                    subscription.due = True
+            self._plan.mark(self, msg)
+        elif self._defer:
+            for subscription in self._subscriptions:
+                if subscription.enabled:
+                    Observable.scheduler.post(subscription, msg or self)
+        else:
+            self._dispatch(msg)
+
+    def _dispatch(self, msg=None, due: bool = False) -> None:
+        """ Calls the enabled callbacks, or those that are due. """
+        diag = Diagnostics.active
+        self._notifying += 1  # Detached subscriptions stay in the list meanwhile
         try:
-            self._callbacks.remove(callback)
-        except ValueError as e:
-            pass
+            for subscription in self._subscriptions:
+                if due:
+                    if not subscription.due:
+                        continue
+                    subscription.due = False
+                elif not subscription.enabled:
+                    continue
+                if diag:
+                    start = utime.ticks_us()
+                    subscription.callback(msg or self)
+                    diag.called(self, utime.ticks_diff(utime.ticks_us(), start))
+                else:
+                    subscription.callback(msg or self)
+        finally:
+            self._notifying -= 1
+        if self._stale and 2 * self._stale >= len(self._subscriptions):
+            self._compact()
+
+    def subscribe(self, callback: Callable, enabled: bool = True, target: Optional[Observable] = None) -> Subscription:
+        subscription = Subscription(callback, self, target)
+        self._subscriptions.append(subscription)
+        if enabled:
+            subscription.enable()
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription) -> None:
+        subscription.detach()
+
+    def _enabled(self, change: int) -> None:
+        pass  # Called with 1 or -1 when a subscription is enabled or disabled
+
+    def _detached(self) -> None:
+        self._stale += 1
+        if 2 * self._stale >= len(self._subscriptions):
+            self._compact()
+
+    def _compact(self) -> None:
+        if self._notifying:
+            return
+        subscriptions = self._subscriptions
+        j = 0
+        for subscription in subscriptions:
+            if subscription.attached:
+                subscriptions[j] = subscription
+                j += 1
+        del subscriptions[j:]
+        self._stale = 0
      
     @classmethod 
-    def next_callback(cls):
-        if cls.deferred_callbacks:
-            callback = Observable.deferred_callbacks.pop()  # LIFO
-            #print(f'Popped a callback and now have {len(Observable.deferred_callbacks)}')
-            callback()
-        
+    def run_deferred(cls, budget: int = 0) -> int:
+        return cls.scheduler.run(budget)
 
 
 class ObservableValue(Observable):
     
     """ A simple value which setter calls notify. """
     
+    __slots__ = ('_value',)
+    
     def __init__(self, name: str, defer: bool = True) -> None:
         super().__init__(name, defer)
         self._value = None
@@ -74,10 +173,12 @@ class ObservableSum(ObservableValue):
     
     """ Sums the values from setter. """
     
+    __slots__ = ()
+    
     def __init__(self, observable: ObservableValue) -> None:
         super().__init__(observable.name(), observable.defer_notifications())
         self.reset()
-        observable.subscribe(self.update)
+        observable.subscribe(self.update, target=self)
     
     def name(self) -> str:
         return f'Sum({super().name()})'
@@ -91,29 +192,38 @@ class ObservableSum(ObservableValue):
 
 class Cooldown(Observable):
     
-    """ A wrapper of an Observable if less frequent notifications is desired. """
+    """ A wrapper of an Observable if less frequent notifications is desired.
+        The Observable is only observed while a subscription is enabled. """
+    
+    __slots__ = ('_period', '_observable', '_source', '_timer', '_listeners')
     
     def __init__(self,
                  observable: Observable,
                  period: int) -> None:
         super().__init__(observable.name())
-        self._callback = partial(self._start, period)
+        self._period = period
         self._observable = observable
-        self._timer = Timer(-1)
+        self._source = observable.subscribe(self._start, enabled=False, target=self)
+        self._timer = SoftTimer()
+        self._listeners = 0
         
-    def subscribe(self, callback) -> None:
-        super().subscribe(callback)
-        self._observable.subscribe(self._callback)
+    def _enabled(self, change: int) -> None:
+        self._listeners += change
+        if not self._listeners:
+            self._timer.deinit()
+            self._source.disable()
+        elif self._listeners == change:
+            self._source.enable()
     
-    def unsubscribe(self, callback) -> None:
-        super().unsubscribe(callback)
-        self._timer.deinit()
-        self._observable.unsubscribe(self._callback)
+    def retune(self, period: int) -> None:
+        """ Changes the period, effective from the next notification. """
+        self._period = period
     
-    def _start(self, period: int, observable: Observable) -> None:
-        self._timer.init(period=period, mode=Timer.ONE_SHOT, callback=self._stop)
-        self._observable.unsubscribe(self._callback)
+    def _start(self, observable: Observable) -> None:
+        self._timer.init(period=self._period, mode=SoftTimer.ONE_SHOT, callback=self._stop)
+        self._source.disable()
         self.notify(self._observable)
         
-    def _stop(self, t: Timer) -> None:
-        self._observable.subscribe(self._callback)
+    def _stop(self, t: SoftTimer) -> None:
+        if self._listeners:
+            self._source.enable()
@@ -1,29 +1,110 @@
 import utime
-from machine import Pin, Timer
+from machine import Pin
 from observable import ObservableValue
+from timers import SoftTimer
+from tracing import Trace
 
 
 class Pump(ObservableValue):
-    
+
+    """ A pump on a relay. start runs it at once, while request leaves it
+        to the PumpScheduler of the supply if there is one. """
+
+    __slots__ = ('_pin', '_timer', '_scheduler', '_requested')
+
     def __init__(self,
                  pin: Pin,
-                 name: Optional[str] = None) -> None:
+                 name: Optional[str] = None,
+                 scheduler: Optional[PumpScheduler] = None) -> None:
         super().__init__(name or str(pin))
         self._pin = pin
-        self._timer = Timer(-1)
+        self._timer = SoftTimer()
+        self._scheduler = scheduler
+        self._requested = 0  # Period of the pending request
         self.stop()
-        
+
+    def request(self, period: int) -> None:
+        if self._scheduler:
+            self._scheduler.request(self, period)
+        else:
+            self.start(period)
+
     def start(self, period: int = 0) -> None:
         if self.isrunning():
             return
         self._pin.off()  # Relay module operates this way.
+        if Trace.active:
+            Trace.active.pump_started(self, period)
         self.value = period
         if period:
-            self._timer.init(period=period, mode=Timer.ONE_SHOT, callback=self.stop)
-        
-    def stop(self, t: Optional[Timer] = None) -> None:
+            self._timer.init(period=period, mode=SoftTimer.ONE_SHOT, callback=self.stop)
+
+    def stop(self, t: Optional[SoftTimer] = None) -> None:
         self._timer.deinit()
+        if Trace.active and self.isrunning():
+            Trace.active.pump_stopped(self)
         self._pin.on()  # Relay module operates this way.
-        
+        if self._scheduler:
+            self._scheduler.stopped(self)
+
     def isrunning(self) -> bool:
         return not self._pin.value()
+
+
+class PumpScheduler:
+
+    """ Queues the requested runs of the pumps sharing a supply. At most
+        max_running pumps run at once and starts are at least spacing
+        milliseconds apart, to keep the inrush currents of the relays and
+        pumps from adding up. Pending runs are started in the order they
+        were requested, one per pump, so a zone requesting again before its
+        turn coalesces into its pending run, keeping the longest period,
+        rather than getting ahead of the others. A request for a running
+        pump is dropped, as Pump.start does. """
+
+    def __init__(self, max_running: int = 1, spacing: int = 500) -> None:
+        self._max_running = max_running
+        self._spacing = spacing
+        self._queue = []
+        self._running = []
+        self._last_start = None
+        self._dispatch_callback = self._dispatch  # Micropython does not implement 3.8+ behavior for equality of member functions
+        self._timer = SoftTimer()
+
+    def pending(self) -> int:
+        return len(self._queue)
+
+    def running(self) -> int:
+        return len(self._running)
+
+    def request(self, pump: Pump, period: int) -> None:
+        if pump.isrunning() or period <= 0:
+            return
+        if pump._requested:
+            pump._requested = max(pump._requested, period)
+            return
+        pump._requested = period
+        self._queue.append(pump)
+        self._dispatch()
+
+    def stopped(self, pump: Pump) -> None:
+        if pump in self._running:
+            self._running.remove(pump)
+            self._dispatch()
+
+    def _dispatch(self, t: Optional[SoftTimer] = None) -> None:
+        while self._queue and len(self._running) < self._max_running:
+            if self._last_start is not None:
+                wait = self._spacing - utime.ticks_diff(utime.ticks_ms(), self._last_start)
+                if wait > 0:
+                    if not self._timer.active():
+                        self._timer.init(period=wait, mode=SoftTimer.ONE_SHOT, callback=self._dispatch_callback)
+                    return
+            pump = self._queue.pop(0)
+            period = pump._requested
+            pump._requested = 0
+            if pump.isrunning():  # Started directly meanwhile
+                continue
+            self._running.append(pump)
+            self._last_start = utime.ticks_ms()
+            pump.start(period)
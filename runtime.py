@@ -0,0 +1,131 @@
+try:
+    import asyncio
+except ImportError:
+    import uasyncio as asyncio
+import machine
+import utime
+from observable import Observable
+from timers import SoftTimer
+
+
+def sleep_ms(ms: int):
+    return asyncio.sleep_ms(ms) if hasattr(asyncio, 'sleep_ms') else asyncio.sleep(ms / 1_000)
+
+
+async def beep(buzz: Pin, duration: int = 100, times: int = 1, sleep: Callable = sleep_ms) -> None:
+    for i in range(times):
+        buzz.high()
+        await sleep(duration)
+        buzz.low()
+        await sleep(duration)
+
+
+class Runtime:
+
+    """ Runs the irrigations as asyncio tasks: one task drains the deferred
+        callbacks, one task per Irrigation starts it after a staggered delay
+        and one task connects, reconnects and services the Uplink. Nothing
+        blocks apart from the MQTT connect itself, which is only attempted
+        once the WLAN reports a link.
+        
+        Given an Idle, the dispatch task sleeps whenever no deferred
+        callbacks are pending and the other tasks have had their turn, until
+        the nearest deadline of the timers, the MQTT keepalive or the tasks.
+        The tasks therefore sleep through _sleep, which records when they
+        are due to wake, so that a beep or a poll is not held up. """
+
+    def __init__(self,
+                 irrigations: list,
+                 uplink: Uplink,
+                 wlan: Optional[WLAN] = None,
+                 buzz: Optional[Pin] = None,
+                 budget: int = 20,
+                 stagger: int = 1_000,
+                 poll: int = 100,
+                 retry_period: int = 30_000,
+                 idle: Optional[Idle] = None) -> None:
+        self._irrigations = irrigations
+        self._uplink = uplink
+        self._wlan = wlan
+        self._buzz = buzz
+        self._budget = budget
+        self._stagger = stagger
+        self._poll = poll
+        self._retry_period = retry_period
+        self._wakes = []  # Ticks at which the tasks sleeping in _sleep are due
+        self._idle = idle
+        if idle:
+            idle.add_source(SoftTimer.service.next_deadline)
+            idle.add_source(uplink.next_ping)
+            idle.add_source(self._until_wake)
+
+    async def dispatch(self) -> None:
+        while True:
+            Observable.run_deferred(self._budget)
+            await sleep_ms(0)  # Let the ready tasks run, and record when they wake, before sleeping
+            if Observable.scheduler.depth():
+                continue
+            if self._idle:
+                self._idle.sleep()
+            else:
+                machine.idle()
+                await sleep_ms(1)
+
+    def _until_wake(self) -> Optional[int]:
+        now = utime.ticks_ms()
+        ms = None
+        for wake in self._wakes:
+            left = max(0, utime.ticks_diff(wake, now))
+            if ms is None or left < ms:
+                ms = left
+        return ms
+
+    async def _sleep(self, ms: int) -> None:
+        wake = utime.ticks_add(utime.ticks_ms(), ms)
+        self._wakes.append(wake)
+        try:
+            await sleep_ms(ms)
+        finally:
+            self._wakes.remove(wake)
+
+    async def zone(self, irrigation: Irrigation, delay: int) -> None:
+        await self._sleep(delay)  # Do not start everything simultaneously
+        irrigation.start()
+
+    async def network(self) -> None:
+        linked = False
+        while True:
+            if self._wlan and not self._wlan.isconnected():
+                linked = False
+                await self._sleep(self._poll)
+                continue
+            if not linked:
+                linked = True
+                print(f'Connected on {self._wlan.ifconfig()[0]}' if self._wlan else 'Connected')
+                self._beep(2)
+            if self._uplink.isconnected():
+                if self._uplink.next_ping() == 0:
+                    self._uplink.ping()
+                self._uplink.check_msg()
+                await self._sleep(self._poll)
+                continue
+            status = self._uplink.connect()
+            print(f'MQTT client connected with status {status}')
+            if status == 0:
+                self._beep(3)
+            else:
+                await self._sleep(self._retry_period)
+
+    def _beep(self, times: int) -> None:
+        if self._buzz:
+            asyncio.create_task(beep(self._buzz, times=times, sleep=self._sleep))
+
+    async def main(self) -> None:
+        self._beep(1)
+        tasks = [asyncio.create_task(self.dispatch()), asyncio.create_task(self.network())]
+        for i, irrigation in enumerate(self._irrigations):
+            tasks.append(asyncio.create_task(self.zone(irrigation, i * self._stagger)))
+        await asyncio.gather(*tasks)
+
+    def run(self) -> None:
+        asyncio.run(self.main())
@@ -0,0 +1,52 @@
+from array import array
+from timers import SoftTimer
+
+
+class Sampler:
+
+    """ Reads the ADC of all sensors in one burst per period. Each channel
+        is oversampled into a preallocated buffer and filtered, using the
+        median or a trimmed mean, into a single reading per sensor. """
+
+    MEDIAN = 0
+    TRIMMED_MEAN = 1
+
+    def __init__(self,
+                 sensors: list,
+                 period: int = 1_000,
+                 oversample: int = 8,
+                 filter: int = MEDIAN,
+                 trim: int = 2) -> None:
+        self._sensors = sensors
+        self._oversample = oversample
+        self._filter = filter
+        self._trim = min(trim, (oversample - 1) // 2)
+        self._buffer = array('H', [0] * (len(sensors) * oversample))
+        self._timer = SoftTimer()
+        if period:
+            self._timer.init(period=period, mode=SoftTimer.PERIODIC, callback=self.sample)
+
+    def sample(self, t: Optional[SoftTimer] = None) -> None:
+        buffer, sensors, n = self._buffer, self._sensors, self._oversample
+        for k in range(n):  # Interleave the channels to spread out any disturbance
+            for i in range(len(sensors)):
+                buffer[i * n + k] = sensors[i].read()
+        for i in range(len(sensors)):
+            sensors[i].sample(self._reduce(i * n))
+
+    def _reduce(self, start: int) -> int:
+        buffer, n = self._buffer, self._oversample
+        for i in range(start + 1, start + n):  # Insertion sort in place
+            reading = buffer[i]
+            j = i - 1
+            while j >= start and buffer[j] > reading:
+                buffer[j + 1] = buffer[j]
+                j -= 1
+            buffer[j + 1] = reading
+        if self._filter == Sampler.MEDIAN:
+            middle = start + n // 2
+            return buffer[middle] if n % 2 else (buffer[middle - 1] + buffer[middle]) // 2
+        total = 0
+        for i in range(start + self._trim, start + n - self._trim):
+            total += buffer[i]
+        return total // (n - 2 * self._trim)
@@ -0,0 +1,144 @@
+import utime
+from diag import Diagnostics
+
+
+class Deferred:
+
+    """ A callback that is pending in a Scheduler at most once at a time.
+        Created once per subscription and reused for every post, so that
+        posting allocates nothing. """
+
+    __slots__ = ('callback', 'owner', 'slot')
+
+    def __init__(self, callback: Callable, owner=None) -> None:
+        self.callback = callback
+        self.owner = owner  # Reported to Diagnostics
+        self.slot = -1  # Position in the Scheduler while pending
+
+
+class Scheduler:
+
+    """ A fixed-capacity FIFO ring buffer of Deferred callbacks in
+        preallocated parallel lists. Only the latest pending argument is
+        kept per Deferred, so repeated notifications of the same
+        subscription coalesce into one entry. When full, the oldest entry
+        is dropped.
+
+        Timer callbacks may post while preempting the main loop in the
+        middle of modifying the queue. Such posts go to a small ring that
+        only they advance the end of, and are moved into the queue once the
+        main loop is done, like TimerService defers a missed run. """
+
+    LATE = 8  # Posts held while the queue is being modified
+
+    def __init__(self, capacity: int = 128) -> None:
+        self._capacity = capacity
+        self._deferreds = [None] * capacity
+        self._args = [None] * capacity
+        self._head = 0
+        self._count = 0
+        self._dropped = 0
+        self._high_water = 0
+        self._busy = False  # The queue is being modified
+        self._late = [None] * Scheduler.LATE
+        self._late_args = [None] * Scheduler.LATE
+        self._late_in = 0  # Only advanced by a preempting post
+        self._late_out = 0  # Only advanced by the main loop
+        self._late_dropped = 0
+
+    def depth(self) -> int:
+        return self._count
+
+    def dropped(self) -> int:
+        return self._dropped + self._late_dropped
+
+    def high_water(self) -> int:
+        return self._high_water
+
+    def post(self, deferred: Deferred, arg=None) -> None:
+        if self._busy:
+            self._post_late(deferred, arg)
+            return
+        self._busy = True
+        if deferred.slot >= 0:
+            self._args[deferred.slot] = arg  # Coalesce, keep the position in the queue
+        else:
+            self._push(deferred, arg)
+        self._busy = False
+        if self._late_in != self._late_out:
+            self._release()
+
+    def _post_late(self, deferred: Deferred, arg) -> None:
+        slot = self._late_in
+        following = slot + 1 if slot + 1 < Scheduler.LATE else 0
+        if following == self._late_out:
+            self._late_dropped += 1
+            return
+        self._late[slot] = deferred
+        self._late_args[slot] = arg
+        self._late_in = following
+
+    def _release(self) -> None:
+        """ Moves the late posts into the queue. """
+        while True:
+            self._busy = True
+            while self._late_out != self._late_in:
+                slot = self._late_out
+                deferred, arg = self._late[slot], self._late_args[slot]
+                self._late[slot] = self._late_args[slot] = None
+                self._late_out = slot + 1 if slot + 1 < Scheduler.LATE else 0
+                self._push(deferred, arg)
+            self._busy = False
+            if self._late_out == self._late_in:  # Else posted late after the check above
+                return
+
+    def _push(self, deferred: Deferred, arg) -> None:
+        if deferred.slot >= 0:
+            self._args[deferred.slot] = arg
+            return
+        if self._count == self._capacity:
+            self._pop()
+            self._dropped += 1
+        slot = self._head + self._count
+        if slot >= self._capacity:
+            slot -= self._capacity
+        self._deferreds[slot] = deferred
+        self._args[slot] = arg
+        deferred.slot = slot
+        self._count += 1
+        if self._count > self._high_water:
+            self._high_water = self._count
+
+    def _pop(self) -> Deferred:
+        slot = self._head
+        deferred = self._deferreds[slot]
+        deferred.slot = -1
+        self._deferreds[slot] = self._args[slot] = None
+        self._head = slot + 1 if slot + 1 < self._capacity else 0
+        self._count -= 1
+        return deferred
+
+    def run(self, budget: int = 0) -> int:
+        """ Runs pending callbacks in FIFO order until the queue is empty or
+            budget milliseconds have passed (0 means no limit). At least one
+            callback is run if any is pending. Returns the number run. """
+        start = utime.ticks_ms()
+        count = 0
+        diag = Diagnostics.active
+        while self._count:
+            self._busy = True
+            arg = self._args[self._head]
+            deferred = self._pop()
+            self._busy = False
+            if self._late_in != self._late_out:
+                self._release()
+            if diag:
+                called = utime.ticks_us()
+                deferred.callback(arg)
+                diag.called(deferred.owner, utime.ticks_diff(utime.ticks_us(), called))
+            else:
+                deferred.callback(arg)
+            count += 1
+            if budget and utime.ticks_diff(utime.ticks_ms(), start) >= budget:
+                break
+        return count
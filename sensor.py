@@ -1,22 +1,34 @@
-from machine import ADC, Pin, Timer
-from observable import ObservableValue
+import utime
+from array import array
+from machine import ADC, Pin
+from observable import Observable, ObservableValue
+from scheduler import Deferred
+from tracing import Trace
 
 
 class Sensor(ObservableValue):
 
-    """ A sensor that measures periodically and transforming the value read from ADC """
+    """ A sensor transforming the value read from ADC. Readings are taken
+        either by measure or handed over by a Sampler. """
+
+    __slots__ = ('_pin',)
 
     def __init__(self,
                  pin: Pin,
-                 name: str,
-                 period: int = 0) -> None:
+                 name: str) -> None:
         super().__init__(name or str(pin))
         self._pin = ADC(pin)
-        if period:
-            Timer(period=period, mode=Timer.PERIODIC, callback=self.measure)
     
-    def measure(self, time: int):
-        self.value = self.transform(self._pin.read_u16())
+    def read(self) -> int:
+        return self._pin.read_u16()
+    
+    def measure(self, time: Optional[int] = None):
+        self.sample(self.read())
+    
+    def sample(self, reading: int) -> None:
+        if Trace.active:
+            Trace.active.sampled(self, reading)
+        self.value = self.transform(reading)
         
     def transform(self, reading):
         return reading
@@ -24,17 +36,131 @@ class Sensor(ObservableValue):
 
 class MoistureSensor(Sensor):
     
+    """ A capacitive moisture sensor giving the humidity in integer percent.
+        The calibration curve is piecewise linear through (reading, percent)
+        points, by default a line from 0 % at max_reading to 100 % at
+        min_reading, and spans the readings of its first and last point.
+        It is precomputed into a lookup table of fixed-point percent, with 8
+        fractional bits, every 1 << SHIFT readings, so a sample costs an
+        index and an integer interpolation and allocates nothing.
+        
+        Readings beyond the calibrated range by more than fault_margin, or
+        repeated unchanged for stuck_samples, are faults: the value is held
+        rather than updated with a bogus humidity, and fault tells why.
+        With auto_calibrate, readings beyond the range but within the margin
+        extend it instead, moving the curve along with it, so the observed
+        dry and wet extremes become 0 and 100 %. As samples are taken from
+        timer callbacks, the extremes are only recorded there, and the table
+        is rebuilt from the main loop at most once per RECALIBRATION_PERIOD,
+        the readings beyond the range counting as its ends until then. """
+    
+    __slots__ = ('_min_reading', '_max_reading', '_curve', '_table', '_fault_low', '_fault_high',
+                 '_auto_calibrate', '_stuck_samples', '_last_reading', '_repeats', '_fault', '_low', '_high',
+                 '_calibrated', '_calibrate_deferred')
+    
+    SHIFT = 8  # log2 of the readings between entries of the table
+    OK = 0
+    STUCK = 1
+    OUT_OF_RANGE = 2
+    RECALIBRATION_PERIOD = 60_000  # Minimum ms between rebuilds of the table with auto_calibrate
+    
     def __init__(self,
                  pin: Pin,
                  name: Optional[str] = None,
-                 period: int = 0,
                  min_reading: int = 42800,
-                 max_reading: int = 65535) -> None:
-        super().__init__(pin, name, period)
-        self._min_reading = min_reading
-        self._max_reading = max_reading
+                 max_reading: int = 65535,
+                 curve: Optional[tuple] = None,
+                 auto_calibrate: bool = False,
+                 fault_margin: Optional[int] = None,
+                 stuck_samples: int = 300) -> None:
+        super().__init__(pin, name)
+        self._curve = sorted(curve) if curve else [(min_reading, 100), (max_reading, 0)]
+        min_reading, max_reading = self._curve[0][0], self._curve[-1][0]
+        if fault_margin is None:
+            fault_margin = (max_reading - min_reading) // 4
+        self._fault_low = min_reading - fault_margin
+        self._fault_high = max_reading + fault_margin
+        self._auto_calibrate = auto_calibrate
+        self._stuck_samples = stuck_samples
+        self._last_reading = -1
+        self._repeats = 0
+        self._fault = MoistureSensor.OK
+        self._table = None
+        self._calibrate_deferred = Deferred(self._recalibrate, self)
+        self.calibrate(min_reading, max_reading)
+        self._calibrated = utime.ticks_add(self._calibrated, -MoistureSensor.RECALIBRATION_PERIOD)  # Extend at once
+    
+    def calibrate(self, min_reading: int, max_reading: int) -> None:
+        """ Fits the calibration curve to the range [min_reading, max_reading]
+            and rebuilds the lookup table. """
+        low, high = self._curve[0][0], self._curve[-1][0]
+        if (low, high) != (min_reading, max_reading):
+            scale = (max_reading - min_reading) / max(1, high - low)
+            self._curve = [(round(min_reading + (reading - low) * scale), percent) for reading, percent in self._curve]
+        self._min_reading = self._low = min_reading
+        self._max_reading = self._high = max_reading
+        self._calibrated = utime.ticks_ms()
+        size = ((max_reading - min_reading) >> MoistureSensor.SHIFT) + 2
+        table = array('H', bytes(2 * size))
+        curve = self._curve
+        j = 0
+        for i in range(size):
+            reading = min_reading + (i << MoistureSensor.SHIFT)  # The last entry extrapolates
+            while j < len(curve) - 2 and reading > curve[j + 1][0]:
+                j += 1
+            (r0, p0), (r1, p1) = curve[j], curve[j + 1]
+            percent = p0 + (p1 - p0) * (reading - r0) / max(1, r1 - r0)
+            table[i] = round(256 * min(100, max(0, percent)))
+        self._table = table
+    
+    def _recalibrate(self, arg=None) -> None:
+        self.calibrate(self._low, self._high)
+
+    def calibration(self) -> tuple:
+        """ The range and curve currently calibrated, e.g. to be saved. """
+        return self._min_reading, self._max_reading, tuple(self._curve)
+    
+    def fault(self) -> int:
+        return self._fault
+    
+    def sample(self, reading: int) -> None:
+        if Trace.active:
+            Trace.active.sampled(self, reading)
+        if reading == self._last_reading:
+            if self._repeats < self._stuck_samples:
+                self._repeats += 1
+        else:
+            self._last_reading = reading
+            self._repeats = 0
+        if reading < self._fault_low or reading > self._fault_high:
+            fault = MoistureSensor.OUT_OF_RANGE
+        elif self._stuck_samples and self._repeats == self._stuck_samples:
+            fault = MoistureSensor.STUCK
+        else:
+            fault = MoistureSensor.OK
+        if fault != self._fault:
+            self._fault = fault
+            if fault:
+                print(f'{self.name()} faulty: {"stuck" if fault == MoistureSensor.STUCK else "out of range"} at {reading}')
+        if fault:
+            return
+        if self._auto_calibrate:
+            if reading < self._low:
+                self._low = reading
+            elif reading > self._high:
+                self._high = reading
+            if ((self._low < self._min_reading or self._high > self._max_reading)
+                    and utime.ticks_diff(utime.ticks_ms(), self._calibrated) >= MoistureSensor.RECALIBRATION_PERIOD):
+                Observable.scheduler.post(self._calibrate_deferred)
+        self.value = self.transform(reading)
         
-    def transform(self, reading: int) -> float:
-        if reading == self._min_reading:
-            return 100.0  # Probably faulty...
-        return 100.0 * (self._max_reading - reading) / (self._max_reading - self._min_reading)
+    def transform(self, reading: int) -> int:
+        offset = reading - self._min_reading
+        if offset <= 0:
+            return (self._table[0] + 128) >> 8
+        if reading >= self._max_reading:
+            offset = self._max_reading - self._min_reading
+        i = offset >> MoistureSensor.SHIFT
+        low = self._table[i]
+        fixed = low + (((self._table[i + 1] - low) * (offset & 0xFF)) >> MoistureSensor.SHIFT)
+        return (fixed + 128) >> 8
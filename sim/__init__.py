@@ -0,0 +1,18 @@
+""" Discrete-event simulation of irrigation zones on a virtual clock.
+
+    The real Irrigation, Controller, criteria, Pump and Sensor classes run
+    on the host stand-ins driven by a VirtualClock, which jumps straight to
+    the next timer deadline, while a Soil model per zone turns pump time
+    into moisture readings. Days of watering take seconds:
+
+    python -m sim --zones 200 --days 7 --set pump_duration=3000
+
+    A Trace recorded on the device, or by the simulation with --trace, is
+    replayed through the same classes by python -m sim.replay.
+
+    python -m sim.sweep evaluates thousands of settings at once in a NumPy
+    batch model of the same control and emits a config.py with the best. """
+
+from .clock import VirtualClock  # noqa: F401
+from .plant import Soil  # noqa: F401
+from .simulation import Simulation  # noqa: F401
@@ -0,0 +1,62 @@
+""" Simulates zones with the settings of config.py, optionally overridden:
+
+    python -m sim --zones 100 --days 3 --set max_humidity=70 --set pump_duration=3000 """
+
+import argparse
+import json
+import statistics
+import time
+
+from .simulation import DAY, Simulation
+
+
+def parse_settings(settings: list) -> dict:
+    parsed = {}
+    for setting in settings:
+        key, _, value = setting.partition('=')
+        parsed[key] = float(value) if '.' in value else int(value)
+    return parsed
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(prog='python -m sim', description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--zones', type=int, default=4)
+    parser.add_argument('--days', type=float, default=1.0)
+    parser.add_argument('--sample-period', type=int, default=1_000, help='ms between sensor readings')
+    parser.add_argument('--oversample', type=int, default=8, help='ADC readings per sensor reading')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--set', action='append', default=[], metavar='KEY=VALUE',
+                        help='override a humidity_config, pump_config, sensor_config or supply_config setting')
+    parser.add_argument('--soil', action='append', default=[], metavar='KEY=VALUE',
+                        help='override a Soil parameter, e.g. flow or evaporation')
+    parser.add_argument('--no-plan', action='store_true', help='propagate hop by hop through the Scheduler')
+    parser.add_argument('--trace', metavar='PATH', help='record a trace for python -m sim.replay')
+    parser.add_argument('--json', action='store_true', help='print the statistics of every zone as JSON')
+    args = parser.parse_args()
+
+    import config
+    settings = parse_settings(args.set)
+    configs = {name: {key: value for key, value in settings.items() if key in getattr(config, name)}
+               for name in ('humidity_config', 'pump_config', 'sensor_config', 'supply_config')}
+    unknown = set(settings) - {key for c in configs.values() for key in c}
+    if unknown:
+        parser.error(f'unknown settings: {", ".join(sorted(unknown))}')
+
+    start = time.perf_counter()
+    simulation = Simulation(zones=args.zones, sample_period=args.sample_period, oversample=args.oversample, seed=args.seed,
+                            soil_config=parse_settings(args.soil), plan=not args.no_plan, trace=args.trace, **configs)
+    simulation.run(int(args.days * DAY))
+    elapsed = time.perf_counter() - start
+    summary = simulation.summary()
+    if args.json:
+        print(json.dumps(summary, indent=1))
+        return
+    print(f'Simulated {args.zones} zones for {args.days} days in {elapsed:.1f} s')
+    for key in ('time_in_band', 'pump_starts_per_day', 'pump_ms_per_day', 'watering_cycles_per_day', 'lowest', 'highest'):
+        values = [zone[key] for zone in summary]
+        print(f'{key:>24}: mean {statistics.mean(values):10.3f}  min {min(values):10.3f}  max {max(values):10.3f}')
+
+
+if __name__ == '__main__':
+    main()
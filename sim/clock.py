@@ -0,0 +1,28 @@
+""" A virtual clock for the host stand-ins. """
+
+from host.clock import Clock
+
+
+class VirtualClock(Clock):
+
+    """ A Clock that never waits: time only advances when the device code
+        sleeps or when run_until jumps to the next timer deadline. """
+
+    def __init__(self) -> None:
+        super().__init__()
+        self._now_us = 0
+
+    def now_us(self) -> int:
+        return self._now_us
+
+    def _wait(self, ms: int) -> None:
+        self._now_us += ms * 1_000
+
+    def run_until(self, ms: int, between=None) -> None:
+        """ Fires all timers up to ms, calling between after each deadline. """
+        while (deadline := self.next_deadline()) is not None and deadline <= ms:
+            self._now_us = max(self._now_us, deadline * 1_000)
+            self.run_due()
+            if between:
+                between()
+        self._now_us = max(self._now_us, ms * 1_000)
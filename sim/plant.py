@@ -0,0 +1,101 @@
+""" A simple physical model of a pot or bed of soil with a pump. """
+
+import math
+
+from host.machine import Pin
+
+
+class PumpPin(Pin):
+
+    """ A relay pin that lets the Soil catch up before the pump is switched. """
+
+    soil = None
+
+    def value(self, value=None):
+        if value is not None and self.soil:
+            self.soil.update()
+        return super().value(value)
+
+    def on(self) -> None:
+        self.value(1)
+
+    def off(self) -> None:
+        self.value(0)
+
+    high = on
+    low = off
+
+
+class Soil:
+
+    """ Soil moisture in percent of one zone. Water from the pump first
+        collects near the surface and reaches the sensor depth with a time
+        constant, so the sensor lags the pump. Moisture evaporates in
+        proportion to itself. The model is integrated lazily whenever the
+        sensor is read or the PumpPin is switched, which also accumulates
+        the statistics. The sensor
+        noise is Gaussian with a standard deviation of noise percent. """
+
+    def __init__(self,
+                 clock,
+                 pump_pin: PumpPin,
+                 rng,
+                 moisture: float = 50.0,
+                 flow: float = 2.0,
+                 infiltration: float = 120.0,
+                 evaporation: float = 2.0,
+                 noise: float = 0.3,
+                 min_reading: int = 42000,
+                 max_reading: int = 65535,
+                 band: tuple = (0.0, 100.0)) -> None:
+        self._clock = clock
+        self._pump_pin = pump_pin
+        pump_pin.soil = self
+        self.moisture = moisture
+        self.flow = flow  # Percent per pump second
+        self.infiltration = infiltration  # Seconds
+        self.evaporation = evaporation  # Percent of the moisture per hour
+        self._min_reading = min_reading
+        self._max_reading = max_reading
+        self._band = band
+        self._surface = 0.0
+        self._last = clock.now_ms()
+        self._scale = (max_reading - min_reading) / 100
+        self._reading = self._to_reading(moisture)
+        self._noise = [round(rng.gauss(0.0, noise) * self._scale) for _ in range(1024)]
+        self._noise_index = 0
+        self.time_in_band = 0
+        self.time_total = 0
+        self.lowest = self.highest = moisture
+
+    def running(self) -> bool:
+        return not self._pump_pin.value()  # The relay module is active low
+
+    def update(self) -> None:
+        now = self._clock.now_ms()
+        if now <= self._last:
+            return
+        dt = (now - self._last) / 1_000
+        if self._band[0] <= self.moisture <= self._band[1]:
+            self.time_in_band += now - self._last
+        self.time_total += now - self._last
+        self._last = now
+        if self.running():
+            self._surface += self.flow * dt
+        transfer = self._surface * (1.0 - math.exp(-dt / self.infiltration))
+        self._surface -= transfer
+        self.moisture += transfer - self.moisture * self.evaporation / 100 / 3_600 * dt
+        self.moisture = min(100.0, max(0.0, self.moisture))
+        self.lowest = min(self.lowest, self.moisture)
+        self.highest = max(self.highest, self.moisture)
+        self._reading = self._to_reading(self.moisture)
+
+    def _to_reading(self, moisture: float) -> int:
+        """ The inverse of MoistureSensor.transform. """
+        return int(self._max_reading - moisture * self._scale)
+
+    def reading(self) -> int:
+        """ A noisy ADC reading of a moisture sensor. """
+        self.update()
+        self._noise_index = (self._noise_index + 1) & 1023
+        return min(65535, max(0, self._reading + self._noise[self._noise_index]))
@@ -0,0 +1,194 @@
+""" Replays a trace recorded by the device through the real control graph
+    on a VirtualClock, as fast as the host allows, and diffs the decisions
+    taken against the recorded ones:
+
+    python -m sim.replay trace --tolerance 1000 """
+
+import argparse
+import mmap
+import os
+import struct
+
+import host
+
+from .clock import VirtualClock
+
+
+class Replay:
+
+    """ Rebuilds the zones of a Trace with the settings of config.py,
+        optionally overridden, and feeds them the recorded sensor readings
+        and pump commands at their recorded times. The trace files are
+        memory-mapped and replayed from the oldest generation on. Where the
+        device restarted, time starting over, the zones are rebuilt on a new
+        clock as the device did and the times carry on from where they
+        were. Pump starts and state changes are the decisions compared.
+
+        The state the device had saved, such as the Cap of each zone, and
+        the fit of dosing are not part of the trace, so decisions may
+        differ until the replayed zones have caught up with them. """
+
+    def __init__(self,
+                 path: str,
+                 humidity_config: dict = None,
+                 pump_config: dict = None,
+                 sensor_config: dict = None,
+                 supply_config: dict = None,
+                 plan: bool = True) -> None:
+        self.clock = host.install(VirtualClock())
+        import config
+        from observable import Observable
+        from tracing import Trace
+        self._trace = Trace
+        self.humidity_config = {**config.humidity_config, **(humidity_config or {})}
+        self.pump_config = {**config.pump_config, **(pump_config or {})}
+        self.sensor_config = {**config.sensor_config, **(sensor_config or {})}
+        self.supply_config = {**config.supply_config, **(supply_config or {})}
+        self._observable = Observable
+        self._plan = plan
+        with open(path + '.sym', 'rb') as f:
+            self.names = [line[:-1].decode() for line in f]
+        self.files = [f'{path}.{generation}' for generation in range(9, -1, -1) if os.path.exists(f'{path}.{generation}')]
+        self.recorded = []  # (ms, zone, kind, value) as recorded
+        self.replayed = []  # (ms, zone, kind, value) as replayed
+        self.events = 0
+        self.restarts = 0
+        self._offset = 0  # ms replayed before the last restart
+        self._graph = None
+        self._boot()
+
+    def _boot(self) -> None:
+        """ Starts without zones on a new clock, timers and scheduler. """
+        from scheduler import Scheduler
+        from timers import SoftTimer, TimerService
+        if self._graph:
+            self._graph.release()
+        self.clock = host.install(VirtualClock())
+        SoftTimer.service = TimerService()
+        self._observable.scheduler = Scheduler(capacity=256)
+        self.sensors = {}  # Symbol -> MoistureSensor
+        self.pumps = {}  # Symbol -> Pump
+        self.irrigations = {}  # Symbol -> Irrigation
+        self._supply = None
+        self._graph = None
+
+    def now_ms(self) -> int:
+        """ The ms replayed, across restarts. """
+        return self._offset + self.clock.now_ms()
+
+    def _zone(self, zone: int, sensor: int, pump: int) -> None:
+        from irrigation import Irrigation
+        from machine import Pin
+        from pump import Pump, PumpScheduler
+        from sensor import MoistureSensor
+        if zone in self.irrigations:
+            return
+        if self._graph:
+            self._graph.release()  # Compiled again with the sensor of the zone
+        self._graph = None
+        if self._supply is None:
+            self._supply = PumpScheduler(**self.supply_config)  # One for all zones, as main.py
+        if sensor not in self.sensors:
+            self.sensors[sensor] = MoistureSensor(Pin(len(self.sensors)), name='Moisture', **self.sensor_config)
+        self.pumps[pump] = Pump(Pin(100 + len(self.pumps), Pin.OUT), name='Pump', scheduler=self._supply)
+        irrigation = Irrigation(self.names[zone], self.sensors[sensor], self.pumps[pump], None, echo=False,
+                                **self.pump_config, **self.humidity_config)
+        self.irrigations[zone] = irrigation
+        self.pumps[pump].subscribe(lambda p, zone=zone: self.replayed.append((self.now_ms(), zone, 'pump', p.value)))
+        irrigation.subscribe(lambda i, zone=zone: self.replayed.append((self.now_ms(), zone, 'state', int(i.value == 'Watering'))))
+        irrigation.start()
+        self._drain()
+
+    def _build(self) -> None:
+        from plan import Plan
+        self._graph = Plan(list(self.sensors.values())) if self._plan else False
+
+    def _drain(self) -> None:
+        while self._observable.scheduler.depth():
+            self._observable.run_deferred()
+
+    def run(self) -> int:
+        """ Replays the trace. Returns the number of records replayed. """
+        Trace = self._trace
+        zones = {}  # Pump symbol -> zone symbol
+        last = 0
+        for path in self.files:
+            with open(path, 'rb') as f:
+                if not os.fstat(f.fileno()).st_size:
+                    continue
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                    size = len(mapped) - len(mapped) % Trace.SIZE
+                    for ms, kind, source, aux, value in struct.iter_unpack(Trace.FORMAT, memoryview(mapped)[:size]):
+                        if ms < last:  # The device restarted
+                            self._offset += self.clock.now_ms()
+                            self._boot()
+                            self.restarts += 1
+                            zones = {}
+                        last = ms
+                        if kind == Trace.ZONE:
+                            zones[value] = source
+                            self._zone(source, aux, value)
+                            continue
+                        if self._graph is None and kind == Trace.SENSOR:
+                            self._build()
+                        self.clock.run_until(ms, between=self._drain)
+                        self.events += 1
+                        if kind == Trace.SENSOR and source in self.sensors:
+                            self.sensors[source].sample(value)
+                        elif kind == Trace.PUMP_START and source in zones:
+                            self.recorded.append((self._offset + ms, zones[source], 'pump', value))
+                        elif kind == Trace.STATE:
+                            self.recorded.append((self._offset + ms, source, 'state', value))
+                        elif kind == Trace.MESSAGE:
+                            self._message(self.names[source], value)
+                        self._drain()
+        return self.events
+
+    def _message(self, topic: str, value: int) -> None:
+        """ Replays the pump commands of main.py. """
+        zone, _, command = topic.partition('/')
+        for symbol, irrigation in self.irrigations.items():
+            if self.names[symbol] == zone and command == 'Pump' and value >= 0:
+                irrigation._start_pump(value)
+
+    def diff(self, tolerance: int = 1_000) -> list:
+        """ The decisions that differ, per zone and kind in order, as
+            (zone, kind, recorded, replayed) with either None if missing. """
+        mismatches = []
+        for zone in sorted({z for ms, z, k, value in self.recorded + self.replayed}):
+            for kind in ('pump', 'state'):
+                recorded = [(ms, value) for ms, z, k, value in self.recorded if z == zone and k == kind]
+                replayed = [(ms, value) for ms, z, k, value in self.replayed if z == zone and k == kind]
+                for i in range(max(len(recorded), len(replayed))):
+                    a = recorded[i] if i < len(recorded) else None
+                    b = replayed[i] if i < len(replayed) else None
+                    if a is None or b is None or a[1] != b[1] or abs(a[0] - b[0]) > tolerance:
+                        mismatches.append((self.names[zone], kind, a, b))
+        return mismatches
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(prog='python -m sim.replay', description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('path', help='path of the trace, without the .sym or generation suffix')
+    parser.add_argument('--tolerance', type=int, default=1_000, help='ms decisions may differ in time')
+    parser.add_argument('--limit', type=int, default=20, help='mismatches to print')
+    parser.add_argument('--no-plan', action='store_true', help='propagate hop by hop through the Scheduler')
+    args = parser.parse_args()
+
+    import time
+    start = time.perf_counter()
+    replay = Replay(args.path, plan=not args.no_plan)
+    events = replay.run()
+    elapsed = time.perf_counter() - start
+    mismatches = replay.diff(args.tolerance)
+    print(f'Replayed {events} records of {len(replay.irrigations)} zones, {replay.now_ms() / 1_000:.0f} s, '
+          f'{replay.restarts} restarts, in {elapsed:.2f} s')
+    print(f'{len(replay.recorded)} decisions recorded, {len(replay.replayed)} replayed, {len(mismatches)} differ')
+    for zone, kind, recorded, replayed in mismatches[:args.limit]:
+        print(f'{zone:>12} {kind:>5}  recorded {recorded}  replayed {replayed}')
+    raise SystemExit(1 if mismatches else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,121 @@
+""" Builds and runs zones of the real control graph on a VirtualClock. """
+
+import random
+
+import host
+
+from .clock import VirtualClock
+from .plant import PumpPin, Soil
+
+DAY = 24 * 60 * 60 * 1_000
+
+
+class ZoneStats:
+
+    """ Pump starts and pump time of one zone, counted from the Pump's notifications. """
+
+    def __init__(self) -> None:
+        self.pump_starts = 0
+        self.pump_time = 0
+        self.watering_cycles = 0
+
+    def pump_started(self, pump) -> None:
+        self.pump_starts += 1
+        self.pump_time += pump.value
+
+    def state_changed(self, irrigation) -> None:
+        if irrigation.value == 'Watering':
+            self.watering_cycles += 1
+
+
+class Simulation:
+
+    """ Runs zones of Irrigation with MoistureSensor, Sampler and Pump, each
+        watering a Soil, on a VirtualClock. Since the device code keeps its
+        state in classes (the deferred Scheduler and the TimerService), there
+        can only be one Simulation per process. """
+
+    def __init__(self,
+                 zones: int = 4,
+                 sample_period: int = 1_000,
+                 oversample: int = 8,
+                 humidity_config: dict = None,
+                 pump_config: dict = None,
+                 sensor_config: dict = None,
+                 soil_config: dict = None,
+                 supply_config: dict = None,
+                 seed: int = 0,
+                 plan: bool = True,
+                 trace: str = None) -> None:
+        self.clock = host.install(VirtualClock())
+        import config
+        from irrigation import Irrigation
+        from machine import Pin
+        from observable import Observable
+        from plan import Plan
+        from pump import Pump, PumpScheduler
+        from sampler import Sampler
+        from scheduler import Scheduler
+        from sensor import MoistureSensor
+        from tracing import Trace
+
+        self.humidity_config = {**config.humidity_config, **(humidity_config or {})}
+        self.pump_config = {**config.pump_config, **(pump_config or {})}
+        self.sensor_config = {**config.sensor_config, **(sensor_config or {})}
+        self.supply_config = {**config.supply_config, **(supply_config or {})}
+        Observable.scheduler = Scheduler(capacity=64 * zones)
+        self._observable = Observable
+        self._trace = Trace
+        rng = random.Random(seed)
+        band = (self.humidity_config['min_humidity'], self.humidity_config['max_humidity'])
+        if trace:  # Recorded for sim.replay, before the zones in order to watch them
+            Trace(trace, capacity=1 << 20, files=1).start()
+        self.sensors, self.pumps, self.soils, self.irrigations, self.stats = [], [], [], [], []
+        self.supplies = []
+        for i in range(zones):
+            if not i % 4:  # One relay board and supply per 4 zones, as main.py
+                self.supplies.append(PumpScheduler(**self.supply_config))
+            sensor = MoistureSensor(Pin(2 * i), name='Moisture', **self.sensor_config)
+            pump = Pump(PumpPin(2 * i + 1, Pin.OUT), name='Pump', scheduler=self.supplies[-1])
+            soil = Soil(self.clock, pump._pin, random.Random(rng.random()),
+                        moisture=rng.uniform(*band), band=band, min_reading=self.sensor_config['min_reading'],
+                        max_reading=self.sensor_config['max_reading'], **(soil_config or {}))
+            sensor._pin.source = soil.reading
+            irrigation = Irrigation(f'Zone{i}', sensor, pump, None, echo=False, **self.pump_config, **self.humidity_config)
+            stats = ZoneStats()
+            pump.subscribe(stats.pump_started)
+            irrigation.subscribe(stats.state_changed)
+            irrigation.start()
+            for collection, item in zip((self.sensors, self.pumps, self.soils, self.irrigations, self.stats),
+                                        (sensor, pump, soil, irrigation, stats)):
+                collection.append(item)
+        self.plan = Plan(self.sensors) if plan else None  # As main.py does
+        self.sampler = Sampler(self.sensors, period=sample_period, oversample=oversample)
+        self._drain()
+
+    def _drain(self) -> None:
+        while self._observable.scheduler.depth():
+            self._observable.run_deferred()
+
+    def run(self, ms: int) -> None:
+        """ Runs the zones for ms of virtual time. """
+        self.clock.run_until(self.clock.now_ms() + ms, between=self._drain)
+        for soil in self.soils:
+            soil.update()
+        if self._trace.active:
+            self._trace.active.flush()
+
+    def summary(self) -> list:
+        """ One dict of statistics per zone. """
+        days = max(1, self.clock.now_ms()) / DAY
+        return [{
+            'zone': irrigation.name(),
+            'state': irrigation.value,
+            'moisture': round(soil.moisture, 1),
+            'lowest': round(soil.lowest, 1),
+            'highest': round(soil.highest, 1),
+            'time_in_band': round(soil.time_in_band / max(1, soil.time_total), 3),
+            'pump_starts_per_day': round(stats.pump_starts / days, 1),
+            'pump_ms_per_day': round(stats.pump_time / days),
+            'watering_cycles_per_day': round(stats.watering_cycles / days, 2),
+        } for irrigation, soil, stats in zip(self.irrigations, self.soils, self.stats)]
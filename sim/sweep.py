@@ -0,0 +1,278 @@
+""" Sweeps humidity_config and pump_config settings through a NumPy batch
+    model of Irrigation, ranks them and emits a config.py with the best:
+
+    python -m sim.sweep --grid min_humidity=30,35,40 --grid pump_duration=2000,5000 --output config.py
+
+    Only watering in fixed bursts of pump_duration is modelled, so the
+    emitted config.py turns pump_dosing off. """
+
+import argparse
+import itertools
+import os
+import re
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+DAY = 24 * 60 * 60 * 1_000
+BUCKETS = 24  # Of Cap
+
+GRID = {
+    'min_humidity': (25.0, 30.0, 35.0, 40.0, 45.0),
+    'max_humidity': (55.0, 60.0, 65.0, 70.0, 75.0, 80.0),
+    'pump_duration': (2_000, 5_000, 10_000, 20_000),
+    'pump_cap_time': (15_000, 30_000, 60_000, 120_000, 240_000),
+}
+SOIL = {  # Ranges the soils are drawn from, around the defaults of Soil
+    'flow': (1.0, 4.0),
+    'infiltration': (60.0, 240.0),
+    'evaporation': (1.0, 3.0),
+}
+
+
+def batch(params: dict, soils: dict, days: float, step: int = 1_000, noise: float = 0.15, band: tuple = (30.0, 75.0),
+          seed: int = 0) -> dict:
+    """ Runs every parameter set against every soil at once and returns the
+        statistics per parameter set, averaged over the soils.
+
+        The model follows Irrigation with pump_dosing off. The humidity is
+        sampled every step and rounded to integer percent as MoistureSensor
+        does, with Gaussian noise of the filtered reading. Draining switches
+        to watering at or below min_humidity, and watering back to draining
+        at or above max_humidity. While watering, every sample at or below
+        max_humidity starts a burst of pump_duration unless the pump is
+        running or the pump time within the sliding window of the Cap has
+        reached pump_cap_time. The pump is counted against the Cap when it
+        starts, in the bucket of the ring of the Cap at that time. The soil
+        is integrated as Soil does, once per step. The pump is assumed to
+        have the supply of its own, and the sensor cooldowns only throttle
+        what is published, so neither is modelled. """
+    rng = np.random.default_rng(seed)
+    sets, count = len(next(iter(params.values()))), len(next(iter(soils.values())))
+    rows = sets * count  # Every parameter set against every soil, flattened
+    p = {key: np.repeat(np.asarray(value, dtype=np.float64), count) for key, value in params.items()}
+    s = {key: np.tile(np.asarray(value, dtype=np.float64), sets) for key, value in soils.items()}
+    dt = step / 1_000
+    flow = s['flow'] / 1_000
+    transfer_rate = 1.0 - np.exp(-dt / s['infiltration'])
+    retained = 1.0 - s['evaporation'] / 100 / 3_600 * dt
+    bucket_ms = (p['pump_cap_window'] // BUCKETS).astype(np.int64)
+    periods = {int(period): np.nonzero(bucket_ms == period)[0] for period in np.unique(bucket_ms)}
+
+    moisture = s['moisture'].copy()
+    surface = np.zeros(rows)
+    watering = np.zeros(rows, dtype=bool)
+    remaining = np.zeros(rows)  # ms left of the running burst
+    buckets = np.zeros((rows, BUCKETS))
+    total = np.zeros(rows)
+    stats = {key: np.zeros(rows) for key in ('in_band', 'pump_ms', 'pump_starts', 'watering_cycles', 'watering_ms')}
+    lowest, highest = moisture.copy(), moisture.copy()
+    running, transfer, value, start, scratch = np.zeros(rows), np.zeros(rows), np.zeros(rows), np.zeros(rows, bool), np.zeros(rows, bool)
+
+    steps = int(days * DAY) // step
+    for i in range(1, steps + 1):
+        now = i * step
+        for period, indices in periods.items():
+            if not now % period:  # The ring of the Cap moves on
+                current = (now // period) % BUCKETS
+                total[indices] -= buckets[indices, current]
+                buckets[indices, current] = 0.0
+
+        np.minimum(remaining, step, out=running)
+        remaining -= running
+        running *= flow
+        surface += running
+        np.multiply(surface, transfer_rate, out=transfer)
+        surface -= transfer
+        moisture *= retained
+        moisture += transfer
+        np.clip(moisture, 0.0, 100.0, out=moisture)
+        np.minimum(lowest, moisture, out=lowest)
+        np.maximum(highest, moisture, out=highest)
+        np.greater_equal(moisture, band[0], out=start)
+        np.less_equal(moisture, band[1], out=scratch)
+        start &= scratch
+        stats['in_band'] += start
+        stats['watering_ms'] += watering
+
+        np.add(moisture.reshape(sets, count), noise * rng.standard_normal(count), out=value.reshape(sets, count))
+        value += 0.5
+        np.floor(value, out=value)
+        np.less_equal(value, p['max_humidity'], out=start)
+        start &= watering
+        np.equal(remaining, 0.0, out=scratch)
+        start &= scratch
+        np.less(total, p['pump_cap_time'], out=scratch)
+        start &= scratch
+        if start.any():
+            indices = np.nonzero(start)[0]
+            duration = p['pump_duration'][indices]
+            remaining[indices] = duration
+            total[indices] += duration
+            buckets[indices, (now // bucket_ms[indices]) % BUCKETS] += duration
+            stats['pump_ms'][indices] += duration
+            stats['pump_starts'][indices] += 1
+        np.greater_equal(value, p['max_humidity'], out=scratch)
+        scratch &= watering
+        watering ^= scratch  # Stopped
+        np.less_equal(value, p['min_humidity'], out=scratch)
+        scratch &= ~watering
+        stats['watering_cycles'] += scratch
+        watering |= scratch  # Started
+
+    days = steps * step / DAY
+    stats = {key: value.reshape(sets, count) for key, value in stats.items()}
+    return {
+        'time_in_band': stats['in_band'].mean(axis=1) / steps,
+        'worst_time_in_band': stats['in_band'].min(axis=1) / steps,
+        'pump_ms_per_day': stats['pump_ms'].mean(axis=1) / days,
+        'pump_starts_per_day': stats['pump_starts'].mean(axis=1) / days,
+        'watering_cycles_per_day': stats['watering_cycles'].mean(axis=1) / days,
+        'watering_share': stats['watering_ms'].mean(axis=1) / steps,
+        'lowest': lowest.reshape(sets, count).min(axis=1),
+        'highest': highest.reshape(sets, count).max(axis=1),
+    }
+
+
+def sweep(grid: dict, fixed: dict, soils: dict, days: float, workers: int = None, **kwargs) -> tuple:
+    """ Evaluates the cartesian product of grid, with fixed for the other
+        settings, in chunks spread over a process pool. Returns the
+        parameter sets and their statistics, as dicts of arrays. """
+    keys = list(grid)
+    combinations = np.array(list(itertools.product(*grid.values())), dtype=np.float64).reshape(-1, len(keys))
+    params = {key: combinations[:, i] for i, key in enumerate(keys)}
+    for key, value in fixed.items():
+        params.setdefault(key, np.full(len(combinations), float(value)))
+    workers = workers or os.cpu_count() or 1
+    chunks = np.array_split(np.arange(len(combinations)), min(len(combinations), workers))
+    with ProcessPoolExecutor(workers) as pool:
+        futures = [pool.submit(batch, {key: value[chunk] for key, value in params.items()}, soils, days, **kwargs)
+                   for chunk in chunks]
+        results = [future.result() for future in futures]
+    return params, {key: np.concatenate([result[key] for result in results]) for key in results[0]}
+
+
+def rank(stats: dict, tolerance: float = 0.01) -> np.ndarray:
+    """ The order of the parameter sets, best first: by time in band in
+        steps of tolerance, then the water used, then the pump starts. """
+    return np.lexsort((stats['pump_starts_per_day'], stats['pump_ms_per_day'],
+                       -np.floor(stats['time_in_band'] / tolerance)))
+
+
+def draw_soils(count: int, band: tuple, seed: int = 0) -> dict:
+    rng = np.random.default_rng(seed)
+    soils = {key: rng.uniform(low, high, count) for key, (low, high) in SOIL.items()}
+    soils['moisture'] = rng.uniform(band[0], band[1], count)
+    return soils
+
+
+def format_value(value) -> str:
+    """ A setting as written in config.py. """
+    if isinstance(value, bool) or isinstance(value, float):
+        return repr(value)
+    if value and not value % (60 * 60 * 1_000):
+        return f'{value // (60 * 60 * 1_000)} * 60 * 60 * 1_000'
+    if not value % 1_000:
+        return f'{value // 1_000} * 1_000'
+    return f'{value:_}'
+
+
+def emit(source: str, settings: dict) -> str:
+    """ source, the text of a config.py, with the values of settings
+        replaced and everything else, the comments included, kept. """
+    for key, value in settings.items():
+        source, count = re.subn(rf"('{key}':\s*)[^,#\n]+?(\s*(?:,|#|\n))", rf'\g<1>{format_value(value)}\g<2>', source, count=1)
+        if not count:
+            raise ValueError(f'{key} not found in config.py')
+    return source
+
+
+def setting(key: str, value: float):
+    """ A swept value as the type of its setting in config.py. """
+    return float(value) if key.endswith('_humidity') else int(round(value))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(prog='python -m sim.sweep', description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--grid', action='append', default=[], metavar='KEY=V1,V2,...',
+                        help='values of a humidity_config or pump_config setting to sweep, replacing its default')
+    parser.add_argument('--soils', type=int, default=8, help='soils drawn to evaluate every parameter set against')
+    parser.add_argument('--days', type=float, default=1.0)
+    parser.add_argument('--step', type=int, default=1_000, help='ms between sensor readings')
+    parser.add_argument('--band', type=float, nargs=2, metavar=('LOW', 'HIGH'),
+                        help='humidity range time in band is measured against, by default that of config.py')
+    parser.add_argument('--tolerance', type=float, default=0.01, help='time in band considered equal when ranking')
+    parser.add_argument('--workers', type=int, help='processes, by default one per core')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--top', type=int, default=10, help='parameter sets to print')
+    parser.add_argument('--check', action='store_true', help='also run the best through the real control graph of sim')
+    parser.add_argument('--output', metavar='PATH', help='write config.py with the best parameter set')
+    args = parser.parse_args()
+
+    import config
+    grid = dict(GRID)
+    for entry in args.grid:
+        key, _, values = entry.partition('=')
+        if key not in config.humidity_config and key not in config.pump_config:
+            parser.error(f'unknown setting: {key}')
+        grid[key] = tuple(float(value) for value in values.split(','))
+    fixed = {**config.humidity_config, **config.pump_config}
+    band = tuple(args.band or (config.humidity_config['min_humidity'], config.humidity_config['max_humidity']))
+    soils = draw_soils(args.soils, band, args.seed)
+
+    start = time.perf_counter()
+    params, stats = sweep(grid, {key: fixed[key] for key in ('min_humidity', 'max_humidity', 'pump_duration',
+                                                             'pump_cap_time', 'pump_cap_window')},
+                          soils, args.days, args.workers, step=args.step, band=band, seed=args.seed)
+    elapsed = time.perf_counter() - start
+    count = len(stats['time_in_band'])
+    print(f'Evaluated {count} parameter sets on {args.soils} soils for {args.days} days in {elapsed:.1f} s, '
+          f'{count * args.soils * args.days / elapsed:,.0f} zone days/s')
+
+    order = rank(stats, args.tolerance)
+    columns = ('time_in_band', 'worst_time_in_band', 'pump_ms_per_day', 'pump_starts_per_day', 'watering_cycles_per_day')
+    print('  '.join(f'{key:>14}' for key in grid) + '  ' + '  '.join(f'{key[:14]:>14}' for key in columns))
+    for row in order[:args.top]:
+        print('  '.join(f'{params[key][row]:14g}' for key in grid) + '  ' +
+              '  '.join(f'{stats[key][row]:14.3f}' for key in columns))
+
+    best = {key: setting(key, params[key][order[0]]) for key in grid}
+    best['pump_dosing'] = False
+    if args.check:
+        check(best, band, args.days, args.step, args.seed)
+    if args.output:
+        with open(os.path.join(os.path.dirname(os.path.abspath(config.__file__)), 'config.py')) as f:
+            source = f.read()
+        with open(args.output, 'w') as f:
+            f.write(emit(source, best))
+        print(f'Wrote {args.output}')
+
+
+def check(best: dict, band: tuple, days: float, step: int, seed: int) -> None:
+    """ Runs the best parameter set through both the model and the real
+        control graph, and prints them side by side. The model is seeded
+        with the soils the zones of the Simulation start from, and as the
+        model has no shared supply, every zone gets a supply of its own. """
+    from .simulation import Simulation
+    import config
+    humidity_config = {key: value for key, value in best.items() if key in config.humidity_config}
+    pump_config = {key: value for key, value in best.items() if key in config.pump_config}
+    zones = 4
+    simulation = Simulation(zones=zones, sample_period=step, humidity_config=humidity_config, pump_config=pump_config,
+                            supply_config={'max_running': zones, 'spacing': 0}, seed=seed)
+    soils = {key: [getattr(soil, key) for soil in simulation.soils] for key in ('flow', 'infiltration', 'evaporation',
+                                                                              'moisture')}
+    simulation.run(int(days * DAY))
+    summary = simulation.summary()
+    fixed = {**config.humidity_config, **config.pump_config, **best}
+    model = batch({key: [fixed[key]] for key in ('min_humidity', 'max_humidity', 'pump_duration', 'pump_cap_time',
+                                                 'pump_cap_window')}, soils, days, step=step, band=band, seed=seed)
+    for key in ('pump_ms_per_day', 'pump_starts_per_day', 'watering_cycles_per_day'):
+        real = sum(zone[key] for zone in summary) / zones
+        print(f'{key:>24}: model {model[key][0]:10.1f}  sim {real:10.1f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,130 @@
+import struct
+import utime
+
+
+class TelemetryLog:
+
+    """ A fixed-size binary log of published values on the filesystem.
+        Each record holds a sequence number, a timestamp, a symbol id for
+        the topic and a value that is a float, an integer or the symbol id
+        of a string. Symbols are appended to a separate file once. When
+        full, the oldest records are overwritten. Strings are expected to be
+        enumerable, such as state names: once the symbol table holds
+        max_symbols names, new ones are dropped rather than logged. """
+
+    HEADER = '<IIHB'
+    SIZE = struct.calcsize(HEADER) + 4
+    FLOAT = 0
+    INT = 1
+    SYMBOL = 2
+    FORMATS = ('<f', '<i', '<i')
+    CHUNK = 32  # Records read per file access when replaying
+
+    def __init__(self, path: str = 'telemetry', capacity: int = 2048, max_symbols: int = 128) -> None:
+        self._path = path
+        self._capacity = capacity
+        self._max_symbols = max_symbols
+        self._record = bytearray(TelemetryLog.SIZE)
+        self._chunk = bytearray(TelemetryLog.SIZE * TelemetryLog.CHUNK)
+        self._symbols = {}
+        self._names = []
+        self._first = 1  # Sequence number of the oldest record not yet replayed
+        self._next = 1
+        self._dropped = 0
+        self._load()
+
+    def _load(self) -> None:
+        try:
+            with open(self._path + '.sym', 'rb') as f:
+                for line in f:
+                    self._symbols[line[:-1]] = len(self._names)
+                    self._names.append(line[:-1])
+        except OSError:
+            pass
+        try:
+            self._file = open(self._path + '.bin', 'r+b')
+        except OSError:
+            self._file = open(self._path + '.bin', 'w+b')
+            self._file.write(bytes(TelemetryLog.SIZE * self._capacity))
+            self._file.flush()
+        last = 0
+        for i in range(self._capacity):
+            self._file.seek(i * TelemetryLog.SIZE)
+            self._file.readinto(self._record)
+            last = max(last, struct.unpack_from('<I', self._record, 0)[0])
+        self._next = last + 1
+        try:
+            with open(self._path + '.pos', 'r') as f:
+                self._first = int(f.read())
+        except (OSError, ValueError):
+            self._first = 1
+        self._first = min(self._next, max(self._first, self._next - self._capacity))
+        self._restarted = self._next  # Records before were logged with the ticks of a previous boot
+
+    def __len__(self) -> int:
+        return self._next - self._first
+
+    def dropped(self) -> int:
+        return self._dropped
+
+    def symbol(self, name) -> int:
+        if isinstance(name, str):
+            name = name.encode()
+        try:
+            return self._symbols[name]
+        except KeyError:
+            pass
+        with open(self._path + '.sym', 'ab') as f:
+            f.write(name + b'\n')
+        self._symbols[name] = len(self._names)
+        self._names.append(name)
+        return self._symbols[name]
+
+    def append(self, topic, value) -> None:
+        if isinstance(value, str):
+            if len(self._names) >= self._max_symbols and value.encode() not in self._symbols:
+                self._dropped += 1
+                return
+            kind, value = TelemetryLog.SYMBOL, self.symbol(value)
+        elif isinstance(value, float):
+            kind = TelemetryLog.FLOAT
+        else:
+            kind = TelemetryLog.INT
+        record = self._record
+        struct.pack_into(TelemetryLog.HEADER, record, 0, self._next, utime.ticks_ms(), self.symbol(topic), kind)
+        struct.pack_into(TelemetryLog.FORMATS[kind], record, TelemetryLog.SIZE - 4, value)
+        self._file.seek((self._next % self._capacity) * TelemetryLog.SIZE)
+        self._file.write(record)
+        self._file.flush()
+        self._next += 1
+        if self._next - self._first > self._capacity:
+            self._first += 1
+            self._dropped += 1
+
+    def replay(self, publish: Callable, limit: int = 0) -> int:
+        """ Calls publish(topic, value, ticks) for up to limit records
+            (0 means all) in the order they were appended. ticks is None
+            for records logged before the last restart. Records are
+            consumed as they are published, so a failing publish can be
+            retried. Returns the number of records published. """
+        count = 0
+        size = TelemetryLog.SIZE
+        chunk = memoryview(self._chunk)
+        while self._first < self._next and (not limit or count < limit):
+            slot = self._first % self._capacity
+            n = min(TelemetryLog.CHUNK, self._next - self._first, self._capacity - slot)
+            self._file.seek(slot * size)
+            self._file.readinto(chunk[:n * size])
+            for i in range(n):
+                if limit and count == limit:
+                    break
+                sequence, ticks, topic, kind = struct.unpack_from(TelemetryLog.HEADER, chunk, i * size)
+                value = struct.unpack_from(TelemetryLog.FORMATS[kind], chunk, i * size + size - 4)[0]
+                publish(self._names[topic], self._names[value] if kind == TelemetryLog.SYMBOL else value,
+                        ticks if sequence >= self._restarted else None)
+                self._first += 1
+                count += 1
+        if count:
+            with open(self._path + '.pos', 'w') as f:
+                f.write(str(self._first))
+        return count
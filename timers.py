@@ -0,0 +1,132 @@
+import utime
+from diag import Diagnostics
+from heapq import heapify, heappop, heappush
+from machine import Timer
+
+
+class TimerService:
+
+    """ Multiplexes any number of SoftTimers onto a single hardware timer.
+        Deadlines are kept in a min-heap and the hardware timer is armed as
+        a one-shot for the earliest one. Time is counted in milliseconds
+        since the service was created, so deadlines never wrap around. """
+
+    def __init__(self, timer_id: int = -1) -> None:
+        self._timer = Timer(timer_id)
+        self._heap = []
+        self._last = utime.ticks_ms()
+        self._now = 0
+        self._armed = None  # The deadline the hardware timer is armed for
+        self._busy = False  # The heap is being modified
+        self._missed = False  # The hardware timer fired while busy
+
+    def now(self) -> int:
+        ticks = utime.ticks_ms()
+        self._now += utime.ticks_diff(ticks, self._last)
+        self._last = ticks
+        return self._now
+
+    def next_deadline(self) -> Optional[int]:
+        """ Milliseconds until the earliest deadline, None if no timer is scheduled. """
+        if not self._heap:
+            return None
+        return max(0, self._heap[0]._deadline - self.now())
+
+    def _schedule(self, timer: SoftTimer) -> None:
+        self._busy = True
+        if timer._scheduled:
+            self._heap.remove(timer)
+            heapify(self._heap)
+        timer._deadline = self.now() + timer._period
+        timer._scheduled = True
+        heappush(self._heap, timer)
+        self._busy = False
+        self._resume()
+
+    def _cancel(self, timer: SoftTimer) -> None:
+        if not timer._scheduled:
+            return
+        self._busy = True
+        self._heap.remove(timer)
+        heapify(self._heap)
+        timer._scheduled = False
+        self._busy = False
+        self._resume()
+
+    def _resume(self) -> None:
+        if self._missed:
+            self._missed = False
+            self._run()
+        else:
+            self._arm()
+
+    def _arm(self) -> None:
+        if not self._heap:
+            self._armed = None
+            self._timer.deinit()
+        elif self._heap[0]._deadline != self._armed:
+            self._armed = self._heap[0]._deadline
+            self._timer.init(period=max(1, self._armed - self.now()), mode=Timer.ONE_SHOT, callback=self._run)
+
+    def _run(self, t: Optional[Timer] = None) -> None:
+        if self._busy:
+            self._missed = True  # Run when the modification is done
+            return
+        self._armed = None
+        heap = self._heap
+        now = self.now()
+        while heap and heap[0]._deadline <= now:
+            self._busy = True
+            timer = heappop(heap)
+            if timer._mode == Timer.PERIODIC:
+                timer._deadline += timer._period
+                if timer._deadline <= now:
+                    timer._deadline = now + timer._period  # Skip missed periods
+                heappush(heap, timer)
+            else:
+                timer._scheduled = False
+            self._busy = False
+            if Diagnostics.active:
+                Diagnostics.active.timer_fired()
+            timer._callback(timer)
+            now = self.now()
+        self._missed = False
+        self._arm()
+
+
+class SoftTimer:
+
+    """ A reusable timer with the init/deinit interface of machine.Timer,
+        scheduled on a TimerService rather than a hardware timer. """
+
+    __slots__ = ('_service', '_period', '_mode', '_callback', '_deadline', '_scheduled')
+
+    ONE_SHOT = Timer.ONE_SHOT
+    PERIODIC = Timer.PERIODIC
+    service = None  # The default TimerService
+
+    def __init__(self, service: Optional[TimerService] = None) -> None:
+        self._service = service or SoftTimer.service
+        self._period = 0
+        self._mode = SoftTimer.ONE_SHOT
+        self._callback = None
+        self._deadline = 0
+        self._scheduled = False
+
+    def __lt__(self, other: SoftTimer) -> bool:
+        return self._deadline < other._deadline
+
+    def init(self, period: int, mode: int = ONE_SHOT, callback: Optional[Callable] = None) -> None:
+        self._period = period
+        self._mode = mode
+        self._callback = callback
+        self._service._schedule(self)
+
+    def deinit(self) -> None:
+        self._service._cancel(self)
+
+    def active(self) -> bool:
+        return self._scheduled
+
+
+SoftTimer.service = TimerService()
@@ -0,0 +1,185 @@
+import os
+import struct
+
+
+class Trace:
+
+    """ Opt-in recording of what the zones sense and decide, for replay on
+        the host, see sim.replay. Each event is a fixed-width record of the
+        time in ms since the TimerService started, the kind, the symbol of
+        its source, an auxiliary field and a value:
+
+            SENSOR      a raw ADC reading handed to a Sensor
+            PUMP_START  a pump started for value ms, 0 until stopped
+            PUMP_STOP   a pump stopped
+            STATE       a zone watering, value 1, or draining, value 0
+            MESSAGE     an MQTT message on the topic, value being its payload
+                        as an integer, or -1 if not one within 32 bits, aux
+                        its length
+            ZONE        a zone watching the sensor in aux and the pump in value
+
+        Source names are appended to <path>.sym once, their line being the
+        symbol. Records are buffered and appended to <path>.0 from the main
+        loop once BUFFERED are pending, with room for as many more until it
+        gets to it, beyond which they are dropped. <path>.0 rotates
+        to <path>.1 and so on when holding capacity records, keeping files
+        generations. The ZONE records are repeated at the start of every
+        file, so each is replayable on its own. The hot paths only record
+        while a Trace is active. """
+
+    active = None  # The Trace the hot paths record to
+    FORMAT = '<IBBHi'
+    SIZE = struct.calcsize(FORMAT)
+    SENSOR = 0
+    PUMP_START = 1
+    PUMP_STOP = 2
+    STATE = 3
+    MESSAGE = 4
+    ZONE = 5
+    BUFFERED = 32  # Records written per file access
+    HEADROOM = 2  # Buffer size in multiples of BUFFERED
+
+    def __init__(self, path: str = 'trace', capacity: int = 4096, files: int = 2, period: int = 10_000) -> None:
+        self._path = path
+        self._capacity = capacity
+        self._files = files
+        self._period = period
+        self._buffer = bytearray(Trace.SIZE * Trace.BUFFERED * Trace.HEADROOM)
+        self._buffered = 0
+        self._dropped = 0
+        self._written = 0  # Records in the current file
+        self._file = None
+        self._symbols = {}
+        self._names = []
+        self._sources = {}  # Sensor, Pump or Irrigation -> symbol
+        self._zones = []  # The ZONE records as (zone, sensor, pump)
+        self._load()
+
+    def _load(self) -> None:
+        try:
+            with open(self._path + '.sym', 'rb') as f:
+                for line in f:
+                    self._symbols[line[:-1]] = len(self._names)
+                    self._names.append(line[:-1])
+        except OSError:
+            pass
+
+    def start(self) -> None:
+        from observable import Observable
+        from scheduler import Deferred
+        from timers import SoftTimer
+        self._now = SoftTimer.service.now
+        self._scheduler = Observable.scheduler
+        self._flush_deferred = Deferred(self.flush, self)
+        self._rotate()
+        Trace.active = self
+        self._timer = SoftTimer()
+        if self._period:
+            self._timer.init(period=self._period, mode=SoftTimer.PERIODIC, callback=self._due)
+
+    def stop(self) -> None:
+        Trace.active = None
+        self._timer.deinit()
+        self.flush()
+        self._file.close()
+
+    def dropped(self) -> int:
+        return self._dropped
+
+    def symbol(self, name) -> int:
+        if isinstance(name, str):
+            name = name.encode()
+        try:
+            return self._symbols[name]
+        except KeyError:
+            pass
+        with open(self._path + '.sym', 'ab') as f:
+            f.write(name + b'\n')
+        self._symbols[name] = len(self._names)
+        self._names.append(name)
+        return self._symbols[name]
+
+    def watch(self, zone: str, sensor: Sensor, pump: Pump, irrigation: Irrigation) -> None:
+        """ Records the events of the zone, once started. A sensor shared
+            by zones keeps the symbol of the first. """
+        if sensor not in self._sources:
+            self._sources[sensor] = self.symbol(f'{zone}/sensor')
+        self._sources[pump] = self.symbol(f'{zone}/pump')
+        self._sources[irrigation] = self.symbol(zone)
+        self._zones.append((self._sources[irrigation], self._sources[sensor], self._sources[pump]))
+        self._record(Trace.ZONE, *self._zones[-1])
+
+    def _record(self, kind: int, source: int, aux: int, value: int) -> None:
+        if self._buffered == Trace.BUFFERED * Trace.HEADROOM:
+            self._dropped += 1
+            return
+        if self._buffered == Trace.BUFFERED:
+            self._scheduler.post(self._flush_deferred)  # Write from the main loop
+        struct.pack_into(Trace.FORMAT, self._buffer, self._buffered * Trace.SIZE,
+                         self._now() & 0xFFFFFFFF, kind, source, aux, value)
+        self._buffered += 1
+
+    def sampled(self, sensor: Sensor, reading: int) -> None:
+        source = self._sources.get(sensor)
+        if source is not None:
+            self._record(Trace.SENSOR, source, 0, reading)
+
+    def pump_started(self, pump: Pump, period: int) -> None:
+        source = self._sources.get(pump)
+        if source is not None:
+            self._record(Trace.PUMP_START, source, 0, period)
+
+    def pump_stopped(self, pump: Pump) -> None:
+        source = self._sources.get(pump)
+        if source is not None:
+            self._record(Trace.PUMP_STOP, source, 0, 0)
+
+    def state(self, irrigation: Irrigation, watering: bool) -> None:
+        source = self._sources.get(irrigation)
+        if source is not None:
+            self._record(Trace.STATE, source, 0, 1 if watering else 0)
+
+    def message(self, topic: bytes, msg: bytes) -> None:
+        try:
+            value = int(msg)
+        except (ValueError, TypeError):
+            value = -1
+        if not -0x80000000 <= value <= 0x7FFFFFFF:
+            value = -1
+        source = self.symbol(topic)
+        if source <= 0xFF:  # Else too many topics to tell apart
+            self._record(Trace.MESSAGE, source, min(len(msg), 0xFFFF), value)
+
+    def _due(self, t: SoftTimer) -> None:
+        if self._buffered:
+            self._scheduler.post(self._flush_deferred)  # Write from the main loop
+
+    def flush(self, arg=None) -> None:
+        while self._buffered:
+            n = min(self._buffered, self._capacity - self._written)
+            try:
+                self._file.write(memoryview(self._buffer)[:n * Trace.SIZE])
+                self._file.flush()
+            except OSError as e:
+                print(f'Writing {self._path}.0 failed: {e}')
+            self._written += n
+            rest = self._buffered - n
+            self._buffer[:rest * Trace.SIZE] = self._buffer[n * Trace.SIZE:self._buffered * Trace.SIZE]
+            self._buffered = rest
+            if self._written == self._capacity:
+                self._rotate()
+
+    def _rotate(self) -> None:
+        if self._file:
+            self._file.close()
+        for generation in range(self._files - 1, 0, -1):
+            try:
+                os.rename(f'{self._path}.{generation - 1}', f'{self._path}.{generation}')
+            except OSError:
+                pass
+        self._file = open(self._path + '.0', 'wb')
+        record = bytearray(Trace.SIZE)
+        for zone in self._zones:  # Ahead of what is still buffered
+            struct.pack_into(Trace.FORMAT, record, 0, self._now() & 0xFFFFFFFF, Trace.ZONE, *zone)
+            self._file.write(record)
+        self._written = len(self._zones)
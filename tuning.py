@@ -0,0 +1,22 @@
+TUNABLE = ('min_humidity', 'max_humidity', 'sensor_cooldown_period_watering', 'sensor_cooldown_period_draining',
+           'pump_duration', 'pump_cap_time')
+
+
+def tune(settings: dict, delta: dict) -> dict:
+    """ The TUNABLE settings of a zone with a delta of them applied, the
+        humidities as floats and the rest as ints. Raises ValueError,
+        KeyError, TypeError or AttributeError if the delta has other keys
+        or the result is invalid. Shared by Irrigation and Zones, and used
+        for what is received on <zone>/config as well as what was saved. """
+    unknown = [key for key in delta if key not in TUNABLE]
+    if unknown:
+        raise ValueError('Not tunable: ' + ', '.join(unknown))
+    tuned = dict(settings)
+    tuned.update(delta)
+    for key in TUNABLE:
+        tuned[key] = float(tuned[key]) if key.endswith('humidity') else int(tuned[key])
+        if tuned[key] < 0:
+            raise ValueError(f'Negative {key}')
+    if not tuned['min_humidity'] < tuned['max_humidity']:
+        raise ValueError('min_humidity is not below max_humidity')
+    return tuned
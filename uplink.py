@@ -0,0 +1,137 @@
+import utime
+from diag import Diagnostics
+from observable import Observable
+from scheduler import Deferred
+from timers import SoftTimer
+
+
+class Uplink:
+
+    """ Store-and-forward wrapper of an MQTTClient with the same publish,
+        subscribe, set_callback and check_msg interface. Values may be
+        published unformatted and are only formatted when sent. While
+        disconnected they are appended to a TelemetryLog instead, which is
+        replayed in bulk once connected again. Replayed values are published
+        on <topic>/replay as '<age> <value>', the age in milliseconds since
+        they were logged or -1 if logged before a restart. Until the log is
+        drained, new values are appended to it too, so that they are not
+        published ahead of older ones. Unless retry_period is 0,
+        reconnection is attempted periodically from the main loop. The
+        keepalive is maintained by pinging when nothing has been sent for
+        half of it. """
+
+    REPLAY_BATCH = 64  # Records replayed per pass of the main loop
+
+    def __init__(self,
+                 client: Optional[MQTTClient],
+                 wlan: Optional[WLAN] = None,
+                 log: Optional[TelemetryLog] = None,
+                 retry_period: int = 30_000) -> None:
+        self._client = client
+        self._wlan = wlan
+        self._log = log
+        self._connected = False
+        self._keepalive = 500 * getattr(client, 'keepalive', 0)  # Half of it in milliseconds
+        self._last_sent = utime.ticks_ms()
+        self._subscriptions = []
+        self._connect_deferred = Deferred(self.connect, self)
+        self._replay_deferred = Deferred(self._replay, self)
+        self._timer = SoftTimer()
+        if client and retry_period:
+            self._timer.init(period=retry_period, mode=SoftTimer.PERIODIC, callback=self._due)
+
+    def isconnected(self) -> bool:
+        return self._connected
+
+    def connect(self, arg=None) -> int:
+        if self._connected or not self._client:
+            return 0
+        if self._wlan and not self._wlan.isconnected():
+            return -1
+        try:
+            status = self._client.connect()
+            for topic in self._subscriptions:
+                self._client.subscribe(topic)
+        except OSError as e:
+            print(f'MQTT connection failed: {e}')
+            return -1
+        self._connected = status == 0
+        self._last_sent = utime.ticks_ms()
+        if self._connected and self._log is not None and len(self._log):
+            Observable.scheduler.post(self._replay_deferred)
+        return status
+
+    def _due(self, t: SoftTimer) -> None:
+        if not self._connected:
+            Observable.scheduler.post(self._connect_deferred)
+
+    def _disconnected(self, e: Exception) -> None:
+        print(f'MQTT connection lost: {e}')
+        self._connected = False
+        try:
+            self._client.disconnect()
+        except OSError:
+            pass
+
+    def _replay(self, arg=None) -> None:
+        try:
+            self._log.replay(self._send, Uplink.REPLAY_BATCH)
+        except OSError as e:
+            self._disconnected(e)
+            return
+        if len(self._log):
+            Observable.scheduler.post(self._replay_deferred)
+
+    def _send(self, topic: bytes, msg, ticks: Optional[int]) -> None:
+        age = -1 if ticks is None else utime.ticks_diff(utime.ticks_ms(), ticks)
+        if isinstance(msg, bytes):
+            msg = msg.decode()
+        self._client.publish(topic + b'/replay', f'{age} {msg}')
+        self._last_sent = utime.ticks_ms()
+
+    def publish(self, topic, msg, retain: bool = False, qos: int = 0) -> None:
+        replaying = self._log is not None and len(self._log) and not isinstance(msg, (bytes, bytearray))
+        if self._connected and not replaying:
+            payload = msg if isinstance(msg, (str, bytes, bytearray)) else str(msg)
+            try:
+                start = utime.ticks_us()
+                self._client.publish(topic, payload, retain=retain, qos=qos)
+                if Diagnostics.active:
+                    Diagnostics.active.published(utime.ticks_diff(utime.ticks_us(), start))
+                self._last_sent = utime.ticks_ms()
+                return
+            except OSError as e:
+                self._disconnected(e)
+        if self._log is not None and not isinstance(msg, (bytes, bytearray)):
+            self._log.append(topic, msg)
+
+    def set_callback(self, callback: Callable) -> None:
+        if self._client:
+            self._client.set_callback(callback)
+
+    def subscribe(self, topic: bytes) -> None:
+        if topic not in self._subscriptions:
+            self._subscriptions.append(topic)
+        if self._connected:
+            self._client.subscribe(topic)
+
+    def check_msg(self) -> None:
+        if self._connected:
+            try:
+                self._client.check_msg()
+            except OSError as e:
+                self._disconnected(e)
+
+    def next_ping(self) -> Optional[int]:
+        """ Milliseconds until a ping is due, None if not connected. """
+        if not self._connected or not self._keepalive:
+            return None
+        return max(0, self._keepalive - utime.ticks_diff(utime.ticks_ms(), self._last_sent))
+
+    def ping(self) -> None:
+        if self._connected:
+            try:
+                self._client.ping()
+                self._last_sent = utime.ticks_ms()
+            except OSError as e:
+                self._disconnected(e)
@@ -0,0 +1,447 @@
+import json
+import os
+import struct
+import utime
+from array import array
+from observable import Observable
+from scheduler import Deferred
+from timers import SoftTimer
+from tuning import tune
+
+try:
+    import numpy as np  # On CPython, e.g. a gateway, a tick is a handful of array operations
+except ImportError:
+    np = None
+
+
+class Zones:
+
+    """ Irrigation of many zones with the state of all of them in parallel
+        arrays rather than in a graph of Observables per zone. Each tick
+        reads the sensors, then decides for every zone at once, with the
+        semantics of Irrigation without dosing: draining until the humidity
+        is at or below min_humidity, then watering, starting a burst of
+        pump_duration at every tick at or below max_humidity unless the
+        pump is running or the pump time within the sliding window of the
+        Cap has reached pump_cap_time, until the humidity is at or above
+        max_humidity. At most max_running pumps run at once, 0 for any
+        number, taking turns between zones. The timers post the ticks, the
+        stops of the pumps and the rotation of the Cap windows to the
+        Scheduler, so that all of it runs from the main loop.
+
+        The values are published on the topics of Irrigation: the humidity
+        on <zone>/Moisture(<zone>) once per sensor cooldown period of the
+        state, the pump time on <zone>/Sum(Pump) and the state on
+        <zone>/<zone>. command and configure are Receiver callbacks for
+        <zone>/Pump and <zone>/config, with the versioned deltas of
+        Irrigation.configure, acknowledged on <zone>/config/applied. A
+        commanded run takes its turn with the automatic starts at the next
+        tick, as with a PumpScheduler, and is dropped if the pump is running.
+
+        Under CPython with numpy, the decisions are array operations over
+        all zones, and only the zones that start, stop or publish are
+        visited. On MicroPython, or unless vectorized, the arrays are of
+        the array module and a tick is one loop over the zones. Time is
+        kept as the ms remaining per zone, decremented by the time elapsed,
+        so that ticks_ms wrapping around does not matter. """
+
+    def __init__(self,
+                 names: list,
+                 sensors: list,
+                 relays: list,
+                 mqtt_client: Optional[Uplink] = None,
+                 min_humidity: float = 20.0,
+                 max_humidity: float = 60.0,
+                 sensor_cooldown_period_watering: int = 10_000,
+                 sensor_cooldown_period_draining: int = 60_000,
+                 pump_duration: int = 2_000,
+                 pump_cap_time: int = 100_000,
+                 pump_cap_window: int = 24 * 60 * 60 * 1_000,
+                 buckets: int = 24,
+                 max_running: int = 0,
+                 period: int = 1_000,
+                 sampler: Optional[Sampler] = None,
+                 path: Optional[str] = None,
+                 echo: bool = True,
+                 vectorized: bool = True) -> None:
+        n = len(names)
+        self._np = np if vectorized else None  # numpy, if used
+        self._names = names
+        self._zones = {name.encode(): i for i, name in enumerate(names)}
+        self._topics = [(f'{name}/Moisture({name})'.encode(), f'{name}/Sum(Pump)'.encode(), f'{name}/{name}'.encode())
+                        for name in names]
+        self._sensors = []
+        self._sensor_index = array('H', [0] * n)  # Zones may share a sensor
+        for i, sensor in enumerate(sensors):
+            if sensor not in self._sensors:
+                self._sensors.append(sensor)
+            self._sensor_index[i] = self._sensors.index(sensor)
+        if self._np:
+            self._sensor_index = self._np.array(self._sensor_index, dtype=self._np.intp)
+        self._relays = relays
+        self._client = mqtt_client
+        self._echo = echo
+        self._sampler = sampler
+        self._max_running = max_running
+        self._turn = 0  # The zone to consider first when the pumps are limited
+        self._buckets = buckets
+        self._current = 0
+        self._path = path
+        self._last = utime.ticks_ms()
+        self._invalid = 0
+        self._cap_changed = False
+
+        # The settings per zone
+        self._min = self._floats(n, min_humidity)
+        self._max = self._floats(n, max_humidity)
+        self._cooldown = (self._ints(n, sensor_cooldown_period_draining), self._ints(n, sensor_cooldown_period_watering))
+        self._duration = self._ints(n, pump_duration)
+        self._cap = self._ints(n, pump_cap_time)
+        self._version = self._ints(n, 0)
+
+        # The state per zone
+        self._humidity = self._floats(n, float('nan'))
+        self._watering = self._ints(n, 0)
+        self._remaining = self._ints(n, 0)  # ms left of the running pump
+        self._requested = self._ints(n, 0)  # ms of the commanded run waiting for its turn
+        self._quiet = self._ints(n, 0)  # ms left of the sensor cooldown
+        self._sum = self._ints(n, 0)  # Pump time, as Sum(Pump)
+        self._total = self._ints(n, 0)  # Pump time within the window of the Cap
+        self._ring = self._ints(n * buckets, 0)  # Per zone, the pump time in each bucket of the window
+        self._load()
+
+        self._tick_deferred = Deferred(self.tick, self)
+        self._stop_deferred = Deferred(self._stopped, self)
+        self._rotate_deferred = Deferred(self._rotate, self)
+        self._stop_timer = SoftTimer()
+        self._rotate_timer = SoftTimer()
+        self._rotate_timer.init(period=pump_cap_window // buckets, mode=SoftTimer.PERIODIC, callback=self._rotate_due)
+        self._tick_timer = SoftTimer()
+        if period:
+            self._tick_timer.init(period=period, mode=SoftTimer.PERIODIC, callback=self._tick_due)
+        for i in range(n):
+            relays[i].on()  # Relay module operates this way.
+
+    def _floats(self, n: int, value: float):
+        np = self._np
+        return np.full(n, value, dtype=np.float32) if np else array('f', [value] * n)
+
+    def _ints(self, n: int, value: int):
+        np = self._np
+        return np.full(n, value, dtype=np.int32) if np else array('i', [value] * n)
+
+    def __len__(self) -> int:
+        return len(self._names)
+
+    def name(self, i: int) -> str:
+        return self._names[i]
+
+    def state(self, i: int) -> str:
+        return 'Watering' if self._watering[i] else 'Draining'
+
+    def humidity(self, i: int) -> float:
+        return float(self._humidity[i])
+
+    def pump_time(self, i: int) -> int:
+        """ The pump time of the zone since start, as Sum(Pump). """
+        return int(self._sum[i])
+
+    def running(self, i: int) -> bool:
+        return self._remaining[i] > 0
+
+    def start(self) -> None:
+        """ Starts all zones in the draining state. """
+        for i in range(len(self._names)):
+            self._publish(self._topics[i][2], 'Draining')
+
+    def invalid(self) -> int:
+        """ The number of commands rejected as invalid. """
+        return self._invalid
+
+    def _tick_due(self, t: SoftTimer) -> None:
+        Observable.scheduler.post(self._tick_deferred)
+
+    def _stop_due(self, t: SoftTimer) -> None:
+        Observable.scheduler.post(self._stop_deferred)
+
+    def _rotate_due(self, t: SoftTimer) -> None:
+        Observable.scheduler.post(self._rotate_deferred)
+
+    def tick(self, arg=None) -> None:
+        """ Reads the sensors and decides for all zones. """
+        np = self._np
+        self._elapse()
+        if np:
+            self._requested[self._remaining > 0] = 0
+        else:
+            for i in range(len(self._requested)):
+                if self._remaining[i] > 0:
+                    self._requested[i] = 0  # As PumpScheduler drops a request for a running pump
+        if self._sampler:
+            self._sampler.sample()
+        if np:
+            values = np.array([sensor.value for sensor in self._sensors], dtype=np.float32)  # None is nan
+            self._humidity[:] = values[self._sensor_index]  # Decides nothing until sampled
+            self._decide_arrays()
+        else:
+            sensors, index, humidity = self._sensors, self._sensor_index, self._humidity
+            for i in range(len(index)):
+                value = sensors[index[i]].value
+                humidity[i] = value if value is not None else float('nan')  # Decides nothing until sampled
+            self._decide_loop()
+        self._arm()
+        if self._cap_changed:
+            self._save_cap()
+
+    def _decide_arrays(self) -> None:
+        np = self._np
+        humidity, watering = self._humidity, self._watering.astype(bool)
+        automatic = watering & (humidity <= self._max) & (self._total < self._cap)
+        due = (automatic | (self._requested > 0)) & (self._remaining <= 0)
+        stopped = watering & (humidity >= self._max)
+        started = ~watering & (humidity <= self._min)
+        for i in self._take_turns(np.flatnonzero(due)):
+            self._start(i, int(self._requested[i] or self._duration[i]))
+        for i in np.flatnonzero(stopped | started):
+            self._switch(i, not watering[i])
+        for i in np.flatnonzero((self._quiet <= 0) & ~np.isnan(humidity)):
+            self._publish_humidity(i)
+
+    def _decide_loop(self) -> None:
+        humidity, watering, remaining, quiet = self._humidity, self._watering, self._remaining, self._quiet
+        maximum, minimum, total, cap, requested = self._max, self._min, self._total, self._cap, self._requested
+        due = []
+        for i in range(len(watering)):
+            value = humidity[i]
+            if requested[i] > 0 and remaining[i] <= 0:
+                due.append(i)
+            if value != value:  # Not sampled yet
+                continue
+            if watering[i]:
+                if value <= maximum[i] and remaining[i] <= 0 and total[i] < cap[i] and not requested[i]:
+                    due.append(i)
+                if value >= maximum[i]:
+                    self._switch(i, False)
+            elif value <= minimum[i]:
+                self._switch(i, True)
+            if quiet[i] <= 0:
+                self._publish_humidity(i)
+        for i in self._take_turns(due):
+            self._start(i, self._requested[i] or self._duration[i])
+
+    def _take_turns(self, due) -> list:
+        """ The zones due to start that may, within max_running. """
+        np = self._np
+        if not self._max_running or not len(due):
+            return due
+        running = np.count_nonzero(self._remaining > 0) if np else sum(1 for r in self._remaining if r > 0)
+        free = self._max_running - running
+        if free <= 0:
+            return []
+        due = sorted(due, key=lambda i: (i - self._turn) % len(self._names))
+        self._turn = (due[min(free, len(due)) - 1] + 1) % len(self._names)
+        return due[:free]
+
+    def _switch(self, i: int, watering: bool) -> None:
+        self._watering[i] = int(watering)
+        self._quiet[i] = 0  # The sensor publisher of the new state is not cooling down
+        self._publish(self._topics[i][2], 'Watering' if watering else 'Draining')
+
+    def _publish_humidity(self, i: int) -> None:
+        self._quiet[i] = self._cooldown[self._watering[i]][i]
+        value = self._humidity[i]
+        self._publish(self._topics[i][0], int(value) if value == int(value) else float(value))
+
+    def _start(self, i: int, period: int) -> None:
+        if period <= 0 or self._remaining[i] > 0:
+            return
+        self._relays[i].off()  # Relay module operates this way.
+        self._requested[i] = 0
+        self._remaining[i] = period
+        self._sum[i] += period
+        self._total[i] += period
+        self._ring[i * self._buckets + self._current] += period
+        self._publish(self._topics[i][1], int(self._sum[i]))
+        self._cap_changed = True  # Saved once per tick rather than per start
+
+    def _elapse(self) -> None:
+        """ Counts down the time since the last tick or stop, stopping the pumps that are due. """
+        np = self._np
+        now = utime.ticks_ms()
+        elapsed = utime.ticks_diff(now, self._last)
+        self._last = now
+        if elapsed <= 0:
+            return
+        remaining, relays = self._remaining, self._relays
+        if np:
+            running = remaining > 0
+            remaining -= elapsed * running
+            self._quiet -= elapsed
+            np.maximum(self._quiet, -1, out=self._quiet)  # Never wraps around
+            for i in np.flatnonzero(running & (remaining <= 0)):
+                relays[i].on()  # Relay module operates this way.
+            return
+        quiet = self._quiet
+        for i in range(len(remaining)):
+            if quiet[i] > 0:
+                quiet[i] -= elapsed
+            if remaining[i] > 0:
+                remaining[i] -= elapsed
+                if remaining[i] <= 0:
+                    relays[i].on()  # Relay module operates this way.
+
+    def _arm(self) -> None:
+        """ Sets the stop timer to the pump that is due first. """
+        np = self._np
+        if np:
+            running = self._remaining[self._remaining > 0]
+            first = int(running.min()) if len(running) else 0
+        else:
+            first = 0
+            for r in self._remaining:
+                if r > 0 and (not first or r < first):
+                    first = r
+        if first:
+            self._stop_timer.init(period=first, mode=SoftTimer.ONE_SHOT, callback=self._stop_due)
+        else:
+            self._stop_timer.deinit()
+
+    def _stopped(self, arg=None) -> None:
+        self._elapse()
+        self._arm()
+
+    def _rotate(self, arg=None) -> None:
+        np = self._np
+        self._current = (self._current + 1) % self._buckets
+        if np:
+            ring = self._ring.reshape(-1, self._buckets)
+            self._total -= ring[:, self._current]
+            ring[:, self._current] = 0
+        else:
+            for i in range(len(self._total)):
+                k = i * self._buckets + self._current
+                self._total[i] -= self._ring[k]
+                self._ring[k] = 0
+        self._save_cap()
+
+    def _publish(self, topic: bytes, value) -> None:
+        if self._client:
+            self._client.publish(topic, value)
+        if self._echo:
+            print(topic.decode(), value)
+
+    def command(self, topic: bytes, msg: bytes) -> None:
+        """ A Receiver callback for <zone>/Pump, requesting a run of the pump of the zone for the ms given. """
+        i = self._zones.get(topic.split(b'/')[0])
+        if i is None:
+            return
+        try:
+            period = int(msg.decode('utf-8'))
+        except (ValueError, UnicodeError):
+            period = 0
+        if period <= 0:  # A period of 0 would not stop
+            print(f'Invalid command: {topic} {msg}')
+            self._invalid += 1
+            return
+        self._requested[i] = max(self._requested[i], period)  # Coalesced while waiting, as PumpScheduler
+        Observable.scheduler.post(self._tick_deferred)
+
+    def configure(self, topic: bytes, msg: bytes) -> None:
+        """ A Receiver callback for <zone>/config, see Irrigation.configure. """
+        zone = topic.split(b'/')[0]
+        i = self._zones.get(zone)
+        if i is None:
+            return
+        try:
+            delta = json.loads(msg)
+            version = int(delta.pop('version'))
+            if version <= self._version[i]:
+                raise ValueError(f'Version {version} is not above {self._version[i]}')
+            settings = tune(self.settings(i), delta)
+        except (ValueError, KeyError, TypeError, AttributeError) as e:
+            self._publish(zone + b'/config/applied', json.dumps({'error': f'Invalid config: {e}'}).encode())
+            return
+        self._apply(i, settings, version)  # Between ticks, as callbacks are not run within one
+        self._save_settings()
+        settings['version'] = version
+        self._publish(zone + b'/config/applied', json.dumps(settings).encode())  # As bytes, not logged for replay
+
+    def settings(self, i: int) -> dict:
+        """ The current values of the TUNABLE settings of the zone. """
+        return {'min_humidity': float(self._min[i]), 'max_humidity': float(self._max[i]),
+                'sensor_cooldown_period_watering': int(self._cooldown[1][i]),
+                'sensor_cooldown_period_draining': int(self._cooldown[0][i]),
+                'pump_duration': int(self._duration[i]), 'pump_cap_time': int(self._cap[i])}
+
+    def _apply(self, i: int, settings: dict, version: int) -> None:
+        self._min[i] = settings['min_humidity']
+        self._max[i] = settings['max_humidity']
+        self._cooldown[1][i] = settings['sensor_cooldown_period_watering']
+        self._cooldown[0][i] = settings['sensor_cooldown_period_draining']
+        self._duration[i] = settings['pump_duration']
+        self._cap[i] = settings['pump_cap_time']
+        self._version[i] = version
+
+    def _load(self) -> None:
+        """ Loads the settings of <path>.cfg and the Cap windows of <path>.cap. """
+        np = self._np
+        if not self._path:
+            return
+        try:
+            with open(self._path + '.cfg') as f:
+                saved = json.load(f)
+            for name, settings in saved.items():
+                i = self._zones.get(name.encode())
+                if i is None:
+                    continue
+                try:  # Validated as if received, else the defaults are kept
+                    version = int(settings.pop('version', 0))
+                    self._apply(i, tune(self.settings(i), settings), version)
+                except (ValueError, KeyError, TypeError, AttributeError) as e:
+                    print(f'Invalid settings of {name} in {self._path}.cfg, keeping the defaults: {e}')
+        except OSError:
+            pass
+        except (ValueError, AttributeError) as e:
+            print(f'Loading {self._path}.cfg failed: {e}')
+        try:
+            with open(self._path + '.cap', 'rb') as f:
+                header = f.read(6)
+                if len(header) == 6 and struct.unpack('<HHH', header)[:2] == (len(self._names), self._buckets):
+                    data = f.read()
+                    ring = np.frombuffer(data, dtype='<i4') if np else array('i', data)
+                    if len(ring) == len(self._ring):
+                        self._current = struct.unpack('<HHH', header)[2] % self._buckets
+                        for k in range(len(ring)):
+                            self._ring[k] = ring[k]
+                            self._total[k // self._buckets] += ring[k]
+        except OSError:
+            pass
+
+    def _save_cap(self) -> None:
+        """ Saves the Cap windows to a new file renamed over the old one. """
+        np = self._np
+        self._cap_changed = False
+        if not self._path:
+            return
+        try:
+            with open(self._path + '.cap.new', 'wb') as f:
+                f.write(struct.pack('<HHH', len(self._names), self._buckets, self._current))
+                f.write(self._ring.astype('<i4').tobytes() if np else self._ring)
+            os.rename(self._path + '.cap.new', self._path + '.cap')
+        except OSError as e:
+            print(f'Saving {self._path}.cap failed: {e}')
+
+    def _save_settings(self) -> None:
+        """ Saves the settings and their versions to a new file renamed over the old one. """
+        if not self._path:
+            return
+        settings = {}
+        for i, name in enumerate(self._names):
+            settings[name] = self.settings(i)
+            settings[name]['version'] = int(self._version[i])
+        try:
+            with open(self._path + '.cfg.new', 'w') as f:
+                json.dump(settings, f)
+            os.rename(self._path + '.cfg.new', self._path + '.cfg')
+        except OSError as e:
+            print(f'Saving {self._path}.cfg failed: {e}')